@@ -21,6 +21,23 @@ class PreloadModelData(BaseModel):
 
 class MaxBatchSize(BaseModel):
     facial_recognition: int | None = None
+    face_detection: int | None = None
+    clip_visual: int | None = None
+    clip_textual: int | None = None
+
+
+class BatchWindow(BaseModel):
+    facial_recognition: float | None = None
+    face_detection: float | None = None
+    clip_visual: float | None = None
+    clip_textual: float | None = None
+
+
+class ModelTTL(BaseModel):
+    facial_recognition: int | None = None
+    face_detection: int | None = None
+    clip_visual: int | None = None
+    clip_textual: int | None = None
 
 
 class Settings(BaseSettings):
@@ -32,20 +49,34 @@ class Settings(BaseSettings):
     )
 
     cache_folder: Path = Path("/cache")
+    model_mirror: str | None = None
+    model_download_workers: int = 8
     model_ttl: int = 300
     model_ttl_poll_s: int = 10
+    model_ttl_override: ModelTTL | None = None
+    model_memory_budget_mb: int = 0
+    model_cache_profiling: bool = False
     host: str = "0.0.0.0"
     port: int = 3003
     workers: int = 1
     test_full: bool = False
     request_threads: int = os.cpu_count() or 4
+    preprocess_workers: int = 0
     model_inter_op_threads: int = 0
     model_intra_op_threads: int = 0
+    model_warmup: bool = False
+    cache_optimized_models: bool = True
+    mmap_model_weights: bool = False
     ann: bool = True
+    quantized_models: bool = False
+    trim_text_padding: bool = False
     ann_fp16_turbo: bool = False
     ann_tuning_level: int = 2
     preload: PreloadModelData | None = None
+    share_preloaded_models: bool = False
+    pin_preloaded_models: bool = False
     max_batch_size: MaxBatchSize | None = None
+    batch_window_ms: BatchWindow | None = None
 
     @property
     def device_id(self) -> str:
@@ -1,4 +1,6 @@
 import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from typing import Any, Iterator
 from unittest import mock
 
@@ -11,6 +13,8 @@ from PIL import Image
 from app.config import log
 
 from .main import app
+from .models.base import InferenceModel
+from .schemas import ModelTask, ModelType
 
 
 @pytest.fixture
@@ -26,9 +30,22 @@ def cv_image(pil_image: Image.Image) -> NDArray[np.float32]:
 @pytest.fixture
 def mock_get_model() -> Iterator[mock.Mock]:
     with mock.patch("app.models.cache.from_model_type", autospec=True) as mocked:
+        mocked.return_value.ttl = 0
         yield mocked
 
 
+@pytest.fixture
+def mock_cached_model() -> Iterator[mock.Mock]:
+    model = mock.Mock(spec=InferenceModel)
+    model.depends = []
+    model.identity = (ModelType.VISUAL, ModelTask.SEARCH)
+    model.loaded = True
+    model.min_image_size.return_value = None
+    model.preprocess_transform = None
+    with mock.patch("app.main.model_cache.get", new_callable=mock.AsyncMock, return_value=model):
+        yield model
+
+
 @pytest.fixture(scope="session")
 def deployed_app() -> Iterator[TestClient]:
     with TestClient(app) as client:
@@ -152,7 +169,8 @@ def path() -> Iterator[mock.Mock]:
     path.with_suffix.return_value = path
     path.return_value = path
 
-    with mock.patch("app.models.base.Path", return_value=path) as mocked:
+    # a lock taken on a mocked model path would otherwise be created in the working directory
+    with mock.patch("app.models.base.Path", return_value=path) as mocked, mock.patch("app.models.base.FileLock"):
         yield mocked
 
 
@@ -175,6 +193,44 @@ def exception() -> Iterator[mock.Mock]:
 
 
 @pytest.fixture(scope="function")
-def snapshot_download() -> Iterator[mock.Mock]:
-    with mock.patch("app.models.base.snapshot_download") as mocked:
+def download_model() -> Iterator[mock.Mock]:
+    with mock.patch("app.models.base.download_model") as mocked:
         yield mocked
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    """Serves `server.files` by path, supporting single byte ranges, and records the requests it gets."""
+
+    server: Any
+
+    def do_GET(self) -> None:
+        self.server.requests.append((self.path, self.headers.get("Range")))
+        content: bytes | None = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+
+        status, start = 200, 0
+        if (range_header := self.headers.get("Range")) is not None and self.server.ranges:
+            status, start = 206, int(range_header.removeprefix("bytes=").split("-")[0])
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(content) - start))
+        self.end_headers()
+        self.wfile.write(content[start:])
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def mirror_server() -> Iterator[Any]:
+    server: Any = ThreadingHTTPServer(("127.0.0.1", 0), MirrorHandler)
+    server.files = {}
+    server.requests = []
+    server.ranges = True
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
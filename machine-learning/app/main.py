@@ -1,30 +1,31 @@
 import asyncio
 import gc
-import os
-import signal
-import threading
-import time
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from functools import partial
-from typing import Any, AsyncGenerator, Callable, Iterator
+from io import BytesIO
+from multiprocessing import get_context
+from typing import Any, AsyncGenerator, Callable
 from zipfile import BadZipFile
 
 import orjson
-from fastapi import Depends, FastAPI, File, Form, HTTPException
+import PIL.Image
+from fastapi import Depends, FastAPI, File, Form, Header, HTTPException
 from fastapi.responses import ORJSONResponse, PlainTextResponse
 from onnxruntime.capi.onnxruntime_pybind11_state import InvalidProtobuf, NoSuchFile
-from PIL.Image import Image
 from pydantic import ValidationError
 from starlette.formparsers import MultiPartParser
 
 from app.models import get_model_deps
 from app.models.base import InferenceModel
-from app.models.transforms import decode_pil
+from app.models.preprocessing import attach, preprocess
+from app.models.transforms import DecodedImage, decode_pil, decode_rgb_buffer, validate_embedding_dimension
 
 from .config import PreloadModelData, log, settings
 from .models.cache import ModelCache
+from .responses import PackedResponse, accepts_packed
 from .schemas import (
+    EmbeddingDtype,
     InferenceEntries,
     InferenceEntry,
     InferenceResponse,
@@ -38,16 +39,21 @@ from .schemas import (
 
 MultiPartParser.max_file_size = 2**26  # spools to disk if payload is 64 MiB or larger
 
-model_cache = ModelCache(revalidate=settings.model_ttl > 0)
+model_cache = ModelCache(
+    revalidate=True,
+    profiling=settings.model_cache_profiling,
+    memory_budget=settings.model_memory_budget_mb * 2**20 if settings.model_memory_budget_mb > 0 else None,
+)
 thread_pool: ThreadPoolExecutor | None = None
-lock = threading.Lock()
-active_requests = 0
-last_called: float | None = None
+preprocess_pool: ProcessPoolExecutor | None = None
+load_pool: ThreadPoolExecutor | None = None
+loading: dict[InferenceModel, asyncio.Future[InferenceModel]] = {}
+LOAD_RETRY_AFTER_S = 5
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI) -> AsyncGenerator[None, None]:
-    global thread_pool
+    global thread_pool, preprocess_pool, load_pool
     log.info(
         (
             "Created in-memory cache with unloading "
@@ -60,45 +66,48 @@ async def lifespan(_: FastAPI) -> AsyncGenerator[None, None]:
             # asyncio is a huge bottleneck for performance, so we use a thread pool to run blocking code
             thread_pool = ThreadPoolExecutor(settings.request_threads) if settings.request_threads > 0 else None
             log.info(f"Initialized request thread pool with {settings.request_threads} threads.")
-        if settings.model_ttl > 0 and settings.model_ttl_poll_s > 0:
-            asyncio.ensure_future(idle_shutdown_task())
+        # separate from the request thread pool so that loading models doesn't hold up requests for loaded ones
+        load_pool = ThreadPoolExecutor(thread_name_prefix="load")
+        if settings.preprocess_workers > 0:
+            # spawned rather than forked, since forking a process with running inference threads is unsafe
+            preprocess_pool = ProcessPoolExecutor(settings.preprocess_workers, mp_context=get_context("spawn"))
+            log.info(f"Initialized preprocessing process pool with {settings.preprocess_workers} processes.")
+        if settings.model_ttl_poll_s > 0:
+            asyncio.ensure_future(idle_unload_task())
         if settings.preload is not None:
             await preload_models(settings.preload)
         yield
     finally:
         log.handlers.clear()
-        for model in model_cache.cache._cache.values():
+        for model in model_cache.cache.values():
             del model
         if thread_pool is not None:
             thread_pool.shutdown()
+        if preprocess_pool is not None:
+            preprocess_pool.shutdown()
+        if load_pool is not None:
+            load_pool.shutdown()
         gc.collect()
 
 
-async def preload_models(preload: PreloadModelData) -> None:
+async def preload_models(preload: PreloadModelData, **model_kwargs: Any) -> None:
     log.info(f"Preloading models: {preload}")
     if preload.clip is not None:
-        model = await model_cache.get(preload.clip, ModelType.TEXTUAL, ModelTask.SEARCH)
-        await load(model)
-
-        model = await model_cache.get(preload.clip, ModelType.VISUAL, ModelTask.SEARCH)
-        await load(model)
+        await load_preloaded(preload.clip, ModelType.TEXTUAL, ModelTask.SEARCH, **model_kwargs)
+        await load_preloaded(preload.clip, ModelType.VISUAL, ModelTask.SEARCH, **model_kwargs)
 
     if preload.facial_recognition is not None:
-        model = await model_cache.get(preload.facial_recognition, ModelType.DETECTION, ModelTask.FACIAL_RECOGNITION)
-        await load(model)
-
-        model = await model_cache.get(preload.facial_recognition, ModelType.RECOGNITION, ModelTask.FACIAL_RECOGNITION)
-        await load(model)
+        face_task = ModelTask.FACIAL_RECOGNITION
+        await load_preloaded(preload.facial_recognition, ModelType.DETECTION, face_task, **model_kwargs)
+        await load_preloaded(preload.facial_recognition, ModelType.RECOGNITION, face_task, **model_kwargs)
 
 
-def update_state() -> Iterator[None]:
-    global active_requests, last_called
-    active_requests += 1
-    last_called = time.time()
-    try:
-        yield
-    finally:
-        active_requests -= 1
+async def load_preloaded(model_name: str, model_type: ModelType, model_task: ModelTask, **model_kwargs: Any) -> None:
+    model = await model_cache.get(model_name, model_type, model_task, **model_kwargs)
+    # shared models must stay loaded, since a worker reloading one would have its own copy of the weights
+    if settings.pin_preloaded_models or settings.share_preloaded_models:
+        model_cache.pin(model)
+    await load(model)
 
 
 def get_entries(entries: str = Form()) -> InferenceEntries:
@@ -114,6 +123,7 @@ def get_entries(entries: str = Form()) -> InferenceEntries:
                     "type": type,
                     "options": entry.get("options", {}),
                 }
+                validate_options(parsed["name"], parsed["options"])
                 dep = get_model_deps(parsed["name"], type, task)
                 (with_deps if dep else without_deps).append(parsed)
         return without_deps, with_deps
@@ -122,6 +132,18 @@ def get_entries(entries: str = Form()) -> InferenceEntries:
         raise HTTPException(422, "Invalid request format.")
 
 
+def validate_options(model_name: str, options: dict[str, Any]) -> None:
+    """Rejects options that would otherwise only fail once the model has run."""
+
+    try:
+        if (dtype := options.get("embeddingDtype")) is not None:
+            EmbeddingDtype(dtype)
+        if (dimension := options.get("embeddingDimension")) is not None:
+            validate_embedding_dimension(model_name, dimension)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+
+
 app = FastAPI(lifespan=lifespan)
 
 
@@ -135,28 +157,102 @@ def ping() -> PlainTextResponse:
     return PlainTextResponse("pong")
 
 
-@app.post("/predict", dependencies=[Depends(update_state)])
+@app.get("/profiling")
+async def profiling() -> ORJSONResponse:
+    metrics = await model_cache.get_profiling()
+    if metrics is None:
+        raise HTTPException(404, "Model cache profiling is disabled")
+    return ORJSONResponse(metrics)
+
+
+def get_load_wait(prefer: str | None = Header(default=None)) -> float | None:
+    """
+    Parses the `wait` preference of RFC 7240, the seconds to wait for models that are still loading before
+    responding with a 503. Waits until they're loaded if not set.
+    """
+
+    for preference in (prefer or "").split(","):
+        name, _, value = preference.strip().partition("=")
+        if name.strip().lower() == "wait":
+            try:
+                return max(float(value.strip().strip('"')), 0.0)
+            except ValueError:
+                raise HTTPException(400, f"Invalid wait preference: {value}")
+    return None
+
+
+@app.post("/predict")
 async def predict(
     entries: InferenceEntries = Depends(get_entries),
+    wait: float | None = Depends(get_load_wait),
     image: bytes | None = File(default=None),
     text: str | None = Form(default=None),
+    pixels: bytes | None = File(default=None),
+    width: int | None = Form(default=None),
+    height: int | None = Form(default=None),
+    accept: str | None = Header(default=None),
 ) -> Any:
     if image is not None:
-        inputs: Image | str = await run(lambda: decode_pil(image))
+        inputs: DecodedImage | str = await decode_image(image, await load_models(entries, wait))
     elif text is not None:
         inputs = text
+    elif pixels is not None:
+        if width is None or height is None:
+            raise HTTPException(400, "Width and height must be provided with pixels")
+        try:
+            inputs = DecodedImage(decode_rgb_buffer(pixels, width, height))
+        except ValueError as e:
+            raise HTTPException(400, str(e))
     else:
-        raise HTTPException(400, "Either image or text must be provided")
-    response = await run_inference(inputs, entries)
-    return ORJSONResponse(response)
+        raise HTTPException(400, "Either image, text or pixels must be provided")
+    try:
+        response = await run_inference(inputs, entries, wait)
+    finally:
+        if isinstance(inputs, DecodedImage):
+            inputs.close()
+    return PackedResponse(response) if accepts_packed(accept) else ORJSONResponse(response)
 
 
-async def run_inference(payload: Image | str, entries: InferenceEntries) -> InferenceResponse:
+@app.post("/predict/batch")
+async def predict_batch(
+    entries: InferenceEntries = Depends(get_entries),
+    wait: float | None = Depends(get_load_wait),
+    images: list[bytes] | None = File(default=None),
+    texts: list[str] | None = Form(default=None),
+    accept: str | None = Header(default=None),
+) -> Any:
+    if images:
+        models = await load_models(entries, wait)
+        decoded = await asyncio.gather(*[decode_image(image, models) for image in images], return_exceptions=True)
+        # images that did decode may hold shared memory from the preprocess pool, which must still be released
+        if error := next((result for result in decoded if isinstance(result, BaseException)), None):
+            for result in decoded:
+                if isinstance(result, DecodedImage):
+                    result.close()
+            raise error
+        inputs: list[DecodedImage | str] = [result for result in decoded if isinstance(result, DecodedImage)]
+    elif texts:
+        inputs = list(texts)
+    else:
+        raise HTTPException(400, "Either images or texts must be provided")
+    # items are run concurrently so that batching models can group them
+    try:
+        responses = await asyncio.gather(*[run_inference(payload, entries, wait) for payload in inputs])
+    finally:
+        for payload in inputs:
+            if isinstance(payload, DecodedImage):
+                payload.close()
+    return PackedResponse(responses) if accepts_packed(accept) else ORJSONResponse(responses)
+
+
+async def run_inference(
+    payload: DecodedImage | str, entries: InferenceEntries, wait: float | None = None
+) -> InferenceResponse:
     outputs: dict[ModelIdentity, Any] = {}
     response: InferenceResponse = {}
 
     async def _run_inference(entry: InferenceEntry) -> None:
-        model = await model_cache.get(entry["name"], entry["type"], entry["task"], ttl=settings.model_ttl)
+        model = await model_cache.get(entry["name"], entry["type"], entry["task"])
         inputs = [payload]
         for dep in model.depends:
             try:
@@ -164,8 +260,9 @@ async def run_inference(payload: Image | str, entries: InferenceEntries) -> Infe
             except KeyError:
                 message = f"Task {entry['task']} of type {entry['type']} depends on output of {dep}"
                 raise HTTPException(400, message)
-        model = await load(model)
-        output = await run(model.predict, *inputs, **entry["options"])
+        with model_cache.use(model):
+            model = await load(model, wait)
+            output = await run(model.predict, *inputs, **entry["options"])
         outputs[model.identity] = output
         response[entry["task"]] = output
 
@@ -173,12 +270,39 @@ async def run_inference(payload: Image | str, entries: InferenceEntries) -> Infe
     await asyncio.gather(*[_run_inference(entry) for entry in without_deps])
     if with_deps:
         await asyncio.gather(*[_run_inference(entry) for entry in with_deps])
-    if isinstance(payload, Image):
+    if isinstance(payload, DecodedImage):
         response["imageHeight"], response["imageWidth"] = payload.height, payload.width
 
     return response
 
 
+async def load_models(entries: InferenceEntries, wait: float | None = None) -> list[InferenceModel]:
+    without_deps, with_deps = entries
+    models = await asyncio.gather(
+        *[model_cache.get(entry["name"], entry["type"], entry["task"]) for entry in [*without_deps, *with_deps]]
+    )
+    return list(await asyncio.gather(*[load(model, wait) for model in models]))
+
+
+async def decode_image(image: bytes, models: list[InferenceModel]) -> DecodedImage:
+    min_size = partial(min_image_size, models)
+    if preprocess_pool is None:
+        return DecodedImage(await run(decode_pil, image, min_size))
+
+    size = await run(lambda: min_size(PIL.Image.open(BytesIO(image)).size))
+    transforms = {model.identity: transform for model in models if (transform := model.preprocess_transform)}
+    loop = asyncio.get_running_loop()
+    shared = await loop.run_in_executor(preprocess_pool, preprocess, image, size, transforms)
+    return attach(*shared)
+
+
+def min_image_size(models: list[InferenceModel], size: tuple[int, int]) -> tuple[int, int] | None:
+    sizes = [model.min_image_size(size) for model in models]
+    if not sizes or None in sizes:
+        return None
+    return max(width for width, _ in sizes), max(height for _, height in sizes)  # type: ignore[misc]
+
+
 async def run(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
     if thread_pool is None:
         return func(*args, **kwargs)
@@ -186,45 +310,79 @@ async def run(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
     return await asyncio.get_running_loop().run_in_executor(thread_pool, partial_func)
 
 
-async def load(model: InferenceModel) -> InferenceModel:
+async def load(model: InferenceModel, wait: float | None = None) -> InferenceModel:
+    """
+    Loads a model if it isn't already. Concurrent calls for the same model share a single load.
+
+    Args:
+        model: The model to load.
+        wait: Seconds to wait for the model to load before raising a 503. Waits until it's loaded if None.
+    """
+
     if model.loaded:
         return model
 
+    task = loading.get(model)
+    if task is None:
+        task = loading[model] = asyncio.ensure_future(_load_model(model))
+        task.add_done_callback(partial(_loaded, model))
+
+    # shielded so that callers giving up don't cancel the load for others
+    if wait is None:
+        return await asyncio.shield(task)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), wait)
+    except asyncio.TimeoutError:
+        message = f"{model.model_type.replace('-', ' ').capitalize()} model '{model.model_name}' is loading"
+        raise HTTPException(503, message, headers={"Retry-After": str(LOAD_RETRY_AFTER_S)})
+
+
+async def _load_model(model: InferenceModel) -> InferenceModel:
     def _load(model: InferenceModel) -> InferenceModel:
         if model.load_attempts > 1:
             raise HTTPException(500, f"Failed to load model '{model.model_name}'")
-        with lock:
-            try:
-                model.load()
-            except FileNotFoundError as e:
-                if model.model_format == ModelFormat.ONNX:
-                    raise e
+        try:
+            model.load()
+        except FileNotFoundError as e:
+            if model.model_format == ModelFormat.ONNX:
+                raise e
+            if model.model_format == ModelFormat.ONNX_INT8:
+                log.info(f"Model '{model.model_name}' does not have an INT8 variant. Using the FP32 model instead.")
+            else:
                 log.exception(e)
                 log.warning(
                     f"{model.model_format.upper()} is available, but model '{model.model_name}' does not support it."
                 )
-                model.model_format = ModelFormat.ONNX
-                model.load()
+            model.model_format = ModelFormat.ONNX
+            model.load()
         return model
 
     try:
-        return await run(_load, model)
+        await run_load(_load, model)
     except (OSError, InvalidProtobuf, BadZipFile, NoSuchFile):
         log.warning(f"Failed to load {model.model_type.replace('_', ' ')} model '{model.model_name}'. Clearing cache.")
         model.clear_cache()
-        return await run(_load, model)
+        await run_load(_load, model)
+    model_cache.record_warmup(model)
+    model_cache.trim(keep=model)
+    return model
+
+
+def _loaded(model: InferenceModel, task: "asyncio.Future[InferenceModel]") -> None:
+    loading.pop(model, None)
+    # marks the error as retrieved in case every caller stopped waiting
+    if not task.cancelled():
+        task.exception()
+
+
+async def run_load(func: Callable[..., T], *args: Any) -> T:
+    if load_pool is None:
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(load_pool, partial(func, *args))
 
 
-async def idle_shutdown_task() -> None:
+async def idle_unload_task() -> None:
     while True:
-        log.debug("Checking for inactivity...")
-        if (
-            last_called is not None
-            and not active_requests
-            and not lock.locked()
-            and time.time() - last_called > settings.model_ttl
-        ):
-            log.info("Shutting down due to inactivity.")
-            os.kill(os.getpid(), signal.SIGINT)
-            break
         await asyncio.sleep(settings.model_ttl_poll_s)
+        log.debug("Checking for inactive models...")
+        model_cache.expire()
@@ -1,11 +1,17 @@
 from __future__ import annotations
 
+import os
+import threading
+import time
 from abc import ABC, abstractmethod
 from pathlib import Path
 from shutil import rmtree
 from typing import Any, ClassVar
 
-from huggingface_hub import snapshot_download
+import numpy as np
+import onnx
+from filelock import FileLock
+from numpy.typing import NDArray
 
 import ann.ann
 from app.sessions.ort import OrtSession
@@ -13,11 +19,24 @@ from app.sessions.ort import OrtSession
 from ..config import clean_name, log, settings
 from ..schemas import ModelFormat, ModelIdentity, ModelSession, ModelTask, ModelType
 from ..sessions.ann import AnnSession
+from .batching import BatchScheduler, has_batch_axis
+from .download import download_model
+from .preprocessing import Transform
+
+_MEMORY_MEASUREMENT_LOCK = threading.Lock()
+_WARMUP_DTYPES: dict[str, type[np.generic]] = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(int32)": np.int32,
+    "tensor(int64)": np.int64,
+}
 
 
 class InferenceModel(ABC):
     depends: ClassVar[list[ModelIdentity]]
     identity: ClassVar[ModelIdentity]
+    # models that implement `_predict_batch` can have requests batched together by a scheduler
+    supports_batching: ClassVar[bool] = False
 
     def __init__(
         self,
@@ -25,6 +44,8 @@ class InferenceModel(ABC):
         cache_dir: Path | str | None = None,
         model_format: ModelFormat | None = None,
         session: ModelSession | None = None,
+        inter_op_threads: int | None = None,
+        intra_op_threads: int | None = None,
         **model_kwargs: Any,
     ) -> None:
         self.loaded = session is not None
@@ -32,6 +53,11 @@ class InferenceModel(ABC):
         self.model_name = clean_name(model_name)
         self.cache_dir = Path(cache_dir) if cache_dir is not None else self._cache_dir_default
         self.model_format = model_format if model_format is not None else self._model_format_default
+        self.scheduler: BatchScheduler[Any, Any] | None = None
+        self.memory_usage = 0
+        self.warmup_time: float | None = None
+        self.inter_op_threads = inter_op_threads
+        self.intra_op_threads = intra_op_threads
         if session is not None:
             self.session = session
 
@@ -50,9 +76,47 @@ class InferenceModel(ABC):
         self.download()
         attempt = f"Attempt #{self.load_attempts} to load" if self.load_attempts > 1 else "Loading"
         log.info(f"{attempt} {self.model_type.replace('-', ' ')} model '{self.model_name}' to memory")
-        self.session = self._load()
+        # the process's RSS grows with every model being loaded, so only one is loaded at a time to attribute it
+        with _MEMORY_MEASUREMENT_LOCK:
+            rss = get_rss()
+            self.session = self._load()
+            self.scheduler = self._make_scheduler()
+            if settings.model_warmup:
+                self.warmup()
+            self.memory_usage = self._measure_memory_usage(rss)
         self.loaded = True
 
+    def warmup(self) -> None:
+        """
+        Runs synthetic inputs through the session at each batch size it's used with, so that the first request
+        doesn't pay for kernel selection, graph compilation and memory allocation.
+        """
+
+        start = time.perf_counter()
+        try:
+            for batch_size in self._warmup_batch_sizes():
+                for feeds in self._warmup_feeds(batch_size):
+                    self.session.run(None, feeds)
+        except Exception as e:
+            log.warning(f"Failed to warm up {self.model_type.replace('-', ' ')} model '{self.model_name}': {e}")
+            return
+        self.warmup_time = time.perf_counter() - start
+        log.info(f"Warmed up {self.model_type.replace('-', ' ')} model '{self.model_name}' in {self.warmup_time:.2f}s")
+
+    def unload(self) -> None:
+        if not self.loaded:
+            return
+
+        log.info(f"Unloading {self.model_type.replace('-', ' ')} model '{self.model_name}' from memory")
+        if self.scheduler is not None:
+            self.scheduler.close()
+            self.scheduler = None
+        self._unload()
+        del self.session
+        self.loaded = False
+        self.load_attempts = 0
+        self.memory_usage = 0
+
     def predict(self, *inputs: Any, **model_kwargs: Any) -> Any:
         self.load()
         if model_kwargs:
@@ -62,21 +126,107 @@ class InferenceModel(ABC):
     @abstractmethod
     def _predict(self, *inputs: Any, **model_kwargs: Any) -> Any: ...
 
+    def _predict_batch(self, batch: list[Any]) -> Any:
+        raise NotImplementedError(f"{self.__class__.__name__} does not support batching")
+
+    def _schedule(self, items: list[Any]) -> Any:
+        if self.scheduler is None:
+            return self._predict_batch(items)
+        return self.scheduler.submit(items)
+
     def configure(self, **kwargs: Any) -> None:
         pass
 
+    @property
+    def preprocess_transform(self) -> Transform | None:
+        """
+        A picklable function that writes the model's input for an RGB image to the `out` array, along with the shape
+        of that array. If set, images can be preprocessed for the model in another process.
+        """
+
+        return None
+
+    def min_image_size(self, size: tuple[int, int]) -> tuple[int, int] | None:
+        """
+        Returns the smallest (width, height) that an image of the given size can be decoded at without affecting the
+        model's input, or None if the model needs the image at full resolution.
+        """
+
+        return None
+
     def _download(self) -> None:
         ignore_patterns = [] if self.model_format == ModelFormat.ARMNN else ["*.armnn"]
-        snapshot_download(
-            f"immich-app/{clean_name(self.model_name)}",
-            cache_dir=self.cache_dir,
-            local_dir=self.cache_dir,
-            ignore_patterns=ignore_patterns,
-        )
+        if self.model_format != ModelFormat.ONNX_INT8:
+            ignore_patterns.append("*.int8.onnx*")
+            download_model(clean_name(self.model_name), self.cache_dir, ignore_patterns=ignore_patterns)
+            return
+
+        fp32_path = self.model_dir / f"model.{ModelFormat.ONNX}"
+        try:
+            download_model(clean_name(self.model_name), self.cache_dir, ignore_patterns=ignore_patterns)
+        except OSError as e:
+            # the variant is looked for again on the next load, but the model that's already here is still usable
+            if not fp32_path.is_file():
+                raise
+            log.warning(
+                f"Failed to download the INT8 variant of model '{self.model_name}'. Using the FP32 model instead: {e}"
+            )
+            self.model_format = ModelFormat.ONNX
+            return
+
+        if not self.model_path.is_file():
+            log.info(f"Model '{self.model_name}' does not have an INT8 variant. Using the FP32 model instead.")
+            self.int8_missing_path.parent.mkdir(parents=True, exist_ok=True)
+            self.int8_missing_path.touch()
+            self.model_format = ModelFormat.ONNX
 
     def _load(self) -> ModelSession:
         return self._make_session(self.model_path)
 
+    def _unload(self) -> None:
+        pass
+
+    def _ensure_batch_axis(self) -> None:
+        """
+        Adds a batch axis to the model file if it doesn't have one, so that it can run on batches.
+
+        This is only checked once per file, after which a marker is left next to it. The file is edited under a lock
+        and atomically replaced, so processes sharing the cache neither edit it at the same time nor load it while
+        it's being written.
+        """
+
+        marker_path = self.model_path.with_name(f"{self.model_path.name}.batched")
+        if self._has_batch_marker(marker_path):
+            return
+
+        with FileLock(self.model_path.with_name(f"{self.model_path.name}.lock")):
+            if self._has_batch_marker(marker_path):
+                return
+            # weights stored in a separate file are left there instead of being loaded only to be written back
+            proto = onnx.load(self.model_path, load_external_data=False)
+            if self._add_batch_axis(proto):
+                log.debug(f"Adding batch axis to model {self.model_path}")
+                tmp_path = self.model_path.with_name(f"{self.model_path.name}.tmp")
+                onnx.save(proto, tmp_path)
+                tmp_path.replace(self.model_path)
+            stat = self.model_path.stat()
+            marker_path.write_text(f"{stat.st_size}:{stat.st_mtime_ns}")
+
+    def _has_batch_marker(self, marker_path: Path) -> bool:
+        # the model file may have been downloaded again since the marker was written
+        if not marker_path.is_file():
+            return False
+        stat = self.model_path.stat()
+        return marker_path.read_text() == f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _add_batch_axis(self, proto: onnx.ModelProto) -> bool:
+        """
+        Edits the model's inputs and outputs to have a batch axis, returning False if they already do. Models that
+        may be published without one override this, and the file is otherwise left as is.
+        """
+
+        return False
+
     def clear_cache(self) -> None:
         if not self.cache_dir.exists():
             log.warning(
@@ -99,6 +249,52 @@ class InferenceModel(ABC):
             self.cache_dir.unlink()
         self.cache_dir.mkdir(parents=True, exist_ok=True)
 
+    def _measure_memory_usage(self, rss_before: int | None) -> int:
+        # approximate, as it includes anything else allocated meanwhile, such as for requests to other models
+        rss_after = get_rss()
+        if rss_before is None or rss_after is None:
+            return self.model_path.stat().st_size if self.model_path.is_file() else 0
+        return max(rss_after - rss_before, 0)
+
+    def _warmup_batch_sizes(self) -> list[int]:
+        max_batch_size = self.max_batch_size
+        if max_batch_size is None or max_batch_size <= 1 or not has_batch_axis(self.session.get_inputs()[0].shape):
+            return [1]
+        return [1, max_batch_size]
+
+    def _warmup_feeds(self, batch_size: int) -> list[dict[str, NDArray[Any]]]:
+        """Returns inputs for each shape the model is run with at the given batch size."""
+
+        feeds: dict[str, NDArray[Any]] = {}
+        for i, node in enumerate(self.session.get_inputs()):
+            # dynamic axes besides the batch axis are given a size of 1 unless overridden
+            shape = [dim if isinstance(dim, int) and dim > 0 else 1 for dim in node.shape]
+            if has_batch_axis(node.shape):
+                shape[0] = batch_size
+            dtype = _WARMUP_DTYPES.get(getattr(node, "type", ""), np.float32)
+            feeds[node.name or f"input_{i}"] = np.zeros(shape, dtype=dtype)
+        return [feeds]
+
+    def _make_scheduler(self) -> BatchScheduler[Any, Any] | None:
+        if not self.supports_batching or self.batch_window_ms is None or self.max_batch_size == 1:
+            return None
+        if not has_batch_axis(self.session.get_inputs()[0].shape):
+            log.warning(
+                f"Batching is enabled for {self.model_type.replace('-', ' ')} models, "
+                f"but model '{self.model_name}' does not have a batch axis. Disabling batching."
+            )
+            return None
+        log.debug(
+            f"Batching {self.model_type.replace('-', ' ')} model '{self.model_name}' with a window of "
+            f"{self.batch_window_ms}ms and max batch size of {self.max_batch_size}"
+        )
+        return BatchScheduler(
+            self._predict_batch,
+            max_batch_size=self.max_batch_size,
+            window_ms=self.batch_window_ms,
+            name=f"{self.model_name}-{self.model_type}",
+        )
+
     def _make_session(self, model_path: Path) -> ModelSession:
         if not model_path.is_file():
             raise FileNotFoundError(f"Model file not found: {model_path}")
@@ -107,7 +303,9 @@ class InferenceModel(ABC):
             case ".armnn":
                 session: ModelSession = AnnSession(model_path)
             case ".onnx":
-                session = OrtSession(model_path)
+                session = OrtSession(
+                    model_path, inter_op_threads=self.inter_op_threads, intra_op_threads=self.intra_op_threads
+                )
             case _:
                 raise ValueError(f"Unsupported model file type: {model_path.suffix}")
         return session
@@ -120,6 +318,12 @@ class InferenceModel(ABC):
     def model_path(self) -> Path:
         return self.model_dir / f"model.{self.model_format}"
 
+    @property
+    def int8_missing_path(self) -> Path:
+        """Left next to the model once its files have been listed without an INT8 variant among them."""
+
+        return self.model_dir / f"model.{ModelFormat.ONNX_INT8}.missing"
+
     @property
     def model_task(self) -> ModelTask:
         return self.identity[1]
@@ -128,6 +332,24 @@ class InferenceModel(ABC):
     def model_type(self) -> ModelType:
         return self.identity[0]
 
+    @property
+    def batch_window_ms(self) -> float | None:
+        return None
+
+    @property
+    def ttl(self) -> int:
+        """Seconds of inactivity before the model is unloaded, or 0 to keep it loaded."""
+
+        return self.ttl_override if self.ttl_override is not None else settings.model_ttl
+
+    @property
+    def ttl_override(self) -> int | None:
+        return None
+
+    @property
+    def max_batch_size(self) -> int | None:
+        return None
+
     @property
     def cache_dir(self) -> Path:
         return self._cache_dir
@@ -155,4 +377,19 @@ class InferenceModel(ABC):
 
     @property
     def _model_format_default(self) -> ModelFormat:
-        return ModelFormat.ARMNN if ann.ann.is_available and settings.ann else ModelFormat.ONNX
+        if ann.ann.is_available and settings.ann:
+            return ModelFormat.ARMNN
+        # only models whose repo was found to not have an INT8 variant skip looking for one
+        if not settings.quantized_models or self.int8_missing_path.is_file():
+            return ModelFormat.ONNX
+        return ModelFormat.ONNX_INT8
+
+
+def get_rss() -> int | None:
+    """Returns the resident memory of the process in bytes, or None if it can't be read."""
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
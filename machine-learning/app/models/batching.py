@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, SimpleQueue
+from typing import Any, Callable, Generic, Sequence, TypeVar
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ..config import log
+
+Item = TypeVar("Item")
+Output = TypeVar("Output")
+
+
+class BatchScheduler(Generic[Item, Output]):
+    """
+    Groups items submitted concurrently by different requests into batches, running each batch with a single call.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[list[Item]], Sequence[Output]],
+        max_batch_size: int | None = None,
+        window_ms: float = 0.0,
+        name: str = "batch-scheduler",
+    ) -> None:
+        """
+        Args:
+            run_batch: Processes a list of items, returning one output per item in the same order.
+            max_batch_size: Maximum number of items in a batch. Unlimited if None. Defaults to None.
+            window_ms: Time to wait for more items after the first item of a batch arrives. Defaults to 0.
+            name: Name of the dispatcher thread. Defaults to "batch-scheduler".
+        """
+
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.window_s = window_ms / 1000
+        self.name = name
+        self.queue: SimpleQueue[tuple[Item, Future[Output]] | None] = SimpleQueue()
+        self.lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+
+    def submit(self, items: list[Item]) -> list[Output]:
+        """Blocks until all items have been processed, returning their outputs in order."""
+
+        self._start()
+        futures: list[Future[Output]] = []
+        for item in items:
+            future: Future[Output] = Future()
+            self.queue.put((item, future))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def close(self) -> None:
+        with self.lock:
+            if self.thread is None:
+                return
+            self.queue.put(None)
+            self.thread = None
+
+    def _start(self) -> None:
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._dispatch, name=self.name, daemon=True)
+                self.thread.start()
+
+    def _dispatch(self) -> None:
+        while (first := self.queue.get()) is not None:
+            batch = [first]
+            closed = False
+            deadline = time.monotonic() + self.window_s
+            while self.max_batch_size is None or len(batch) < self.max_batch_size:
+                try:
+                    timeout = deadline - time.monotonic()
+                    pending = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+                except Empty:
+                    break
+                if pending is None:
+                    closed = True
+                    break
+                batch.append(pending)
+            self._run(batch)
+            if closed:
+                break
+
+    def _run(self, batch: list[tuple[Item, Future[Output]]]) -> None:
+        log.debug(f"Running batch of {len(batch)} items with {self.name}")
+        try:
+            outputs = self.run_batch([item for item, _ in batch])
+            if len(outputs) != len(batch):
+                raise ValueError(f"Expected {len(batch)} outputs from batch, but got {len(outputs)}")
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), output in zip(batch, outputs):
+            future.set_result(output)
+
+
+def has_batch_axis(shape: tuple[Any, ...]) -> bool:
+    return len(shape) > 0 and not isinstance(shape[0], int)
+
+
+def concat_feeds(feeds: list[dict[str, NDArray[Any]]]) -> dict[str, NDArray[Any]]:
+    if len(feeds) == 1:
+        return feeds[0]
+    return {name: np.concatenate([feed[name] for feed in feeds]) for name in feeds[0]}
@@ -1,60 +1,163 @@
-from typing import Any
-
-from aiocache.backends.memory import SimpleMemoryCache
-from aiocache.lock import OptimisticLock
-from aiocache.plugins import TimingPlugin
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Any, Iterator
 
+from app.config import log
 from app.models import from_model_type
 from app.models.base import InferenceModel
 
-from ..schemas import ModelTask, ModelType, has_profiling
+from ..schemas import ModelTask, ModelType
 
 
 class ModelCache:
-    """Fetches a model from an in-memory cache, instantiating it if it's missing."""
+    """
+    Fetches a model from an in-memory cache, instantiating it if it's missing.
+
+    Models that go unused for their TTL are unloaded, but stay cached to be loaded again when needed. Loaded models
+    also count toward an optional memory budget. When it's exceeded, the least recently used models that aren't
+    pinned are unloaded.
+    """
 
     def __init__(
         self,
         revalidate: bool = False,
-        timeout: int | None = None,
         profiling: bool = False,
+        memory_budget: int | None = None,
     ) -> None:
         """
         Args:
             revalidate: Resets TTL on cache hit. Useful to keep models in memory while active. Defaults to False.
-            timeout: Maximum allowed time for model to load. Disabled if None. Defaults to None.
             profiling: Collects metrics for cache operations, adding slight overhead. Defaults to False.
+            memory_budget: Maximum memory in bytes for loaded models to use. Disabled if None. Defaults to None.
         """
 
-        plugins = []
-
-        if profiling:
-            plugins.append(TimingPlugin())
-
         self.should_revalidate = revalidate
-
-        self.cache = SimpleMemoryCache(timeout=timeout, plugins=plugins, namespace=None)
+        self.memory_budget = memory_budget
+        # ordered from least to most recently used
+        self.cache: OrderedDict[str, InferenceModel] = OrderedDict()
+        self.ttls: dict[str, int] = {}
+        self.expires_at: dict[str, float] = {}
+        self.pinned: set[str] = set()
+        self.in_use: Counter[InferenceModel] = Counter()
+        self.profiling: dict[str, float] | None = {} if profiling else None
 
     async def get(
         self, model_name: str, model_type: ModelType, model_task: ModelTask, **model_kwargs: Any
     ) -> InferenceModel:
+        start = time.perf_counter()
         key = f"{model_name}{model_type}{model_task}"
 
-        async with OptimisticLock(self.cache, key) as lock:
-            model: InferenceModel | None = await self.cache.get(key)
-            if model is None:
-                model = from_model_type(model_name, model_type, model_task, **model_kwargs)
-                await lock.cas(model, ttl=model_kwargs.get("ttl", None))
+        self.expire()
+        model = self.cache.get(key)
+        if model is None:
+            model = from_model_type(model_name, model_type, model_task, **model_kwargs)
+            self.cache[key] = model
+            self.set_ttl(key, model_kwargs.get("ttl", model.ttl))
+        else:
+            self.cache.move_to_end(key)
+            if key not in self.expires_at:
+                # unloaded since it was last used, so it's about to be loaded again
+                self.set_ttl(key, model_kwargs.get("ttl", model.ttl))
             elif self.should_revalidate:
-                await self.revalidate(key, model_kwargs.get("ttl", None))
+                await self.revalidate(key, model_kwargs.get("ttl", model.ttl))
+
+        self._record("get", time.perf_counter() - start)
         return model
 
     async def get_profiling(self) -> dict[str, float] | None:
-        if not has_profiling(self.cache):
-            return None
-
-        return self.cache.profiling
+        return self.profiling
 
     async def revalidate(self, key: str, ttl: int | None) -> None:
-        if ttl is not None and key in self.cache._handlers:
-            await self.cache.expire(key, ttl)
+        if ttl is not None and key in self.expires_at:
+            self.set_ttl(key, ttl)
+
+    def set_ttl(self, key: str, ttl: int | None) -> None:
+        if ttl is not None and ttl > 0:
+            self.ttls[key] = ttl
+            self.expires_at[key] = time.monotonic() + ttl
+
+    def expire(self) -> None:
+        """Unloads the models that weren't used within their TTL."""
+
+        now = time.monotonic()
+        for key, expires_at in list(self.expires_at.items()):
+            if expires_at > now or key in self.pinned:
+                continue
+            model = self.cache[key]
+            if model.loaded and not self.in_use[model]:
+                self.unload(key)
+            else:
+                # still loading or in use
+                self.expires_at[key] = now + self.ttls[key]
+
+    def pin(self, model: InferenceModel) -> None:
+        """Keeps a cached model from being unloaded."""
+
+        for key, cached in self.cache.items():
+            if cached is model:
+                self.pinned.add(key)
+
+    @contextmanager
+    def use(self, model: InferenceModel) -> Iterator[InferenceModel]:
+        """Keeps a model from being unloaded while it's being used."""
+
+        self.in_use[model] += 1
+        try:
+            yield model
+        finally:
+            self.in_use[model] -= 1
+            if not self.in_use[model]:
+                del self.in_use[model]
+
+    def trim(self, keep: InferenceModel | None = None) -> None:
+        """
+        Unloads the least recently used models that aren't pinned until loaded models fit in the memory budget.
+
+        Args:
+            keep: A model to not unload, such as one that was just loaded to be used.
+        """
+
+        if self.memory_budget is None:
+            return
+
+        usage = self.memory_usage
+        for key, model in list(self.cache.items()):
+            if usage <= self.memory_budget:
+                break
+            if key in self.pinned or model is keep or not model.loaded or self.in_use[model]:
+                continue
+            usage -= model.memory_usage
+            log.info(f"Loaded models exceed memory budget of {self.memory_budget / 2**20:.0f} MiB")
+            self.unload(key)
+
+        if usage > self.memory_budget:
+            log.warning(
+                f"Loaded models use {usage / 2**20:.0f} MiB, "
+                f"exceeding the memory budget of {self.memory_budget / 2**20:.0f} MiB"
+            )
+
+    def record_warmup(self, model: InferenceModel) -> None:
+        """Adds the time a model that was just loaded took to warm up to the profiling metrics, if it was warmed up."""
+
+        if self.profiling is not None and model.warmup_time is not None:
+            self._record("warmup", model.warmup_time)
+
+    def unload(self, key: str) -> None:
+        self.cache[key].unload()
+        self.expires_at.pop(key, None)
+
+    @property
+    def memory_usage(self) -> int:
+        return sum(model.memory_usage for model in self.cache.values() if model.loaded)
+
+    def _record(self, operation: str, elapsed: float) -> None:
+        if self.profiling is None:
+            return
+        count = self.profiling.get(f"{operation}_count", 0) + 1
+        total = self.profiling.get(f"{operation}_total", 0.0) + elapsed
+        self.profiling[f"{operation}_count"] = count
+        self.profiling[f"{operation}_total"] = total
+        self.profiling[f"{operation}_avg"] = total / count
+        self.profiling[f"{operation}_min"] = min(self.profiling.get(f"{operation}_min", elapsed), elapsed)
+        self.profiling[f"{operation}_max"] = max(self.profiling.get(f"{operation}_max", elapsed), elapsed)
@@ -1,4 +1,5 @@
 import json
+import math
 from abc import abstractmethod
 from functools import cached_property
 from pathlib import Path
@@ -8,22 +9,39 @@ import numpy as np
 from numpy.typing import NDArray
 from tokenizers import Encoding, Tokenizer
 
-from app.config import log
+from app.config import log, settings
 from app.models.base import InferenceModel
-from app.models.transforms import clean_text
-from app.schemas import ModelSession, ModelTask, ModelType
+from app.models.transforms import clean_text, quantize_embedding, truncate_embedding, validate_embedding_dimension
+from app.schemas import Embedding, EmbeddingDtype, ModelSession, ModelTask, ModelType
+
+# with a dynamic sequence length, texts are padded to a multiple of this to limit how many shapes the model sees
+SEQUENCE_LENGTH_BUCKET = 16
 
 
 class BaseCLIPTextualEncoder(InferenceModel):
     depends = []
     identity = (ModelType.TEXTUAL, ModelTask.SEARCH)
-
-    def _predict(self, inputs: str, **kwargs: Any) -> NDArray[np.float32]:
-        res: NDArray[np.float32] = self.session.run(None, self.tokenize(inputs))[0][0]
+    supports_batching = True
+    dynamic_length = False
+
+    def _predict(self, inputs: str, **kwargs: Any) -> Embedding:
+        dimension: int | None = kwargs.get("embeddingDimension")
+        if dimension is not None:
+            validate_embedding_dimension(self.model_name, dimension)
+        res: NDArray[np.float32] = self._schedule([inputs])[0]
+        if dimension is not None:
+            res = truncate_embedding(res, dimension)
+        return quantize_embedding(res, kwargs.get("embeddingDtype", EmbeddingDtype.FLOAT32))
+
+    def _predict_batch(self, batch: list[str]) -> NDArray[np.float32]:
+        res: NDArray[np.float32] = self.session.run(None, self.tokenize_batch(batch))[0]
         return res
 
     def _load(self) -> ModelSession:
         session = super()._load()
+        # only models exported with a dynamic sequence axis accept shorter inputs, and they're only exported with one
+        # if padding doesn't affect their embeddings
+        self.dynamic_length = settings.trim_text_padding and not isinstance(session.get_inputs()[0].shape[-1], int)
         log.debug(f"Loading tokenizer for CLIP model '{self.model_name}'")
         self.tokenizer = self._load_tokenizer()
         tokenizer_kwargs: dict[str, Any] | None = self.text_cfg.get("tokenizer_kwargs")
@@ -32,14 +50,51 @@ class BaseCLIPTextualEncoder(InferenceModel):
 
         return session
 
+    def _warmup_feeds(self, batch_size: int) -> list[dict[str, NDArray[Any]]]:
+        if not self.dynamic_length:
+            return [dict(self.tokenize_batch([""] * batch_size))]
+        # each length bucket is a different input shape, which the first query of that length would otherwise pay for
+        context_length: int = self.text_cfg.get("context_length", 77)
+        lengths = [*range(SEQUENCE_LENGTH_BUCKET, context_length, SEQUENCE_LENGTH_BUCKET), context_length]
+        return [dict(self.tokenize_batch([""] * batch_size, length=length)) for length in lengths]
+
     @abstractmethod
     def _load_tokenizer(self) -> Tokenizer:
         pass
 
+    def _pad(self, encodings: list[Encoding], length: int | None = None) -> list[Encoding]:
+        """
+        Pads the encodings to `length`, or else the shortest bucket that fits the longest of them, if the sequence
+        length is dynamic.
+        """
+
+        if not self.dynamic_length:
+            return encodings
+        if length is None:
+            longest = max(len(encoding.ids) for encoding in encodings)
+            context_length: int = self.text_cfg.get("context_length", 77)
+            length = min(math.ceil(longest / SEQUENCE_LENGTH_BUCKET) * SEQUENCE_LENGTH_BUCKET, context_length)
+        pad_token: str = self.tokenizer_cfg["pad_token"]
+        for encoding in encodings:
+            encoding.pad(length, pad_id=self.tokenizer.token_to_id(pad_token), pad_token=pad_token)
+        return encodings
+
     @abstractmethod
-    def tokenize(self, text: str) -> dict[str, NDArray[np.int32]]:
+    def tokenize_batch(self, texts: list[str], length: int | None = None) -> dict[str, NDArray[np.int32]]:
         pass
 
+    @property
+    def batch_window_ms(self) -> float | None:
+        return settings.batch_window_ms.clip_textual if settings.batch_window_ms else None
+
+    @property
+    def max_batch_size(self) -> int | None:
+        return settings.max_batch_size.clip_textual if settings.max_batch_size else None
+
+    @property
+    def ttl_override(self) -> int | None:
+        return settings.model_ttl_override.clip_textual if settings.model_ttl_override else None
+
     @property
     def model_cfg_path(self) -> Path:
         return self.cache_dir / "config.json"
@@ -87,22 +142,24 @@ class OpenClipTextualEncoder(BaseCLIPTextualEncoder):
         tokenizer: Tokenizer = Tokenizer.from_file(self.tokenizer_file_path.as_posix())
 
         pad_id: int = tokenizer.token_to_id(pad_token)
-        tokenizer.enable_padding(length=context_length, pad_token=pad_token, pad_id=pad_id)
+        # padded to the longest text in the batch, and then to a bucket, if the model allows it
+        length = None if self.dynamic_length else context_length
+        tokenizer.enable_padding(length=length, pad_token=pad_token, pad_id=pad_id)
         tokenizer.enable_truncation(max_length=context_length)
 
         return tokenizer
 
-    def tokenize(self, text: str) -> dict[str, NDArray[np.int32]]:
-        text = clean_text(text, canonicalize=self.canonicalize)
-        tokens: Encoding = self.tokenizer.encode(text)
-        return {"text": np.array([tokens.ids], dtype=np.int32)}
+    def tokenize_batch(self, texts: list[str], length: int | None = None) -> dict[str, NDArray[np.int32]]:
+        texts = [clean_text(text, canonicalize=self.canonicalize) for text in texts]
+        tokens = self._pad(self.tokenizer.encode_batch(texts), length)
+        return {"text": np.array([encoding.ids for encoding in tokens], dtype=np.int32)}
 
 
 class MClipTextualEncoder(OpenClipTextualEncoder):
-    def tokenize(self, text: str) -> dict[str, NDArray[np.int32]]:
-        text = clean_text(text, canonicalize=self.canonicalize)
-        tokens: Encoding = self.tokenizer.encode(text)
+    def tokenize_batch(self, texts: list[str], length: int | None = None) -> dict[str, NDArray[np.int32]]:
+        texts = [clean_text(text, canonicalize=self.canonicalize) for text in texts]
+        tokens = self._pad(self.tokenizer.encode_batch(texts), length)
         return {
-            "input_ids": np.array([tokens.ids], dtype=np.int32),
-            "attention_mask": np.array([tokens.attention_mask], dtype=np.int32),
+            "input_ids": np.array([encoding.ids for encoding in tokens], dtype=np.int32),
+            "attention_mask": np.array([encoding.attention_mask for encoding in tokens], dtype=np.int32),
         }
@@ -1,6 +1,7 @@
 import json
+import threading
 from abc import abstractmethod
-from functools import cached_property
+from functools import cached_property, partial
 from pathlib import Path
 from typing import Any
 
@@ -8,25 +9,61 @@ import numpy as np
 from numpy.typing import NDArray
 from PIL import Image
 
-from app.config import log
+from app.config import log, settings
 from app.models.base import InferenceModel
-from app.models.transforms import crop_pil, decode_pil, get_pil_resampling, normalize, resize_pil, to_numpy
-from app.schemas import ModelSession, ModelTask, ModelType
+from app.models.batching import concat_feeds
+from app.models.preprocessing import Transform
+from app.models.transforms import (
+    DecodedImage,
+    decode_pil,
+    decode_rgb,
+    get_pil_resampling,
+    quantize_embedding,
+    resize_crop_normalize,
+    truncate_embedding,
+    validate_embedding_dimension,
+)
+from app.schemas import Embedding, EmbeddingDtype, ModelSession, ModelTask, ModelType
 
 
 class BaseCLIPVisualEncoder(InferenceModel):
     depends = []
     identity = (ModelType.VISUAL, ModelTask.SEARCH)
+    supports_batching = True
 
-    def _predict(self, inputs: Image.Image | bytes, **kwargs: Any) -> NDArray[np.float32]:
-        image = decode_pil(inputs)
-        res: NDArray[np.float32] = self.session.run(None, self.transform(image))[0][0]
+    def _predict(self, inputs: Image.Image | NDArray[np.uint8] | bytes | DecodedImage, **kwargs: Any) -> Embedding:
+        dimension: int | None = kwargs.get("embeddingDimension")
+        if dimension is not None:
+            validate_embedding_dimension(self.model_name, dimension)
+        if isinstance(inputs, DecodedImage) and self.identity in inputs.tensors:
+            feeds = {"image": inputs.tensors[self.identity][np.newaxis]}
+        else:
+            feeds = self.transform(inputs if isinstance(inputs, DecodedImage) else decode_pil(inputs))
+        res: NDArray[np.float32] = self._schedule([feeds])[0]
+        if dimension is not None:
+            res = truncate_embedding(res, dimension)
+        return quantize_embedding(res, kwargs.get("embeddingDtype", EmbeddingDtype.FLOAT32))
+
+    def _predict_batch(self, batch: list[dict[str, NDArray[np.float32]]]) -> NDArray[np.float32]:
+        res: NDArray[np.float32] = self.session.run(None, concat_feeds(batch))[0]
         return res
 
     @abstractmethod
-    def transform(self, image: Image.Image) -> dict[str, NDArray[np.float32]]:
+    def transform(self, image: Image.Image | DecodedImage) -> dict[str, NDArray[np.float32]]:
         pass
 
+    @property
+    def batch_window_ms(self) -> float | None:
+        return settings.batch_window_ms.clip_visual if settings.batch_window_ms else None
+
+    @property
+    def max_batch_size(self) -> int | None:
+        return settings.max_batch_size.clip_visual if settings.max_batch_size else None
+
+    @property
+    def ttl_override(self) -> int | None:
+        return settings.model_ttl_override.clip_visual if settings.model_ttl_override else None
+
     @property
     def model_cfg_path(self) -> Path:
         return self.cache_dir / "config.json"
@@ -58,12 +95,26 @@ class OpenClipVisualEncoder(BaseCLIPVisualEncoder):
         self.resampling = get_pil_resampling(self.preprocess_cfg["interpolation"])
         self.mean = np.array(self.preprocess_cfg["mean"], dtype=np.float32)
         self.std = np.array(self.preprocess_cfg["std"], dtype=np.float32)
+        # (x / 255 - mean) / std as a single multiply-add
+        self.scale = (1 / (255 * self.std)).astype(np.float32)
+        self.shift = (-self.mean / self.std).astype(np.float32)
+        self.buffers = threading.local()
 
         return super()._load()
 
-    def transform(self, image: Image.Image) -> dict[str, NDArray[np.float32]]:
-        image = resize_pil(image, self.size)
-        image = crop_pil(image, self.size)
-        image_np = to_numpy(image)
-        image_np = normalize(image_np, self.mean, self.std)
-        return {"image": np.expand_dims(image_np.transpose(2, 0, 1), 0)}
+    def min_image_size(self, size: tuple[int, int]) -> tuple[int, int] | None:
+        # the shorter side is resized to `self.size` before cropping
+        return self.size, self.size
+
+    @property
+    def preprocess_transform(self) -> Transform:
+        transform = partial(resize_crop_normalize, size=self.size, scale=self.scale, shift=self.shift)
+        return transform, (3, self.size, self.size)
+
+    def transform(self, image: Image.Image | DecodedImage) -> dict[str, NDArray[np.float32]]:
+        # each thread reuses its buffer since it waits for the session to consume it before calling this again
+        buffer: NDArray[np.float32] | None = getattr(self.buffers, "image", None)
+        if buffer is None:
+            buffer = self.buffers.image = np.empty((1, 3, self.size, self.size), dtype=np.float32)
+        resize_crop_normalize(decode_rgb(image), self.size, self.scale, self.shift, out=buffer[0])
+        return {"image": buffer}
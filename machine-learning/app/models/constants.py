@@ -47,6 +47,13 @@ _OPENCLIP_MODELS = {
 }
 
 
+# trained with Matryoshka representation learning, so a prefix of their embeddings is a smaller embedding
+_MRL_MODELS = {
+    "nllb-clip-base-siglip__mrl": 768,
+    "nllb-clip-large-siglip__mrl": 1152,
+}
+
+
 _MCLIP_MODELS = {
     "LABSE-Vit-L-14",
     "XLM-Roberta-Large-Vit-B-16Plus",
@@ -79,3 +86,9 @@ def get_model_source(model_name: str) -> ModelSource | None:
         return ModelSource.OPENCLIP
 
     return None
+
+
+def get_mrl_dimension(model_name: str) -> int | None:
+    """Returns the full embedding dimension of a model whose embeddings can be truncated, or None otherwise."""
+
+    return _MRL_MODELS.get(clean_name(model_name))
@@ -0,0 +1,147 @@
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import NamedTuple
+from urllib.parse import quote
+
+from filelock import FileLock, Timeout
+from huggingface_hub import HfApi, hf_hub_url
+from huggingface_hub.utils import build_hf_headers, filter_repo_objects, get_session
+
+from ..config import log, settings
+
+# lists the files of a downloaded model, so that a cache folder can be copied as is to seed a mirror
+MANIFEST_NAME = ".manifest.json"
+CHUNK_SIZE = 2**20
+TIMEOUT_S = 30
+
+
+class RemoteFile(NamedTuple):
+    path: str
+    size: int | None = None
+    sha256: str | None = None
+
+
+def download_model(model_name: str, local_dir: Path, ignore_patterns: list[str] | None = None) -> None:
+    """
+    Downloads the files of a model to `local_dir` from the configured mirror, or Hugging Face if there isn't one.
+
+    Only one process on the host downloads a model at a time, with others waiting for it to finish and then skipping
+    the files it downloaded. Files are fetched in parallel and resumed if an earlier attempt was interrupted. They're
+    only moved into place once their size and SHA-256 match what the source lists.
+
+    Args:
+        model_name: Name of the model, as in its Hugging Face repo or mirror folder.
+        local_dir: Folder to download the model to.
+        ignore_patterns: Glob patterns for files to skip.
+    """
+
+    local_dir.mkdir(parents=True, exist_ok=True)
+    lock = FileLock(local_dir.with_name(f"{local_dir.name}.lock"))
+    try:
+        lock.acquire(timeout=0)
+    except Timeout:
+        log.info(f"Waiting for another process to download model '{model_name}'")
+        lock.acquire()
+
+    try:
+        files = list(filter_repo_objects(list_files(model_name), ignore_patterns=ignore_patterns, key=lambda f: f.path))
+        pending = [file for file in files if not _is_complete(local_dir / file.path, file)]
+        with ThreadPoolExecutor(max(settings.model_download_workers, 1)) as pool:
+            # consumed to raise any errors
+            list(pool.map(partial(_download_file, model_name, local_dir), pending))
+        (local_dir / MANIFEST_NAME).write_text(json.dumps([file._asdict() for file in files]))
+    finally:
+        lock.release()
+
+
+def list_files(model_name: str) -> list[RemoteFile]:
+    mirror = settings.model_mirror
+    if mirror is None:
+        info = HfApi().model_info(f"immich-app/{model_name}", files_metadata=True)
+        return [
+            RemoteFile(sibling.rfilename, sibling.size, sibling.lfs.sha256 if sibling.lfs is not None else None)
+            for sibling in info.siblings or []
+        ]
+
+    if _is_url(mirror):
+        response = get_session().get(_mirror_url(mirror, model_name, MANIFEST_NAME), timeout=TIMEOUT_S)
+        response.raise_for_status()
+        manifest = response.json()
+    else:
+        manifest = json.loads((Path(mirror) / model_name / MANIFEST_NAME).read_text())
+    return [RemoteFile(**file) for file in manifest]
+
+
+def _download_file(model_name: str, local_dir: Path, file: RemoteFile) -> None:
+    path = local_dir / file.path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    incomplete = path.with_name(f"{path.name}.incomplete")
+    offset = incomplete.stat().st_size if incomplete.is_file() else 0
+    if file.size is not None and offset > file.size:
+        offset = 0
+
+    if file.size is None or offset < file.size:
+        log.debug(f"Downloading '{file.path}' for model '{model_name}'{f' from byte {offset}' if offset else ''}")
+        _fetch(model_name, file.path, incomplete, offset)
+
+    try:
+        _verify(incomplete, file)
+    except OSError:
+        incomplete.unlink()
+        raise
+    incomplete.replace(path)
+
+
+def _fetch(model_name: str, file_path: str, incomplete: Path, offset: int) -> None:
+    mirror = settings.model_mirror
+    if mirror is not None and not _is_url(mirror):
+        with (Path(mirror) / model_name / file_path).open("rb") as src, incomplete.open("ab" if offset else "wb") as f:
+            src.seek(offset)
+            while chunk := src.read(CHUNK_SIZE):
+                f.write(chunk)
+        return
+
+    if mirror is None:
+        url, headers = hf_hub_url(f"immich-app/{model_name}", file_path), build_hf_headers()
+    else:
+        url, headers = _mirror_url(mirror, model_name, file_path), {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    with get_session().get(url, headers=headers, stream=True, timeout=TIMEOUT_S) as response:
+        response.raise_for_status()
+        # the server may not support ranges, in which case the whole file is sent
+        resumed = response.status_code == 206
+        with incomplete.open("ab" if resumed else "wb") as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+
+
+def _verify(path: Path, file: RemoteFile) -> None:
+    size = path.stat().st_size
+    if file.size is not None and size != file.size:
+        raise OSError(f"Expected '{file.path}' to be {file.size} bytes, got {size}")
+    if file.sha256 is None:
+        return
+
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    if digest.hexdigest() != file.sha256:
+        raise OSError(f"Checksum mismatch for '{file.path}': expected {file.sha256}, got {digest.hexdigest()}")
+
+
+def _is_complete(path: Path, file: RemoteFile) -> bool:
+    # files are only moved into place after being verified
+    return path.is_file() and (file.size is None or path.stat().st_size == file.size)
+
+
+def _is_url(mirror: str) -> bool:
+    return mirror.startswith(("http://", "https://"))
+
+
+def _mirror_url(mirror: str, model_name: str, file_path: str) -> str:
+    return f"{mirror.rstrip('/')}/{quote(model_name)}/{quote(file_path)}"
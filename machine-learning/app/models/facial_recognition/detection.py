@@ -1,33 +1,56 @@
+import math
 from typing import Any
 
+import cv2
 import numpy as np
+import onnx
 from insightface.model_zoo import RetinaFace
+from insightface.model_zoo.retinaface import distance2bbox, distance2kps
 from numpy.typing import NDArray
 
+from app.config import settings
 from app.models.base import InferenceModel
-from app.models.transforms import decode_cv2
-from app.schemas import FaceDetectionOutput, ModelSession, ModelTask, ModelType
+from app.models.transforms import DecodedImage, decode_cv2
+from app.schemas import FaceDetectionOutput, ModelFormat, ModelSession, ModelTask, ModelType
+
+# letterboxed image, scale relative to the original image and score threshold
+DetectionItem = tuple[NDArray[np.uint8], float, float]
 
 
 class FaceDetector(InferenceModel):
     depends = []
     identity = (ModelType.DETECTION, ModelTask.FACIAL_RECOGNITION)
+    supports_batching = True
 
     def __init__(self, model_name: str, min_score: float = 0.7, **model_kwargs: Any) -> None:
         self.min_score = model_kwargs.pop("minScore", min_score)
+        self.input_size = (640, 640)
         super().__init__(model_name, **model_kwargs)
 
     def _load(self) -> ModelSession:
+        if self.batch_window_ms is not None and self.max_batch_size != 1 and self.model_format != ModelFormat.ARMNN:
+            self._ensure_batch_axis()
         session = self._make_session(self.model_path)
         self.model = RetinaFace(session=session)
-        self.model.prepare(ctx_id=0, det_thresh=self.min_score, input_size=(640, 640))
+        self.model.prepare(ctx_id=0, det_thresh=self.min_score, input_size=self.input_size)
 
         return session
 
-    def _predict(self, inputs: NDArray[np.uint8] | bytes, **kwargs: Any) -> FaceDetectionOutput:
+    def _unload(self) -> None:
+        del self.model
+
+    def _warmup_feeds(self, batch_size: int) -> list[dict[str, NDArray[Any]]]:
+        name = self.session.get_inputs()[0].name or "input"
+        width, height = self.input_size
+        return [{name: np.zeros((batch_size, 3, height, width), dtype=np.float32)}]
+
+    def _predict(self, inputs: NDArray[np.uint8] | bytes | DecodedImage, **kwargs: Any) -> FaceDetectionOutput:
         inputs = decode_cv2(inputs)
 
-        bboxes, landmarks = self._detect(inputs)
+        if self.scheduler is None:
+            bboxes, landmarks = self._detect(inputs)
+        else:
+            [(bboxes, landmarks)] = self.scheduler.submit([self._letterbox(inputs)])
         return {
             "boxes": bboxes[:, :4].round(),
             "scores": bboxes[:, 4],
@@ -37,5 +60,92 @@ class FaceDetector(InferenceModel):
     def _detect(self, inputs: NDArray[np.uint8] | bytes) -> tuple[NDArray[np.float32], NDArray[np.float32]]:
         return self.model.detect(inputs)  # type: ignore
 
+    def _predict_batch(self, batch: list[DetectionItem]) -> list[tuple[NDArray[np.float32], NDArray[np.float32]]]:
+        blob: NDArray[np.float32] = cv2.dnn.blobFromImages(  # type: ignore
+            [image for image, _, _ in batch],
+            1.0 / self.model.input_std,
+            self.input_size,
+            (self.model.input_mean, self.model.input_mean, self.model.input_mean),
+            swapRB=True,
+        )
+        net_outs = self.session.run(self.model.output_names, {self.model.input_name: blob})
+        # outputs either have a batch axis or have the anchors of each image concatenated along the first axis
+        net_outs = [out.reshape(len(batch), -1, out.shape[-1]) for out in net_outs]
+        return [
+            self._decode([out[i] for out in net_outs], det_scale, threshold)
+            for i, (_, det_scale, threshold) in enumerate(batch)
+        ]
+
+    def _letterbox(self, image: NDArray[np.uint8]) -> DetectionItem:
+        width, height = self.input_size
+        if image.shape[0] / image.shape[1] > height / width:
+            new_height = height
+            new_width = int(new_height / (image.shape[0] / image.shape[1]))
+        else:
+            new_width = width
+            new_height = int(new_width * (image.shape[0] / image.shape[1]))
+        det_img = np.zeros((height, width, 3), dtype=np.uint8)
+        det_img[:new_height, :new_width] = cv2.resize(image, (new_width, new_height))
+        return det_img, new_height / image.shape[0], self.model.det_thresh
+
+    def _decode(
+        self, net_outs: list[NDArray[np.float32]], det_scale: float, threshold: float
+    ) -> tuple[NDArray[np.float32], NDArray[np.float32]]:
+        fmc = self.model.fmc
+        scores_list, bboxes_list, kpss_list = [], [], []
+        for idx, stride in enumerate(self.model._feat_stride_fpn):
+            scores = net_outs[idx]
+            anchor_centers = self._anchor_centers(stride)
+            pos_inds = np.where(scores >= threshold)[0]
+            scores_list.append(scores[pos_inds])
+            bboxes_list.append(distance2bbox(anchor_centers, net_outs[idx + fmc] * stride)[pos_inds])
+            if self.model.use_kps:
+                kpss = distance2kps(anchor_centers, net_outs[idx + fmc * 2] * stride)
+                kpss_list.append(kpss.reshape((kpss.shape[0], -1, 2))[pos_inds])
+
+        order = np.vstack(scores_list).ravel().argsort()[::-1]
+        pre_det = np.hstack((np.vstack(bboxes_list) / det_scale, np.vstack(scores_list)))
+        pre_det = pre_det.astype(np.float32, copy=False)[order, :]
+        keep = self.model.nms(pre_det)
+        kpss = np.vstack(kpss_list)[order][keep] / det_scale if self.model.use_kps else None
+        return pre_det[keep, :], kpss  # type: ignore
+
+    def _anchor_centers(self, stride: int) -> NDArray[np.float32]:
+        height, width = self.input_size[1] // stride, self.input_size[0] // stride
+        key = (height, width, stride)
+        if key not in self.model.center_cache:
+            anchor_centers = np.stack([*np.mgrid[:height, :width][::-1]], axis=-1).astype(np.float32)
+            anchor_centers = (anchor_centers * stride).reshape((-1, 2))
+            if self.model._num_anchors > 1:
+                anchor_centers = np.stack([anchor_centers] * self.model._num_anchors, axis=1).reshape((-1, 2))
+            self.model.center_cache[key] = anchor_centers
+        centers: NDArray[np.float32] = self.model.center_cache[key]
+        return centers
+
+    def _add_batch_axis(self, proto: onnx.ModelProto) -> bool:
+        if not proto.graph.input[0].type.tensor_type.shape.dim[0].HasField("dim_value"):
+            return False
+        proto.graph.input[0].type.tensor_type.shape.dim[0].dim_param = "batch"
+        for output in proto.graph.output:
+            output.type.tensor_type.shape.dim[0].dim_param = f"{output.name}_anchors"
+        return True
+
+    def min_image_size(self, size: tuple[int, int]) -> tuple[int, int] | None:
+        # the image is resized to fit within the input size
+        scale = min(self.input_size[0] / size[0], self.input_size[1] / size[1])
+        return math.ceil(size[0] * scale), math.ceil(size[1] * scale)
+
     def configure(self, **kwargs: Any) -> None:
         self.model.det_thresh = kwargs.pop("minScore", self.model.det_thresh)
+
+    @property
+    def batch_window_ms(self) -> float | None:
+        return settings.batch_window_ms.face_detection if settings.batch_window_ms else None
+
+    @property
+    def max_batch_size(self) -> int | None:
+        return settings.max_batch_size.face_detection if settings.max_batch_size else None
+
+    @property
+    def ttl_override(self) -> int | None:
+        return settings.model_ttl_override.face_detection if settings.model_ttl_override else None
@@ -0,0 +1,84 @@
+from contextlib import suppress
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, NamedTuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ..schemas import ModelIdentity
+from .transforms import DecodedImage, decode_pil
+
+# writes the preprocessed input of a model for an RGB image to the given array
+Transform = tuple[Callable[..., Any], tuple[int, ...]]
+
+
+class SharedArray(NamedTuple):
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+
+def preprocess(
+    image_bytes: bytes, min_size: tuple[int, int] | None, transforms: dict[ModelIdentity, Transform]
+) -> tuple[SharedArray, dict[ModelIdentity, SharedArray]]:
+    """
+    Decodes an image and applies the given transforms to it, meant to be run in a worker process.
+
+    The decoded RGB image and each transformed array are written to shared memory, so only their names are pickled
+    when returning them to the main process, which is then responsible for unlinking them.
+
+    Args:
+        image_bytes: Encoded image.
+        min_size: Smallest (width, height) to decode the image at, or None for full resolution.
+        transforms: The transform and output shape for each model that preprocessing is done for.
+    """
+
+    created: list[SharedMemory] = []
+
+    def _write(shape: tuple[int, ...], dtype: type[np.generic], write: Callable[[NDArray[Any]], Any]) -> SharedArray:
+        shm = SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+        created.append(shm)
+        write(np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+        return SharedArray(shm.name, shape, np.dtype(dtype).str)
+
+    try:
+        rgb = np.asarray(decode_pil(image_bytes, (lambda _: min_size) if min_size is not None else None))
+        image = _write(rgb.shape, np.uint8, lambda out: np.copyto(out, rgb))
+        outputs = {
+            identity: _write(shape, np.float32, lambda out: transform(rgb, out=out))
+            for identity, (transform, shape) in transforms.items()
+        }
+    except BaseException:
+        for shm in created:
+            with suppress(BufferError):
+                shm.close()
+            shm.unlink()
+        raise
+
+    for shm in created:
+        shm.close()
+    return image, outputs
+
+
+def attach(image: SharedArray, outputs: dict[ModelIdentity, SharedArray]) -> DecodedImage:
+    """Wraps the shared memory written by `preprocess` without copying it. The image must be closed after use."""
+
+    arrays = [image, *outputs.values()]
+    try:
+        shared = [SharedMemory(name=array.name) for array in arrays]
+    except FileNotFoundError:
+        for array in arrays:
+            _unlink(array.name)
+        raise
+
+    rgb, *tensors = [np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf) for array, shm in zip(arrays, shared)]
+    return DecodedImage(rgb[..., ::-1], tensors=dict(zip(outputs, tensors)), shared_memory=shared)
+
+
+def _unlink(name: str) -> None:
+    try:
+        shm = SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
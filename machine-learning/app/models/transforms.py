@@ -1,41 +1,76 @@
 import string
+import threading
+from contextlib import suppress
 from io import BytesIO
-from typing import IO
+from multiprocessing.shared_memory import SharedMemory
+from typing import IO, Any, Callable
 
 import cv2
 import numpy as np
 from numpy.typing import NDArray
 from PIL import Image
 
+from app.models.constants import get_mrl_dimension
+from app.schemas import Embedding, EmbeddingDtype, ModelIdentity
+
 _PIL_RESAMPLING_METHODS = {resampling.name.lower(): resampling for resampling in Image.Resampling}
 _PUNCTUATION_TRANS = str.maketrans("", "", string.punctuation)
 
 
-def resize_pil(img: Image.Image, size: int) -> Image.Image:
-    if img.width < img.height:
-        return img.resize((size, int((img.height / img.width) * size)), resample=Image.Resampling.BICUBIC)
-    else:
-        return img.resize((int((img.width / img.height) * size), size), resample=Image.Resampling.BICUBIC)
-
-
-# https://stackoverflow.com/a/60883103
-def crop_pil(img: Image.Image, size: int) -> Image.Image:
-    left = int((img.size[0] / 2) - (size / 2))
-    upper = int((img.size[1] / 2) - (size / 2))
-    right = left + size
-    lower = upper + size
-
-    return img.crop((left, upper, right, lower))
-
-
-def to_numpy(img: Image.Image) -> NDArray[np.float32]:
-    return np.asarray(img if img.mode == "RGB" else img.convert("RGB"), dtype=np.float32) / 255.0
+def crop_window(width: int, height: int, size: int) -> tuple[int, int, int, int]:
+    """
+    Returns the region (x1, y1, x2, y2) of an image that is kept by resizing its shorter side to `size` and
+    cropping the centre square.
+    """
 
-
-def normalize(
-    img: NDArray[np.float32], mean: float | NDArray[np.float32], std: float | NDArray[np.float32]
+    if width < height:
+        new_width, new_height = size, int((height / width) * size)
+    else:
+        new_width, new_height = int((width / height) * size), size
+    left = int((new_width / 2) - (size / 2))
+    upper = int((new_height / 2) - (size / 2))
+    scale_x, scale_y = width / new_width, height / new_height
+    return (
+        round(left * scale_x),
+        round(upper * scale_y),
+        round((left + size) * scale_x),
+        round((upper + size) * scale_y),
+    )
+
+
+def resize_crop_normalize(
+    image: NDArray[np.uint8],
+    size: int,
+    scale: NDArray[np.float32],
+    shift: NDArray[np.float32],
+    out: NDArray[np.float32],
 ) -> NDArray[np.float32]:
-    return np.divide(img - mean, std, dtype=np.float32)
+    """
+    Fused equivalent of resizing the shorter side to `size` with PIL's bicubic filter, cropping the centre square,
+    normalizing and transposing to CHW. Only the cropped region is resampled, and no intermediate float arrays
+    are allocated.
+
+    The output is close to, but not identical to, PIL's. Embeddings of images encoded before this was introduced
+    differ slightly from new ones, so Smart Search should be re-run on all assets for consistent results.
+
+    Args:
+        image: RGB image.
+        size: Side length of the square output.
+        scale: Factor for each RGB channel, i.e. `1 / (255 * std)`.
+        shift: Offset for each RGB channel, i.e. `-mean / std`.
+        out: Float32 array of shape (3, size, size) to write the RGB channels to.
+    """
+
+    x1, y1, x2, y2 = crop_window(image.shape[1], image.shape[0], size)
+    region = image[y1:y2, x1:x2]
+    # area interpolation averages over the source pixels when downsampling, similarly to PIL's antialiased filters.
+    # cubic interpolation would be closer to PIL when upsampling, but samples too few pixels when downsampling
+    interpolation = cv2.INTER_AREA if region.shape[0] > size else cv2.INTER_CUBIC
+    resized = cv2.resize(region, (size, size), interpolation=interpolation)
+    for channel in range(3):
+        np.multiply(resized[..., channel], scale[channel], out=out[channel])
+        out[channel] += shift[channel]
+    return out
 
 
 def get_pil_resampling(resample: str) -> Image.Resampling:
@@ -43,20 +78,42 @@ def get_pil_resampling(resample: str) -> Image.Resampling:
 
 
 def pil_to_cv2(image: Image.Image) -> NDArray[np.uint8]:
-    return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)  # type: ignore
+    return rgb_to_cv2(np.array(image))
+
+
+def rgb_to_cv2(image: NDArray[np.uint8]) -> NDArray[np.uint8]:
+    return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)  # type: ignore
 
 
-def decode_pil(image_bytes: bytes | IO[bytes] | Image.Image) -> Image.Image:
+def decode_pil(
+    image_bytes: "bytes | IO[bytes] | Image.Image | NDArray[np.uint8] | DecodedImage",
+    min_size: Callable[[tuple[int, int]], tuple[int, int] | None] | None = None,
+) -> Image.Image:
+    """
+    Args:
+        image_bytes: Encoded image, or an already decoded image.
+        min_size: Gets the smallest (width, height) needed for an image of the given size, or None for full
+            resolution. JPEGs are decoded at the smallest 1/2, 1/4 or 1/8 scale that is at least this size.
+    """
+
     if isinstance(image_bytes, Image.Image):
         return image_bytes
+    if isinstance(image_bytes, DecodedImage):
+        return image_bytes.pil
+    if isinstance(image_bytes, np.ndarray):
+        return Image.fromarray(image_bytes[..., ::-1])
     image: Image.Image = Image.open(BytesIO(image_bytes) if isinstance(image_bytes, bytes) else image_bytes)
+    if min_size is not None and (size := min_size(image.size)) is not None:
+        image.draft("RGB", size)  # no-op if not a JPEG
     image.load()
     if not image.mode == "RGB":
         image = image.convert("RGB")
     return image
 
 
-def decode_cv2(image_bytes: NDArray[np.uint8] | bytes | Image.Image) -> NDArray[np.uint8]:
+def decode_cv2(image_bytes: "NDArray[np.uint8] | bytes | Image.Image | DecodedImage") -> NDArray[np.uint8]:
+    if isinstance(image_bytes, DecodedImage):
+        return image_bytes.bgr
     if isinstance(image_bytes, bytes):
         image_bytes = decode_pil(image_bytes)  # pillow is much faster than cv2
     if isinstance(image_bytes, Image.Image):
@@ -64,6 +121,128 @@ def decode_cv2(image_bytes: NDArray[np.uint8] | bytes | Image.Image) -> NDArray[
     return image_bytes
 
 
+class DecodedImage:
+    """
+    An image decoded once per request and shared by the models of its pipeline.
+
+    Each representation that a model asks for is built on first use and reused afterwards.
+    """
+
+    def __init__(
+        self,
+        image: Image.Image | NDArray[np.uint8],
+        tensors: dict[ModelIdentity, NDArray[np.float32]] | None = None,
+        shared_memory: list[SharedMemory] | None = None,
+    ) -> None:
+        """
+        Args:
+            image: A PIL image, or a BGR array as given to cv2.
+            tensors: Inputs that were already preprocessed for the models with these identities.
+            shared_memory: Shared memory that the image and tensors are views of, released by `close`.
+        """
+
+        self._pil = image if isinstance(image, Image.Image) else None
+        self._bgr = image if isinstance(image, np.ndarray) else None
+        self._rgb: NDArray[np.uint8] | None = None
+        self.tensors = tensors if tensors is not None else {}
+        self.shared_memory = shared_memory if shared_memory is not None else []
+        # models of a request run concurrently
+        self._lock = threading.RLock()
+
+    @property
+    def pil(self) -> Image.Image:
+        with self._lock:
+            if self._pil is None:
+                self._pil = Image.fromarray(self.rgb)
+            return self._pil
+
+    @property
+    def rgb(self) -> NDArray[np.uint8]:
+        with self._lock:
+            if self._rgb is None:
+                self._rgb = np.asarray(self._pil) if self._pil is not None else self.bgr[..., ::-1]
+            return self._rgb
+
+    @property
+    def bgr(self) -> NDArray[np.uint8]:
+        with self._lock:
+            if self._bgr is None:
+                self._bgr = rgb_to_cv2(self.rgb)
+            return self._bgr
+
+    @property
+    def width(self) -> int:
+        return self._pil.width if self._pil is not None else self.rgb.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self._pil.height if self._pil is not None else self.rgb.shape[0]
+
+    def close(self) -> None:
+        """Unlinks the shared memory of the image, if any, after which its arrays must not be used."""
+
+        if not self.shared_memory:
+            return
+        self._rgb = self._bgr = None
+        self.tensors = {}
+        for shm in self.shared_memory:
+            # if still referenced elsewhere, it's unmapped once that reference is released
+            with suppress(BufferError):
+                shm.close()
+            shm.unlink()
+        self.shared_memory = []
+
+
+def decode_rgb_buffer(buffer: bytes, width: int, height: int) -> NDArray[np.uint8]:
+    """Wraps packed 8-bit RGB pixels in a BGR image without copying them."""
+    if width <= 0 or height <= 0 or len(buffer) != width * height * 3:
+        raise ValueError(f"Expected {width * height * 3} bytes for a {width}x{height} RGB image, got {len(buffer)}")
+    rgb = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 3)
+    return rgb[..., ::-1]
+
+
+def decode_rgb(image: bytes | Image.Image | NDArray[np.uint8] | DecodedImage) -> NDArray[np.uint8]:
+    if isinstance(image, DecodedImage):
+        return image.rgb
+    if isinstance(image, np.ndarray):
+        return image[..., ::-1]
+    return np.asarray(decode_pil(image))
+
+
+def quantize_embedding(embedding: NDArray[np.float32], dtype: EmbeddingDtype | str) -> Embedding:
+    match EmbeddingDtype(dtype):
+        case EmbeddingDtype.FLOAT32:
+            return embedding
+        case EmbeddingDtype.FLOAT16:
+            return embedding.astype(np.float16)
+        case EmbeddingDtype.INT8:
+            # symmetric quantization, so the embedding is approximately `values * scale`
+            scale = float(np.abs(embedding).max()) / 127 or 1.0
+            values = np.clip(np.rint(embedding / scale), -127, 127).astype(np.int8)
+            return {"values": values, "scale": scale}
+
+
+def validate_embedding_dimension(model_name: str, dimension: Any) -> int:
+    full_dimension = get_mrl_dimension(model_name)
+    if full_dimension is None:
+        raise ValueError(f"Model '{model_name}' does not support truncated embeddings")
+    # bool is a subclass of int, and floats aren't silently rounded
+    if isinstance(dimension, bool) or not isinstance(dimension, int):
+        raise ValueError(f"Embedding dimension must be an integer, got {dimension!r}")
+    if not 0 < dimension <= full_dimension:
+        raise ValueError(f"Embedding dimension must be between 1 and {full_dimension}, got {dimension}")
+    return dimension
+
+
+def truncate_embedding(embedding: NDArray[np.float32], dimension: int) -> NDArray[np.float32]:
+    """Keeps the first `dimension` values of an MRL embedding, normalized to unit length again."""
+
+    truncated = embedding[..., :dimension]
+    norm = np.linalg.norm(truncated, axis=-1, keepdims=True)
+    normalized: NDArray[np.float32] = (truncated / np.maximum(norm, 1e-12)).astype(np.float32)
+    return normalized
+
+
 def clean_text(text: str, canonicalize: bool = False) -> str:
     text = " ".join(text.split())
     if canonicalize:
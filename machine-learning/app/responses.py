@@ -0,0 +1,141 @@
+import struct
+from typing import Any
+
+import numpy as np
+import orjson
+from fastapi.responses import Response
+from numpy.typing import NDArray
+
+from .schemas import FacialRecognitionOutput, ModelTask
+
+PACKED_MEDIA_TYPE = "application/vnd.immich.ml.packed"
+
+# buffers start at multiples of this so clients can view them as typed arrays without copying
+_ALIGNMENT = 8
+_HEADER_LENGTH = struct.Struct("<I")
+
+
+def pack(content: Any) -> bytes:
+    """
+    Serializes content with its arrays stored as raw little-endian buffers.
+
+    The layout is a 4-byte little-endian header length, a JSON header and the array buffers. The header has the
+    content under "data", where each array is replaced by {"$array": index}, and the dtype, shape and offset of each
+    buffer relative to the start of the buffer section under "arrays".
+    """
+
+    arrays: list[NDArray[Any]] = []
+
+    def _replace(obj: Any) -> Any:
+        match obj:
+            case np.ndarray():
+                arrays.append(np.ascontiguousarray(obj, dtype=obj.dtype.newbyteorder("<")))
+                return {"$array": len(arrays) - 1}
+            case np.generic():
+                return obj.item()
+            case dict():
+                return {key: _replace(value) for key, value in obj.items()}
+            case list() | tuple():
+                return [_replace(value) for value in obj]
+            case _:
+                return obj
+
+    data = _replace(content)
+    offsets: list[int] = []
+    offset = 0
+    for array in arrays:
+        offset = _align(offset)
+        offsets.append(offset)
+        offset += array.nbytes
+    specs = [
+        {"dtype": array.dtype.str, "shape": array.shape, "offset": offset} for array, offset in zip(arrays, offsets)
+    ]
+
+    header = orjson.dumps({"data": data, "arrays": specs}, option=orjson.OPT_NON_STR_KEYS)
+    header += b" " * (_align(_HEADER_LENGTH.size + len(header)) - _HEADER_LENGTH.size - len(header))
+    packed = bytearray(_HEADER_LENGTH.pack(len(header)) + header)
+    start = len(packed)
+    for array, offset in zip(arrays, offsets):
+        packed += bytes(start + offset - len(packed))
+        packed += array.tobytes()
+    return bytes(packed)
+
+
+def unpack(packed: bytes) -> Any:
+    """Inverse of `pack`. Arrays are read-only views of the packed buffer."""
+
+    (header_length,) = _HEADER_LENGTH.unpack_from(packed)
+    start = _HEADER_LENGTH.size + header_length
+    header = orjson.loads(packed[_HEADER_LENGTH.size : start])
+    arrays = [
+        np.frombuffer(
+            packed,
+            dtype=np.dtype(spec["dtype"]),
+            count=int(np.prod(spec["shape"])),
+            offset=start + spec["offset"],
+        ).reshape(spec["shape"])
+        for spec in header["arrays"]
+    ]
+
+    def _restore(obj: Any) -> Any:
+        match obj:
+            case {"$array": int(index)}:
+                return arrays[index]
+            case dict():
+                return {key: _restore(value) for key, value in obj.items()}
+            case list():
+                return [_restore(value) for value in obj]
+            case _:
+                return obj
+
+    return _restore(header["data"])
+
+
+def pack_faces(faces: FacialRecognitionOutput) -> dict[str, NDArray[Any]]:
+    """
+    Converts detected faces to contiguous arrays of boxes, scores and embeddings.
+
+    Quantized embeddings are packed as their int8 values, with their scales in a separate array.
+    """
+
+    if not faces:
+        return {
+            "boxes": np.empty((0, 4), dtype=np.float32),
+            "scores": np.empty(0, dtype=np.float32),
+            "embeddings": np.empty((0, 0), dtype=np.float32),
+        }
+    packed: dict[str, NDArray[Any]] = {
+        "boxes": np.array(
+            [[face["boundingBox"][key] for key in ("x1", "y1", "x2", "y2")] for face in faces], dtype=np.float32
+        ),
+        "scores": np.array([face["score"] for face in faces], dtype=np.float32),
+    }
+    quantized = [face["embedding"] for face in faces if isinstance(face["embedding"], dict)]
+    if quantized:
+        packed["embeddings"] = np.stack([embedding["values"] for embedding in quantized])
+        packed["embeddingScales"] = np.array([embedding["scale"] for embedding in quantized], dtype=np.float32)
+    else:
+        packed["embeddings"] = np.stack([face["embedding"] for face in faces])  # type: ignore[misc]
+    return packed
+
+
+class PackedResponse(Response):
+    media_type = PACKED_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, list):
+            return pack([self._columnar(item) for item in content])
+        return pack(self._columnar(content))
+
+    def _columnar(self, content: dict[str, Any]) -> dict[str, Any]:
+        if ModelTask.FACIAL_RECOGNITION in content:
+            return {**content, ModelTask.FACIAL_RECOGNITION: pack_faces(content[ModelTask.FACIAL_RECOGNITION])}
+        return content
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def accepts_packed(accept: str | None) -> bool:
+    return accept is not None and PACKED_MEDIA_TYPE in accept
@@ -35,6 +35,13 @@ class ModelType(StrEnum):
 class ModelFormat(StrEnum):
     ARMNN = "armnn"
     ONNX = "onnx"
+    ONNX_INT8 = "int8.onnx"
+
+
+class EmbeddingDtype(StrEnum):
+    FLOAT32 = "float32"
+    FLOAT16 = "float16"
+    INT8 = "int8"
 
 
 class ModelSource(StrEnum):
@@ -67,19 +74,23 @@ class ModelSession(Protocol):
     def get_outputs(self) -> list[SessionNode]: ...
 
 
-class HasProfiling(Protocol):
-    profiling: dict[str, float]
-
-
 class FaceDetectionOutput(TypedDict):
     boxes: npt.NDArray[np.float32]
     scores: npt.NDArray[np.float32]
     landmarks: npt.NDArray[np.float32]
 
 
+class QuantizedEmbedding(TypedDict):
+    values: npt.NDArray[np.int8]
+    scale: float
+
+
+Embedding = npt.NDArray[np.float32] | npt.NDArray[np.float16] | QuantizedEmbedding
+
+
 class DetectedFace(TypedDict):
     boundingBox: BoundingBox
-    embedding: npt.NDArray[np.float32]
+    embedding: Embedding
     score: float
 
 
@@ -107,10 +118,6 @@ InferenceEntries = tuple[list[InferenceEntry], list[InferenceEntry]]
 InferenceResponse = dict[ModelTask | Literal["imageHeight"] | Literal["imageWidth"], Any]
 
 
-def has_profiling(obj: Any) -> TypeGuard[HasProfiling]:
-    return hasattr(obj, "profiling") and isinstance(obj.profiling, dict)
-
-
 def is_ndarray(obj: Any, dtype: "type[np._DTypeScalar_co]") -> "TypeGuard[npt.NDArray[np._DTypeScalar_co]]":
     return isinstance(obj, np.ndarray) and obj.dtype == dtype
 
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import tempfile
 from pathlib import Path
 from typing import Any
 
@@ -12,6 +13,9 @@ from app.schemas import SessionNode
 
 from ..config import log, settings
 
+# providers whose graph optimizations can be saved, unlike those that compile the graph themselves
+OPTIMIZABLE_PROVIDERS = {"CUDAExecutionProvider", "CPUExecutionProvider"}
+
 
 class OrtSession:
     def __init__(
@@ -20,17 +24,16 @@ class OrtSession:
         providers: list[str] | None = None,
         provider_options: list[dict[str, Any]] | None = None,
         sess_options: ort.SessionOptions | None = None,
+        inter_op_threads: int | None = None,
+        intra_op_threads: int | None = None,
     ):
         self.model_path = Path(model_path)
+        self.inter_op_threads = inter_op_threads if inter_op_threads is not None else settings.model_inter_op_threads
+        self.intra_op_threads = intra_op_threads if intra_op_threads is not None else settings.model_intra_op_threads
         self.providers = providers if providers is not None else self._providers_default
         self.provider_options = provider_options if provider_options is not None else self._provider_options_default
         self.sess_options = sess_options if sess_options is not None else self._sess_options_default
-        self.session = ort.InferenceSession(
-            self.model_path.as_posix(),
-            providers=self.providers,
-            provider_options=self.provider_options,
-            sess_options=self.sess_options,
-        )
+        self.session = self._make_session()
 
     def get_inputs(self) -> list[SessionNode]:
         inputs: list[SessionNode] = self.session.get_inputs()
@@ -49,6 +52,100 @@ class OrtSession:
         outputs: list[NDArray[np.float32]] = self.session.run(output_names, input_feed, run_options)
         return outputs
 
+    def _make_session(self) -> ort.InferenceSession:
+        optimized_path = self.optimized_model_path
+        if optimized_path is None:
+            return self._inference_session(self.model_path)
+
+        # ORT raises a variety of exceptions for invalid models, and the original model can be used regardless
+        if not self._is_fresh(optimized_path):
+            try:
+                self._save_optimized(optimized_path)
+            except Exception as e:
+                log.warning(f"Failed to save optimized model for '{self.model_path}': {e}")
+                return self._inference_session(self.model_path)
+
+        try:
+            return self._inference_session(optimized_path)
+        except Exception as e:
+            log.warning(f"Failed to load optimized model '{optimized_path}'. Using the original model instead: {e}")
+            self._remove_optimized(optimized_path)
+            return self._inference_session(self.model_path)
+
+    def _inference_session(self, model_path: Path) -> ort.InferenceSession:
+        return ort.InferenceSession(
+            model_path.as_posix(),
+            providers=self.providers,
+            provider_options=self.provider_options,
+            sess_options=self.sess_options,
+        )
+
+    def _save_optimized(self, optimized_path: Path) -> None:
+        """
+        Saves the model after applying the graph optimizations that don't depend on the hardware, so that they
+        don't need to be applied again each time the model is loaded.
+        """
+
+        log.info(f"Optimizing model '{self.model_path}' for faster loading. This may take a while.")
+        optimized_path.parent.mkdir(parents=True, exist_ok=True)
+        # artifacts of this model for older ORT versions are no longer used
+        for stale in optimized_path.parent.glob(f"{self.model_path.stem}.ort*.{self._provider_key}.onnx*"):
+            stale.unlink(missing_ok=True)
+
+        # written to a temporary folder first, so that other processes never see a partially written model
+        with tempfile.TemporaryDirectory(dir=optimized_path.parent) as tmp:
+            tmp_path = Path(tmp) / optimized_path.name
+            sess_options = ort.SessionOptions()
+            # limited to the same threads as the model's own session, as other models may be serving meanwhile
+            sess_options.inter_op_num_threads = self.sess_options.inter_op_num_threads
+            sess_options.intra_op_num_threads = self.sess_options.intra_op_num_threads
+            sess_options.execution_mode = self.sess_options.execution_mode
+            sess_options.enable_cpu_mem_arena = self.sess_options.enable_cpu_mem_arena
+            sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+            sess_options.optimized_model_filepath = tmp_path.as_posix()
+            # models over 2 GiB can only be saved with their weights in a separate file
+            data_name = f"{optimized_path.name}.data"
+            sess_options.add_session_config_entry("session.optimized_model_external_initializers_file_name", data_name)
+            sess_options.add_session_config_entry(
+                "session.optimized_model_external_initializers_min_size_in_bytes", "1024"
+            )
+            ort.InferenceSession(
+                self.model_path.as_posix(),
+                providers=self.providers,
+                provider_options=self.provider_options,
+                sess_options=sess_options,
+            )
+            if (tmp_path.parent / data_name).is_file():
+                (tmp_path.parent / data_name).replace(optimized_path.with_name(data_name))
+            tmp_path.replace(optimized_path)
+
+    def _is_fresh(self, optimized_path: Path) -> bool:
+        # the original model is replaced when it's downloaded again or converted to have a batch axis
+        return optimized_path.is_file() and optimized_path.stat().st_mtime >= self.model_path.stat().st_mtime
+
+    def _remove_optimized(self, optimized_path: Path) -> None:
+        optimized_path.unlink(missing_ok=True)
+        optimized_path.with_name(f"{optimized_path.name}.data").unlink(missing_ok=True)
+
+    @property
+    def optimized_model_path(self) -> Path | None:
+        """Where the optimized model is cached for the current ORT version and provider, if it can be."""
+
+        if (
+            not settings.cache_optimized_models
+            or not self.providers
+            or not set(self.providers) <= OPTIMIZABLE_PROVIDERS
+            or self.model_path.suffix != ".onnx"
+            or not self.model_path.is_file()
+        ):
+            return None
+        name = f"{self.model_path.stem}.ort{ort.__version__}.{self._provider_key}.onnx"
+        return self.model_path.parent / "optimized" / name
+
+    @property
+    def _provider_key(self) -> str:
+        return self.providers[0].removesuffix("ExecutionProvider").lower()
+
     @property
     def providers(self) -> list[str]:
         return self._providers
@@ -118,18 +215,23 @@ class OrtSession:
         sess_options.enable_cpu_mem_arena = False
 
         # avoid thread contention between models
-        if settings.model_inter_op_threads > 0:
-            sess_options.inter_op_num_threads = settings.model_inter_op_threads
+        if self.inter_op_threads > 0:
+            sess_options.inter_op_num_threads = self.inter_op_threads
         # these defaults work well for CPU, but bottleneck GPU
-        elif settings.model_inter_op_threads == 0 and self.providers == ["CPUExecutionProvider"]:
+        elif self.inter_op_threads == 0 and self.providers == ["CPUExecutionProvider"]:
             sess_options.inter_op_num_threads = 1
 
-        if settings.model_intra_op_threads > 0:
-            sess_options.intra_op_num_threads = settings.model_intra_op_threads
-        elif settings.model_intra_op_threads == 0 and self.providers == ["CPUExecutionProvider"]:
+        if self.intra_op_threads > 0:
+            sess_options.intra_op_num_threads = self.intra_op_threads
+        elif self.intra_op_threads == 0 and self.providers == ["CPUExecutionProvider"]:
             sess_options.intra_op_num_threads = 2
 
         if sess_options.inter_op_num_threads > 1:
             sess_options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
 
+        # weights in a separate data file are memory-mapped by ORT, but then copied to the heap in the layout the CPU
+        # kernels prefer. without that copy, they're read from the file's pages, which can be shared and reclaimed
+        if settings.mmap_model_weights:
+            sess_options.add_session_config_entry("session.disable_prepacking", "1")
+
         return sess_options
@@ -1,6 +1,13 @@
+import asyncio
+import hashlib
 import json
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from io import BytesIO
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
 from random import randint
 from types import SimpleNamespace
@@ -9,29 +16,57 @@ from unittest import mock
 
 import cv2
 import numpy as np
+import onnx
 import onnxruntime as ort
 import pytest
 from fastapi import HTTPException
 from fastapi.testclient import TestClient
+from insightface.model_zoo import RetinaFace
+from numpy.typing import NDArray
 from PIL import Image
 from pytest import MonkeyPatch
 from pytest_mock import MockerFixture
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import Whitespace
 
-from app.main import load, preload_models
+import gunicorn_conf
+from app.main import app, get_load_wait, load, min_image_size, model_cache, preload_models
+from app.models.batching import BatchScheduler
 from app.models.clip.textual import MClipTextualEncoder, OpenClipTextualEncoder
 from app.models.clip.visual import OpenClipVisualEncoder
+from app.models.download import MANIFEST_NAME, download_model
 from app.models.facial_recognition.detection import FaceDetector
 from app.models.facial_recognition.recognition import FaceRecognizer
+from app.models.preprocessing import attach, preprocess
+from app.models.transforms import (
+    DecodedImage,
+    crop_window,
+    decode_cv2,
+    decode_pil,
+    decode_rgb_buffer,
+    resize_crop_normalize,
+)
 from app.sessions.ann import AnnSession
 from app.sessions.ort import OrtSession
 
-from .config import Settings, settings
+from .config import BatchWindow, MaxBatchSize, ModelTTL, PreloadModelData, Settings, settings
 from .models.base import InferenceModel
 from .models.cache import ModelCache
+from .responses import PACKED_MEDIA_TYPE, PackedResponse, pack, unpack
 from .schemas import ModelFormat, ModelTask, ModelType
 
 
 class TestBase:
+    def test_does_not_batch_models_without_batching_support(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "batch_window_ms", BatchWindow(clip_textual=5))
+        mocker.patch.object(OpenClipTextualEncoder, "supports_batching", False)
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai")
+        encoder.session = mock.Mock()
+        encoder.session.get_inputs.return_value = [SimpleNamespace(name="text", shape=["batch", 77])]
+
+        assert encoder._make_scheduler() is None
+
     def test_sets_default_cache_dir(self) -> None:
         encoder = OpenClipTextualEncoder("ViT-B-32__openai")
 
@@ -60,6 +95,82 @@ class TestBase:
 
         assert encoder.model_format == ModelFormat.ARMNN
 
+    def test_sets_default_model_format_to_int8_if_quantized_models(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ann", False)
+        mocker.patch.object(settings, "quantized_models", True)
+
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="/test_cache")
+
+        assert encoder.model_format == ModelFormat.ONNX_INT8
+        assert encoder.model_path == Path("/test_cache/textual/model.int8.onnx")
+
+    def test_looks_for_int8_variant_if_only_fp32_model_is_cached(self, tmp_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ann", False)
+        mocker.patch.object(settings, "quantized_models", True)
+        (tmp_path / "textual").mkdir()
+        (tmp_path / "textual" / "model.onnx").touch()
+
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir=tmp_path)
+
+        assert encoder.model_format == ModelFormat.ONNX_INT8
+        assert not encoder.cached
+
+    def test_uses_fp32_model_if_int8_variant_is_recorded_missing(self, tmp_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ann", False)
+        mocker.patch.object(settings, "quantized_models", True)
+        (tmp_path / "textual").mkdir()
+        (tmp_path / "textual" / "model.onnx").touch()
+        (tmp_path / "textual" / "model.int8.onnx.missing").touch()
+
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir=tmp_path)
+
+        assert encoder.model_format == ModelFormat.ONNX
+        assert encoder.cached
+
+    def test_records_missing_int8_variant(self, tmp_path: Path, download_model: mock.Mock, info: mock.Mock) -> None:
+        download_model.side_effect = lambda *args, **kwargs: (tmp_path / "textual" / "model.onnx").touch()
+        (tmp_path / "textual").mkdir()
+
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir=tmp_path, model_format=ModelFormat.ONNX_INT8)
+        encoder.download()
+
+        assert encoder.model_format == ModelFormat.ONNX
+        assert (tmp_path / "textual" / "model.int8.onnx.missing").is_file()
+        info.assert_any_call("Model 'ViT-B-32__openai' does not have an INT8 variant. Using the FP32 model instead.")
+
+    def test_uses_cached_fp32_model_if_int8_download_fails(
+        self, tmp_path: Path, download_model: mock.Mock, warning: mock.Mock
+    ) -> None:
+        download_model.side_effect = OSError("unreachable")
+        (tmp_path / "textual").mkdir()
+        (tmp_path / "textual" / "model.onnx").touch()
+
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir=tmp_path, model_format=ModelFormat.ONNX_INT8)
+        encoder.download()
+
+        assert encoder.model_format == ModelFormat.ONNX
+        assert not (tmp_path / "textual" / "model.int8.onnx.missing").exists()
+        warning.assert_called_once()
+
+    def test_raises_if_int8_download_fails_without_fp32_model(self, tmp_path: Path, download_model: mock.Mock) -> None:
+        download_model.side_effect = OSError("unreachable")
+
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir=tmp_path, model_format=ModelFormat.ONNX_INT8)
+
+        with pytest.raises(OSError):
+            encoder.download()
+
+    def test_uses_cached_int8_variant_if_quantized_models(self, tmp_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "ann", False)
+        mocker.patch.object(settings, "quantized_models", True)
+        (tmp_path / "textual").mkdir()
+        (tmp_path / "textual" / "model.onnx").touch()
+        (tmp_path / "textual" / "model.int8.onnx").touch()
+
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir=tmp_path)
+
+        assert encoder.model_format == ModelFormat.ONNX_INT8
+
     def test_sets_model_format_kwarg(self, mocker: MockerFixture) -> None:
         mocker.patch.object(settings, "ann", False)
         mocker.patch("ann.ann.is_available", False)
@@ -74,6 +185,116 @@ class TestBase:
 
         assert encoder.cache_dir == Path(cache_dir)
 
+    def test_load_measures_memory_usage(self, mocker: MockerFixture) -> None:
+        mocker.patch("app.models.base.get_rss", side_effect=[2**20, 3 * 2**20])
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "_load")
+        mocker.patch.object(OpenClipTextualEncoder, "_make_scheduler", return_value=None)
+
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai")
+        encoder.load()
+
+        assert encoder.memory_usage == 2 * 2**20
+
+    def test_concurrent_loads_are_measured_separately(self, mocker: MockerFixture) -> None:
+        rss = 0
+        loading = threading.Barrier(2, timeout=0.5)
+
+        def _load(model: InferenceModel) -> mock.Mock:
+            nonlocal rss
+            try:
+                # would pass if both models could load at once, counting each other's allocations
+                loading.wait()
+            except threading.BrokenBarrierError:
+                pass
+            rss += 2**20 if isinstance(model, OpenClipTextualEncoder) else 4 * 2**20
+            return mock.Mock()
+
+        mocker.patch("app.models.base.get_rss", side_effect=lambda: rss)
+        mocker.patch.object(InferenceModel, "download")
+        mocker.patch.object(InferenceModel, "_make_scheduler", return_value=None)
+        mocker.patch.object(OpenClipTextualEncoder, "_load", autospec=True, side_effect=_load)
+        mocker.patch.object(OpenClipVisualEncoder, "_load", autospec=True, side_effect=_load)
+        textual = OpenClipTextualEncoder("ViT-B-32__openai")
+        visual = OpenClipVisualEncoder("ViT-B-32__openai")
+
+        with ThreadPoolExecutor(2) as pool:
+            list(pool.map(lambda model: model.load(), [textual, visual]))
+
+        assert textual.memory_usage == 2**20
+        assert visual.memory_usage == 4 * 2**20
+
+    def test_unload(self, mocker: MockerFixture) -> None:
+        scheduler = mock.Mock()
+        mocker.patch.object(OpenClipTextualEncoder, "_make_scheduler", return_value=scheduler)
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "_load")
+
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai")
+        encoder.load()
+        encoder.unload()
+
+        assert not encoder.loaded
+        assert not hasattr(encoder, "session")
+        assert encoder.scheduler is None
+        assert encoder.memory_usage == 0
+        scheduler.close.assert_called_once()
+
+    def test_ttl_override(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "model_ttl", 300)
+        mocker.patch.object(settings, "model_ttl_override", ModelTTL(clip_textual=0))
+
+        assert OpenClipTextualEncoder("ViT-B-32__openai").ttl == 0
+        assert OpenClipVisualEncoder("ViT-B-32__openai").ttl == 300
+
+    def test_warmup_runs_each_batch_size(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "max_batch_size", MaxBatchSize(clip_visual=4))
+        session = mock.Mock()
+        session.get_inputs.return_value = [
+            SimpleNamespace(name="image", shape=("batch", 3, 224, 224), type="tensor(float)")
+        ]
+
+        encoder = OpenClipVisualEncoder("ViT-B-32__openai", session=session)
+        encoder.warmup()
+
+        shapes = [call.args[1]["image"].shape for call in session.run.call_args_list]
+        assert shapes == [(1, 3, 224, 224), (4, 3, 224, 224)]
+        assert session.run.call_args.args[1]["image"].dtype == np.float32
+        assert encoder.warmup_time is not None
+
+    def test_warmup_uses_detection_input_size(self) -> None:
+        session = mock.Mock()
+        session.get_inputs.return_value = [SimpleNamespace(name="input.1", shape=("batch", 3, "?", "?"))]
+
+        detector = FaceDetector("buffalo_s", session=session)
+        detector.warmup()
+
+        session.run.assert_called_once()
+        assert session.run.call_args.args[1]["input.1"].shape == (1, 3, 640, 640)
+
+    def test_warmup_failure_is_logged(self, warning: mock.Mock) -> None:
+        session = mock.Mock()
+        session.get_inputs.return_value = [SimpleNamespace(name="image", shape=(1, 3, 224, 224))]
+        session.run.side_effect = RuntimeError("bad input")
+
+        encoder = OpenClipVisualEncoder("ViT-B-32__openai", session=session)
+        encoder.warmup()
+
+        assert encoder.warmup_time is None
+        warning.assert_called_once()
+
+    def test_load_warms_up_if_enabled(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "model_warmup", True)
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "_load")
+        mocker.patch.object(OpenClipTextualEncoder, "_make_scheduler", return_value=None)
+        warmup = mocker.patch.object(OpenClipTextualEncoder, "warmup")
+
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai")
+        encoder.load()
+
+        warmup.assert_called_once()
+
     def test_clear_cache(self, rmtree: mock.Mock, path: mock.Mock, info: mock.Mock) -> None:
         encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir=path)
         encoder.clear_cache()
@@ -116,30 +337,28 @@ class TestBase:
         path.return_value.mkdir.assert_called_once()
         warning.assert_called_once()
 
-    def test_download(self, snapshot_download: mock.Mock) -> None:
+    def test_download(self, download_model: mock.Mock) -> None:
         encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="/path/to/cache")
         encoder.download()
 
-        snapshot_download.assert_called_once_with(
-            "immich-app/ViT-B-32__openai",
-            cache_dir=encoder.cache_dir,
-            local_dir=encoder.cache_dir,
-            ignore_patterns=["*.armnn"],
+        download_model.assert_called_once_with(
+            "ViT-B-32__openai", encoder.cache_dir, ignore_patterns=["*.armnn", "*.int8.onnx*"]
         )
 
-    def test_download_downloads_armnn_if_preferred_format(self, snapshot_download: mock.Mock) -> None:
+    def test_download_downloads_armnn_if_preferred_format(self, download_model: mock.Mock) -> None:
         encoder = OpenClipTextualEncoder("ViT-B-32__openai", model_format=ModelFormat.ARMNN)
         encoder.download()
 
-        snapshot_download.assert_called_once_with(
-            "immich-app/ViT-B-32__openai",
-            cache_dir=encoder.cache_dir,
-            local_dir=encoder.cache_dir,
-            ignore_patterns=[],
-        )
+        download_model.assert_called_once_with("ViT-B-32__openai", encoder.cache_dir, ignore_patterns=["*.int8.onnx*"])
+
+    def test_download_downloads_int8_if_preferred_format(self, tmp_path: Path, download_model: mock.Mock) -> None:
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir=tmp_path, model_format=ModelFormat.ONNX_INT8)
+        encoder.download()
+
+        download_model.assert_called_once_with("ViT-B-32__openai", encoder.cache_dir, ignore_patterns=["*.armnn"])
 
     def test_throws_exception_if_model_path_does_not_exist(
-        self, snapshot_download: mock.Mock, ort_session: mock.Mock, path: mock.Mock
+        self, download_model: mock.Mock, ort_session: mock.Mock, path: mock.Mock
     ) -> None:
         path.return_value.__truediv__.return_value.__truediv__.return_value.is_file.return_value = False
 
@@ -148,9 +367,132 @@ class TestBase:
         with pytest.raises(FileNotFoundError):
             encoder.load()
 
-        snapshot_download.assert_called_once()
+        download_model.assert_called_once()
         ort_session.assert_not_called()
 
+    def test_passes_thread_limits_to_session(self, tmp_path: Path, mocker: MockerFixture) -> None:
+        ort_session = mocker.patch("app.models.base.OrtSession")
+        model_path = tmp_path / "model.onnx"
+        model_path.touch()
+        encoder = OpenClipTextualEncoder("ViT-B-32__openai", inter_op_threads=1, intra_op_threads=1)
+
+        encoder._make_session(model_path)
+
+        ort_session.assert_called_once_with(model_path, inter_op_threads=1, intra_op_threads=1)
+
+
+class TestDownload:
+    files = {"visual/model.onnx": b"visual" * 1000, "config.json": b"{}", "visual/model.armnn": b"armnn"}
+
+    def serve(self, mirror_server: Any, files: dict[str, bytes] | None = None) -> None:
+        files = files if files is not None else self.files
+        manifest = [
+            {"path": path, "size": len(content), "sha256": hashlib.sha256(content).hexdigest()}
+            for path, content in files.items()
+        ]
+        mirror_server.files = {f"/test_model/{path}": content for path, content in files.items()}
+        mirror_server.files[f"/test_model/{MANIFEST_NAME}"] = json.dumps(manifest).encode()
+
+    def test_downloads_from_http_mirror(self, mirror_server: Any, tmp_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "model_mirror", mirror_server.url)
+        self.serve(mirror_server)
+
+        download_model("test_model", tmp_path / "test_model", ignore_patterns=["*.armnn"])
+
+        assert (tmp_path / "test_model" / "visual" / "model.onnx").read_bytes() == self.files["visual/model.onnx"]
+        assert (tmp_path / "test_model" / "config.json").read_bytes() == b"{}"
+        assert not (tmp_path / "test_model" / "visual" / "model.armnn").exists()
+        assert not list((tmp_path / "test_model").rglob("*.incomplete"))
+        manifest = json.loads((tmp_path / "test_model" / MANIFEST_NAME).read_text())
+        assert [file["path"] for file in manifest] == ["visual/model.onnx", "config.json"]
+
+    def test_copies_from_local_mirror(self, tmp_path: Path, mocker: MockerFixture) -> None:
+        mirror = tmp_path / "mirror"
+        mocker.patch.object(settings, "model_mirror", mirror.as_posix())
+        (mirror / "test_model" / "visual").mkdir(parents=True)
+        (mirror / "test_model" / "visual" / "model.onnx").write_bytes(self.files["visual/model.onnx"])
+        (mirror / "test_model" / MANIFEST_NAME).write_text(
+            json.dumps([{"path": "visual/model.onnx", "size": len(self.files["visual/model.onnx"])}])
+        )
+
+        download_model("test_model", tmp_path / "cache" / "test_model")
+
+        assert (tmp_path / "cache" / "test_model" / "visual" / "model.onnx").read_bytes() == self.files[
+            "visual/model.onnx"
+        ]
+
+    def test_resumes_incomplete_download(self, mirror_server: Any, tmp_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "model_mirror", mirror_server.url)
+        self.serve(mirror_server, {"model.onnx": self.files["visual/model.onnx"]})
+        (tmp_path / "test_model").mkdir()
+        (tmp_path / "test_model" / "model.onnx.incomplete").write_bytes(self.files["visual/model.onnx"][:1000])
+
+        download_model("test_model", tmp_path / "test_model")
+
+        assert (tmp_path / "test_model" / "model.onnx").read_bytes() == self.files["visual/model.onnx"]
+        assert ("/test_model/model.onnx", "bytes=1000-") in mirror_server.requests
+
+    def test_restarts_download_if_range_is_not_supported(
+        self, mirror_server: Any, tmp_path: Path, mocker: MockerFixture
+    ) -> None:
+        mocker.patch.object(settings, "model_mirror", mirror_server.url)
+        mirror_server.ranges = False
+        self.serve(mirror_server, {"model.onnx": self.files["visual/model.onnx"]})
+        (tmp_path / "test_model").mkdir()
+        (tmp_path / "test_model" / "model.onnx.incomplete").write_bytes(self.files["visual/model.onnx"][:1000])
+
+        download_model("test_model", tmp_path / "test_model")
+
+        assert (tmp_path / "test_model" / "model.onnx").read_bytes() == self.files["visual/model.onnx"]
+
+    def test_rejects_checksum_mismatch(self, mirror_server: Any, tmp_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "model_mirror", mirror_server.url)
+        self.serve(mirror_server, {"model.onnx": self.files["visual/model.onnx"]})
+        mirror_server.files["/test_model/model.onnx"] = b"x" * len(self.files["visual/model.onnx"])
+
+        with pytest.raises(OSError, match="Checksum mismatch"):
+            download_model("test_model", tmp_path / "test_model")
+
+        assert not (tmp_path / "test_model" / "model.onnx").exists()
+        assert not (tmp_path / "test_model" / "model.onnx.incomplete").exists()
+
+    def test_skips_downloaded_files(self, mirror_server: Any, tmp_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "model_mirror", mirror_server.url)
+        self.serve(mirror_server)
+
+        download_model("test_model", tmp_path / "test_model")
+        download_model("test_model", tmp_path / "test_model")
+
+        paths = [path for path, _ in mirror_server.requests if not path.endswith(MANIFEST_NAME)]
+        assert sorted(paths) == sorted(f"/test_model/{path}" for path in self.files)
+
+    def test_concurrent_downloads_fetch_once(self, mirror_server: Any, tmp_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "model_mirror", mirror_server.url)
+        self.serve(mirror_server)
+
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(lambda _: download_model("test_model", tmp_path / "test_model"), range(4)))
+
+        paths = [path for path, _ in mirror_server.requests if not path.endswith(MANIFEST_NAME)]
+        assert sorted(paths) == sorted(f"/test_model/{path}" for path in self.files)
+
+    def test_lists_hugging_face_files(self, mirror_server: Any, tmp_path: Path, mocker: MockerFixture) -> None:
+        content = self.files["visual/model.onnx"]
+        siblings = [
+            SimpleNamespace(rfilename="visual/model.onnx", size=len(content), lfs=SimpleNamespace(sha256="0" * 64)),
+            SimpleNamespace(rfilename="config.json", size=2, lfs=None),
+        ]
+        hf_api = mocker.patch("app.models.download.HfApi")
+        hf_api.return_value.model_info.return_value = SimpleNamespace(siblings=siblings)
+        mocker.patch("app.models.download.hf_hub_url", lambda repo_id, path: f"{mirror_server.url}/test_model/{path}")
+        self.serve(mirror_server)
+
+        with pytest.raises(OSError, match="Checksum mismatch for 'visual/model.onnx'"):
+            download_model("test_model", tmp_path / "test_model")
+
+        hf_api.return_value.model_info.assert_called_once_with("immich-app/test_model", files_metadata=True)
+        assert (tmp_path / "test_model" / "config.json").read_bytes() == b"{}"
+
 
 @pytest.mark.usefixtures("ort_session")
 class TestOrtSession:
@@ -261,6 +603,16 @@ class TestOrtSession:
         assert session.sess_options.inter_op_num_threads == 2
         assert session.sess_options.intra_op_num_threads == 4
 
+    def test_thread_kwargs_override_settings(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "model_inter_op_threads", 2)
+        mocker.patch.object(settings, "model_intra_op_threads", 4)
+
+        session = OrtSession("ViT-B-32__openai", inter_op_threads=1, intra_op_threads=1)
+
+        assert session.sess_options.execution_mode == ort.ExecutionMode.ORT_SEQUENTIAL
+        assert session.sess_options.inter_op_num_threads == 1
+        assert session.sess_options.intra_op_num_threads == 1
+
     def test_sets_sess_options_kwarg(self) -> None:
         sess_options = ort.SessionOptions()
         session = OrtSession(
@@ -272,6 +624,119 @@ class TestOrtSession:
 
         assert sess_options is session.sess_options
 
+    def test_disables_prepacking_if_mmap_model_weights(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "mmap_model_weights", True)
+
+        session = OrtSession("ViT-B-32__openai")
+
+        assert session.sess_options.get_session_config_entry("session.disable_prepacking") == "1"
+
+    def test_does_not_disable_prepacking_by_default(self) -> None:
+        session = OrtSession("ViT-B-32__openai")
+
+        with pytest.raises(RuntimeError):
+            session.sess_options.get_session_config_entry("session.disable_prepacking")
+
+
+class TestOptimizedModelCache:
+    @pytest.fixture
+    def model_path(self, tmp_path: Path) -> Path:
+        weight = onnx.numpy_helper.from_array(np.full((64, 64), 0.5, dtype=np.float32), "weight")
+        nodes = [
+            onnx.helper.make_node("MatMul", ["x", "weight"], ["y"]),
+            onnx.helper.make_node("Erf", ["y"], ["z"]),
+        ]
+        graph = onnx.helper.make_graph(
+            nodes,
+            "test",
+            [onnx.helper.make_tensor_value_info("x", onnx.TensorProto.FLOAT, ["batch", 64])],
+            [onnx.helper.make_tensor_value_info("z", onnx.TensorProto.FLOAT, ["batch", 64])],
+            [weight],
+        )
+        model = onnx.helper.make_model(graph, opset_imports=[onnx.helper.make_opsetid("", 17)])
+        model.ir_version = 8
+        path = tmp_path / "visual" / "model.onnx"
+        path.parent.mkdir()
+        onnx.save(model, path.as_posix())
+        return path
+
+    def optimized_path(self, model_path: Path) -> Path:
+        return model_path.parent / "optimized" / f"model.ort{ort.__version__}.cpu.onnx"
+
+    def test_saves_and_loads_optimized_model(self, model_path: Path, mocker: MockerFixture) -> None:
+        inference_session = mocker.patch("app.sessions.ort.ort.InferenceSession", wraps=ort.InferenceSession)
+        x = np.ones((2, 64), dtype=np.float32)
+
+        expected = OrtSession(model_path, providers=["CPUExecutionProvider"]).run(None, {"x": x})[0]
+        inference_session.reset_mock()
+        session = OrtSession(model_path, providers=["CPUExecutionProvider"])
+
+        inference_session.assert_called_once()
+        assert inference_session.call_args.args[0] == self.optimized_path(model_path).as_posix()
+        assert np.allclose(session.run(None, {"x": x})[0], expected)
+
+    def test_optimizes_with_configured_threads(self, model_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "model_inter_op_threads", 2)
+        mocker.patch.object(settings, "model_intra_op_threads", 3)
+        inference_session = mocker.patch("app.sessions.ort.ort.InferenceSession", wraps=ort.InferenceSession)
+
+        OrtSession(model_path, providers=["CPUExecutionProvider"])
+
+        assert inference_session.call_count == 2
+        for call in inference_session.call_args_list:
+            sess_options = call.kwargs["sess_options"]
+            assert sess_options.inter_op_num_threads == 2
+            assert sess_options.intra_op_num_threads == 3
+            assert sess_options.execution_mode == ort.ExecutionMode.ORT_PARALLEL
+
+    def test_regenerates_stale_optimized_model(self, model_path: Path) -> None:
+        OrtSession(model_path, providers=["CPUExecutionProvider"])
+        optimized_path = self.optimized_path(model_path)
+        stale_time = model_path.stat().st_mtime - 10
+        os.utime(optimized_path, (stale_time, stale_time))
+
+        OrtSession(model_path, providers=["CPUExecutionProvider"])
+
+        assert optimized_path.stat().st_mtime >= model_path.stat().st_mtime
+
+    def test_falls_back_to_original_model_if_optimized_is_invalid(self, model_path: Path, warning: mock.Mock) -> None:
+        optimized_path = self.optimized_path(model_path)
+        optimized_path.parent.mkdir()
+        optimized_path.write_bytes(b"invalid")
+
+        session = OrtSession(model_path, providers=["CPUExecutionProvider"])
+
+        assert session.run(None, {"x": np.ones((1, 64), dtype=np.float32)})[0].shape == (1, 64)
+        assert not optimized_path.exists()
+        warning.assert_called_once()
+
+    def test_removes_optimized_models_for_other_ort_versions(self, model_path: Path) -> None:
+        old_path = model_path.parent / "optimized" / "model.ort1.0.0.cpu.onnx"
+        old_path.parent.mkdir()
+        old_path.write_bytes(b"old")
+        other_provider_path = model_path.parent / "optimized" / "model.ort1.0.0.cuda.onnx"
+        other_provider_path.write_bytes(b"old")
+
+        OrtSession(model_path, providers=["CPUExecutionProvider"])
+
+        assert not old_path.exists()
+        assert other_provider_path.exists()
+        assert self.optimized_path(model_path).exists()
+
+    def test_does_not_optimize_for_compiling_providers(self, model_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch("app.sessions.ort.ort.InferenceSession")
+
+        session = OrtSession(model_path, providers=["OpenVINOExecutionProvider", "CPUExecutionProvider"])
+
+        assert session.optimized_model_path is None
+
+    def test_does_not_optimize_if_disabled(self, model_path: Path, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "cache_optimized_models", False)
+
+        OrtSession(model_path, providers=["CPUExecutionProvider"])
+
+        assert not (model_path.parent / "optimized").exists()
+
 
 class TestAnnSession:
     def test_creates_ann_session(self, ann_session: mock.Mock, info: mock.Mock) -> None:
@@ -327,6 +792,45 @@ class TestAnnSession:
         np_spy.assert_has_calls([mock.call(input1), mock.call(input2)])
 
 
+class TestBatchScheduler:
+    def test_batches_concurrent_items(self) -> None:
+        run_batch = mock.Mock(side_effect=lambda batch: [item * 2 for item in batch])
+        scheduler = BatchScheduler(run_batch, max_batch_size=4, window_ms=5000)
+
+        with ThreadPoolExecutor(4) as pool:
+            outputs = list(pool.map(lambda item: scheduler.submit([item]), range(4)))
+        scheduler.close()
+
+        assert outputs == [[0], [2], [4], [6]]
+        run_batch.assert_called_once()
+        assert sorted(run_batch.call_args.args[0]) == [0, 1, 2, 3]
+
+    def test_splits_batches_by_max_batch_size(self) -> None:
+        run_batch = mock.Mock(side_effect=lambda batch: [item * 2 for item in batch])
+        scheduler = BatchScheduler(run_batch, max_batch_size=2)
+
+        outputs = scheduler.submit([1, 2, 3, 4, 5])
+        scheduler.close()
+
+        assert outputs == [2, 4, 6, 8, 10]
+        assert all(len(call.args[0]) <= 2 for call in run_batch.call_args_list)
+
+    def test_raises_exception_for_each_item_in_failed_batch(self) -> None:
+        run_batch = mock.Mock(side_effect=RuntimeError("batch failed"))
+        scheduler = BatchScheduler(run_batch)
+
+        with pytest.raises(RuntimeError, match="batch failed"):
+            scheduler.submit([1, 2])
+        scheduler.close()
+
+    def test_raises_exception_if_output_count_does_not_match(self) -> None:
+        scheduler: BatchScheduler[int, int] = BatchScheduler(lambda batch: batch[:-1])
+
+        with pytest.raises(ValueError):
+            scheduler.submit([1, 2])
+        scheduler.close()
+
+
 class TestCLIP:
     embedding = np.random.rand(512).astype(np.float32)
     cache_dir = Path("test_cache")
@@ -353,6 +857,128 @@ class TestCLIP:
         assert embedding.dtype == np.float32
         mocked.run.assert_called_once()
 
+    def test_image_float16_embedding(
+        self,
+        pil_image: Image.Image,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenClipVisualEncoder, "download")
+        mocker.patch.object(OpenClipVisualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipVisualEncoder, "preprocess_cfg", clip_preprocess_cfg)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.run.return_value = [[self.embedding]]
+
+        clip_encoder = OpenClipVisualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        embedding = clip_encoder.predict(pil_image, embeddingDtype="float16")
+
+        assert isinstance(embedding, np.ndarray)
+        assert embedding.dtype == np.float16
+        assert np.allclose(embedding, self.embedding, atol=1e-3)
+
+    def test_transform_matches_pil_preprocessing(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenClipVisualEncoder, "download")
+        mocker.patch.object(OpenClipVisualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipVisualEncoder, "preprocess_cfg", clip_preprocess_cfg)
+        mocker.patch.object(InferenceModel, "_make_session", autospec=True)
+        clip_encoder = OpenClipVisualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        clip_encoder.load()
+        noise = np.random.randint(0, 256, (30, 40, 3), dtype=np.uint8)
+        pixels = cv2.resize(noise, (800, 600)).astype(np.uint8)
+        image = Image.fromarray(pixels)
+
+        resized = image.resize((298, 224), resample=Image.Resampling.BICUBIC).crop((37, 0, 261, 224))
+        expected = (np.asarray(resized, dtype=np.float32) / 255.0 - clip_encoder.mean) / clip_encoder.std
+        expected = expected.transpose(2, 0, 1)
+        actual = clip_encoder.transform(image)["image"]
+
+        assert actual.shape == (1, 3, 224, 224)
+        assert actual.dtype == np.float32
+        assert np.abs(actual[0] - expected).mean() < 0.02
+        assert np.array_equal(clip_encoder.transform(DecodedImage(pixels[..., ::-1]))["image"], actual)
+
+    def test_transform_reuses_buffer_per_thread(
+        self,
+        pil_image: Image.Image,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenClipVisualEncoder, "download")
+        mocker.patch.object(OpenClipVisualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipVisualEncoder, "preprocess_cfg", clip_preprocess_cfg)
+        mocker.patch.object(InferenceModel, "_make_session", autospec=True)
+        clip_encoder = OpenClipVisualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        clip_encoder.load()
+
+        buffer = clip_encoder.transform(pil_image)["image"]
+
+        assert clip_encoder.transform(pil_image)["image"] is buffer
+        with ThreadPoolExecutor(1) as executor:
+            assert executor.submit(clip_encoder.transform, pil_image).result()["image"] is not buffer
+
+    def test_crop_window(self) -> None:
+        assert crop_window(800, 600, 224) == (99, 0, 701, 600)
+        assert crop_window(600, 800, 224) == (0, 99, 600, 701)
+        assert crop_window(224, 224, 224) == (0, 0, 224, 224)
+
+    def test_batches_concurrent_images(
+        self,
+        pil_image: Image.Image,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(settings, "batch_window_ms", BatchWindow(clip_visual=5000))
+        mocker.patch.object(settings, "max_batch_size", MaxBatchSize(clip_visual=4))
+        mocker.patch.object(OpenClipVisualEncoder, "download")
+        mocker.patch.object(OpenClipVisualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipVisualEncoder, "preprocess_cfg", clip_preprocess_cfg)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.get_inputs.return_value = [SimpleNamespace(name="image", shape=("batch_size", 3, 224, 224))]
+        embeddings = np.random.rand(4, 512).astype(np.float32)
+        mocked.run.return_value = [embeddings]
+
+        clip_encoder = OpenClipVisualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        clip_encoder.load()
+        with ThreadPoolExecutor(4) as pool:
+            outputs = list(pool.map(clip_encoder.predict, [pil_image] * 4))
+        assert clip_encoder.scheduler is not None
+        clip_encoder.scheduler.close()
+
+        mocked.run.assert_called_once()
+        assert mocked.run.call_args.args[1]["image"].shape == (4, 3, 224, 224)
+        assert sorted(output.tobytes() for output in outputs) == sorted(embedding.tobytes() for embedding in embeddings)
+
+    def test_does_not_batch_images_without_batch_axis(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+        warning: mock.Mock,
+    ) -> None:
+        mocker.patch.object(settings, "batch_window_ms", BatchWindow(clip_visual=5))
+        mocker.patch.object(OpenClipVisualEncoder, "download")
+        mocker.patch.object(OpenClipVisualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipVisualEncoder, "preprocess_cfg", clip_preprocess_cfg)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.get_inputs.return_value = [SimpleNamespace(name="image", shape=(1, 3, 224, 224))]
+
+        clip_encoder = OpenClipVisualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        clip_encoder.load()
+
+        assert clip_encoder.scheduler is None
+        warning.assert_called_once()
+
     def test_basic_text(
         self,
         mocker: MockerFixture,
@@ -375,7 +1001,7 @@ class TestCLIP:
         assert embedding.dtype == np.float32
         mocked.run.assert_called_once()
 
-    def test_openclip_tokenizer(
+    def test_text_int8_embedding(
         self,
         mocker: MockerFixture,
         clip_model_cfg: dict[str, Any],
@@ -384,66 +1010,205 @@ class TestCLIP:
         mocker.patch.object(OpenClipTextualEncoder, "download")
         mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
         mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
-        mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
-        mock_tokenizer = mocker.patch("app.models.clip.textual.Tokenizer.from_file", autospec=True).return_value
-        mock_ids = [randint(0, 50000) for _ in range(77)]
-        mock_tokenizer.encode.return_value = SimpleNamespace(ids=mock_ids)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.run.return_value = [[self.embedding]]
+        mocker.patch("app.models.clip.textual.Tokenizer.from_file", autospec=True)
 
         clip_encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="test_cache")
-        clip_encoder._load()
-        tokens = clip_encoder.tokenize("test   search query")
+        embedding = clip_encoder.predict("test search query", embeddingDtype="int8")
 
-        assert "text" in tokens
-        assert isinstance(tokens["text"], np.ndarray)
-        assert tokens["text"].shape == (1, 77)
-        assert tokens["text"].dtype == np.int32
-        assert np.allclose(tokens["text"], np.array([mock_ids], dtype=np.int32), atol=0)
-        mock_tokenizer.encode.assert_called_once_with("test search query")
+        assert isinstance(embedding, dict)
+        assert embedding["values"].dtype == np.int8
+        assert embedding["values"].shape == self.embedding.shape
+        assert np.abs(embedding["values"]).max() == 127
+        assert np.allclose(embedding["values"] * embedding["scale"], self.embedding, atol=embedding["scale"] / 2)
 
-    def test_openclip_tokenizer_canonicalizes_text(
+    def test_raises_exception_if_invalid_embedding_dtype(
         self,
         mocker: MockerFixture,
         clip_model_cfg: dict[str, Any],
         clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
     ) -> None:
-        clip_model_cfg["text_cfg"]["tokenizer_kwargs"] = {"clean": "canonicalize"}
         mocker.patch.object(OpenClipTextualEncoder, "download")
         mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
         mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
-        mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
-        mock_tokenizer = mocker.patch("app.models.clip.textual.Tokenizer.from_file", autospec=True).return_value
-        mock_ids = [randint(0, 50000) for _ in range(77)]
-        mock_tokenizer.encode.return_value = SimpleNamespace(ids=mock_ids)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.run.return_value = [[self.embedding]]
+        mocker.patch("app.models.clip.textual.Tokenizer.from_file", autospec=True)
 
         clip_encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="test_cache")
-        clip_encoder._load()
-        tokens = clip_encoder.tokenize("Test   Search Query!")
 
-        assert "text" in tokens
-        assert isinstance(tokens["text"], np.ndarray)
-        assert tokens["text"].shape == (1, 77)
-        assert tokens["text"].dtype == np.int32
-        assert np.allclose(tokens["text"], np.array([mock_ids], dtype=np.int32), atol=0)
-        mock_tokenizer.encode.assert_called_once_with("test search query")
+        with pytest.raises(ValueError):
+            clip_encoder.predict("test search query", embeddingDtype="int4")
 
-    def test_mclip_tokenizer(
+    def test_truncates_text_embedding_for_mrl_model(
         self,
         mocker: MockerFixture,
         clip_model_cfg: dict[str, Any],
         clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
     ) -> None:
-        mocker.patch.object(MClipTextualEncoder, "download")
-        mocker.patch.object(MClipTextualEncoder, "model_cfg", clip_model_cfg)
-        mocker.patch.object(MClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
-        mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
-        mock_tokenizer = mocker.patch("app.models.clip.textual.Tokenizer.from_file", autospec=True).return_value
-        mock_ids = [randint(0, 50000) for _ in range(77)]
-        mock_attention_mask = [randint(0, 1) for _ in range(77)]
-        mock_tokenizer.encode.return_value = SimpleNamespace(ids=mock_ids, attention_mask=mock_attention_mask)
-
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.run.return_value = [[self.embedding]]
+        mocker.patch("app.models.clip.textual.Tokenizer.from_file", autospec=True)
+
+        clip_encoder = OpenClipTextualEncoder("nllb-clip-base-siglip__mrl", cache_dir="test_cache")
+        embedding = clip_encoder.predict("test search query", embeddingDimension=128)
+
+        assert isinstance(embedding, np.ndarray)
+        assert embedding.shape == (128,)
+        assert embedding.dtype == np.float32
+        assert np.isclose(np.linalg.norm(embedding), 1.0)
+        assert np.allclose(embedding, self.embedding[:128] / np.linalg.norm(self.embedding[:128]))
+
+    def test_truncates_image_embedding_before_quantizing(
+        self,
+        pil_image: Image.Image,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenClipVisualEncoder, "download")
+        mocker.patch.object(OpenClipVisualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipVisualEncoder, "preprocess_cfg", clip_preprocess_cfg)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.run.return_value = [[self.embedding]]
+
+        clip_encoder = OpenClipVisualEncoder("immich-app/nllb-clip-large-siglip__mrl", cache_dir="test_cache")
+        embedding = clip_encoder.predict(pil_image, embeddingDimension=64, embeddingDtype="int8")
+
+        assert isinstance(embedding, dict)
+        assert embedding["values"].shape == (64,)
+        truncated = self.embedding[:64] / np.linalg.norm(self.embedding[:64])
+        assert np.allclose(embedding["values"] * embedding["scale"], truncated, atol=embedding["scale"] / 2)
+
+    def test_raises_exception_if_truncating_non_mrl_embedding(
+        self,
+        pil_image: Image.Image,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenClipVisualEncoder, "download")
+        mocker.patch.object(OpenClipVisualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipVisualEncoder, "preprocess_cfg", clip_preprocess_cfg)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.run.return_value = [[self.embedding]]
+
+        clip_encoder = OpenClipVisualEncoder("nllb-clip-base-siglip__v1", cache_dir="test_cache")
+
+        with pytest.raises(ValueError, match="does not support truncated embeddings"):
+            clip_encoder.predict(pil_image, embeddingDimension=128)
+        mocked.run.assert_not_called()
+
+    @pytest.mark.parametrize(
+        ("dimension", "message"),
+        [
+            (0, "must be between 1 and 768"),
+            (-1, "must be between 1 and 768"),
+            (769, "must be between 1 and 768"),
+            (256.7, "must be an integer"),
+            (True, "must be an integer"),
+        ],
+    )
+    def test_raises_exception_if_invalid_embedding_dimension(
+        self,
+        dimension: Any,
+        message: str,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.run.return_value = [[self.embedding]]
+        mocker.patch("app.models.clip.textual.Tokenizer.from_file", autospec=True)
+
+        clip_encoder = OpenClipTextualEncoder("nllb-clip-base-siglip__mrl", cache_dir="test_cache")
+
+        with pytest.raises(ValueError, match=message):
+            clip_encoder.predict("test search query", embeddingDimension=dimension)
+        mocked.run.assert_not_called()
+
+    def test_openclip_tokenizer(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mock_tokenizer = mocker.patch("app.models.clip.textual.Tokenizer.from_file", autospec=True).return_value
+        mock_ids = [randint(0, 50000) for _ in range(77)]
+        mock_tokenizer.encode_batch.return_value = [SimpleNamespace(ids=mock_ids)]
+
+        clip_encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        clip_encoder._load()
+        tokens = clip_encoder.tokenize_batch(["test   search query"])
+
+        assert "text" in tokens
+        assert isinstance(tokens["text"], np.ndarray)
+        assert tokens["text"].shape == (1, 77)
+        assert tokens["text"].dtype == np.int32
+        assert np.allclose(tokens["text"], np.array([mock_ids], dtype=np.int32), atol=0)
+        mock_tokenizer.encode_batch.assert_called_once_with(["test search query"])
+
+    def test_openclip_tokenizer_canonicalizes_text(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        clip_model_cfg["text_cfg"]["tokenizer_kwargs"] = {"clean": "canonicalize"}
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mock_tokenizer = mocker.patch("app.models.clip.textual.Tokenizer.from_file", autospec=True).return_value
+        mock_ids = [randint(0, 50000) for _ in range(77)]
+        mock_tokenizer.encode_batch.return_value = [SimpleNamespace(ids=mock_ids)]
+
+        clip_encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        clip_encoder._load()
+        tokens = clip_encoder.tokenize_batch(["Test   Search Query!"])
+
+        assert "text" in tokens
+        assert isinstance(tokens["text"], np.ndarray)
+        assert tokens["text"].shape == (1, 77)
+        assert tokens["text"].dtype == np.int32
+        assert np.allclose(tokens["text"], np.array([mock_ids], dtype=np.int32), atol=0)
+        mock_tokenizer.encode_batch.assert_called_once_with(["test search query"])
+
+    def test_mclip_tokenizer(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(MClipTextualEncoder, "download")
+        mocker.patch.object(MClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(MClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mock_tokenizer = mocker.patch("app.models.clip.textual.Tokenizer.from_file", autospec=True).return_value
+        mock_ids = [randint(0, 50000) for _ in range(77)]
+        mock_attention_mask = [randint(0, 1) for _ in range(77)]
+        mock_tokenizer.encode_batch.return_value = [SimpleNamespace(ids=mock_ids, attention_mask=mock_attention_mask)]
+
         clip_encoder = MClipTextualEncoder("ViT-B-32__openai", cache_dir="test_cache")
         clip_encoder._load()
-        tokens = clip_encoder.tokenize("test search query")
+        tokens = clip_encoder.tokenize_batch(["test search query"])
 
         assert "input_ids" in tokens
         assert "attention_mask" in tokens
@@ -454,6 +1219,208 @@ class TestCLIP:
         assert np.allclose(tokens["input_ids"], np.array([mock_ids], dtype=np.int32), atol=0)
         assert np.allclose(tokens["attention_mask"], np.array([mock_attention_mask], dtype=np.int32), atol=0)
 
+    def test_openclip_tokenizer_batch(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mock_tokenizer = mocker.patch("app.models.clip.textual.Tokenizer.from_file", autospec=True).return_value
+        mock_ids = [[randint(0, 50000) for _ in range(77)] for _ in range(3)]
+        mock_tokenizer.encode_batch.return_value = [SimpleNamespace(ids=ids) for ids in mock_ids]
+
+        clip_encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        clip_encoder._load()
+        tokens = clip_encoder.tokenize_batch(["test   search query", "a dog", "a cat"])
+
+        assert tokens["text"].shape == (3, 77)
+        assert tokens["text"].dtype == np.int32
+        assert np.allclose(tokens["text"], np.array(mock_ids, dtype=np.int32), atol=0)
+        mock_tokenizer.encode_batch.assert_called_once_with(["test search query", "a dog", "a cat"])
+
+    def test_mclip_tokenizer_batch(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(MClipTextualEncoder, "download")
+        mocker.patch.object(MClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(MClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mock_tokenizer = mocker.patch("app.models.clip.textual.Tokenizer.from_file", autospec=True).return_value
+        mock_ids = [[randint(0, 50000) for _ in range(77)] for _ in range(2)]
+        mock_attention_mask = [[randint(0, 1) for _ in range(77)] for _ in range(2)]
+        mock_tokenizer.encode_batch.return_value = [
+            SimpleNamespace(ids=ids, attention_mask=mask) for ids, mask in zip(mock_ids, mock_attention_mask)
+        ]
+
+        clip_encoder = MClipTextualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        clip_encoder._load()
+        tokens = clip_encoder.tokenize_batch(["test search query", "a dog"])
+
+        assert tokens["input_ids"].shape == (2, 77)
+        assert tokens["attention_mask"].shape == (2, 77)
+        assert np.allclose(tokens["input_ids"], np.array(mock_ids, dtype=np.int32), atol=0)
+        assert np.allclose(tokens["attention_mask"], np.array(mock_attention_mask, dtype=np.int32), atol=0)
+
+    def _save_word_tokenizer(self, model_dir: Path) -> None:
+        vocab = {"<|endoftext|>": 0} | {f"w{i}": i + 1 for i in range(100)}
+        tokenizer = Tokenizer(WordLevel(vocab, unk_token="<|endoftext|>"))
+        tokenizer.pre_tokenizer = Whitespace()
+        model_dir.mkdir(parents=True)
+        tokenizer.save((model_dir / "tokenizer.json").as_posix())
+
+    def _mock_text_session(self, mocker: MockerFixture, shape: list[Any]) -> mock.Mock:
+        session: mock.Mock = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        session.get_inputs.return_value = [SimpleNamespace(name="text", shape=shape)]
+        return session
+
+    def test_trims_text_padding_to_bucket(
+        self,
+        tmp_path: Path,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(settings, "trim_text_padding", True)
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        self._mock_text_session(mocker, ["batch", "sequence"])
+        self._save_word_tokenizer(tmp_path / "textual")
+
+        clip_encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir=tmp_path)
+        clip_encoder._load()
+        single = clip_encoder.tokenize_batch(["w1 w2"])
+        batch = clip_encoder.tokenize_batch(["w1", " ".join(f"w{i}" for i in range(20))])
+        truncated = clip_encoder.tokenize_batch([" ".join(f"w{i % 100}" for i in range(100))])
+
+        assert clip_encoder.dynamic_length
+        assert single["text"].shape == (1, 16)
+        assert single["text"][0, :3].tolist() == [2, 3, 0]
+        assert batch["text"].shape == (2, 32)
+        assert (batch["text"][0, 1:] == 0).all()
+        assert (batch["text"][1, 20:] == 0).all()
+        assert truncated["text"].shape == (1, 77)
+
+    def test_keeps_text_padding_for_static_sequence_length(
+        self,
+        tmp_path: Path,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(settings, "trim_text_padding", True)
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        self._mock_text_session(mocker, ["batch", 77])
+        self._save_word_tokenizer(tmp_path / "textual")
+
+        clip_encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir=tmp_path)
+        clip_encoder._load()
+
+        assert not clip_encoder.dynamic_length
+        assert clip_encoder.tokenize_batch(["w1 w2"])["text"].shape == (1, 77)
+        assert clip_encoder.tokenize_batch(["w1", "w2 w3"])["text"].shape == (2, 77)
+
+    def test_keeps_text_padding_by_default(
+        self,
+        tmp_path: Path,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        self._mock_text_session(mocker, ["batch", "sequence"])
+        self._save_word_tokenizer(tmp_path / "textual")
+
+        clip_encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir=tmp_path)
+        clip_encoder._load()
+
+        assert clip_encoder.tokenize_batch(["w1 w2"])["text"].shape == (1, 77)
+
+    def test_warms_up_each_length_bucket_for_dynamic_sequence_length(
+        self,
+        tmp_path: Path,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(settings, "trim_text_padding", True)
+        mocker.patch.object(settings, "max_batch_size", MaxBatchSize(clip_textual=4))
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        session = self._mock_text_session(mocker, ["batch", "sequence"])
+        self._save_word_tokenizer(tmp_path / "textual")
+
+        clip_encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir=tmp_path)
+        clip_encoder.session = clip_encoder._load()
+        clip_encoder.warmup()
+
+        shapes = [call.args[1]["text"].shape for call in session.run.call_args_list]
+        assert shapes == [(batch_size, length) for batch_size in [1, 4] for length in [16, 32, 48, 64, 77]]
+
+    def test_mclip_trims_text_padding_with_attention_mask(
+        self,
+        tmp_path: Path,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(settings, "trim_text_padding", True)
+        mocker.patch.object(MClipTextualEncoder, "download")
+        mocker.patch.object(MClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(MClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        self._mock_text_session(mocker, ["batch", "sequence"])
+        self._save_word_tokenizer(tmp_path / "textual")
+
+        clip_encoder = MClipTextualEncoder("ViT-B-32__openai", cache_dir=tmp_path)
+        clip_encoder._load()
+        tokens = clip_encoder.tokenize_batch(["w1 w2 w3", "w4"])
+
+        assert tokens["input_ids"].shape == (2, 16)
+        assert tokens["attention_mask"].tolist() == [[1] * 3 + [0] * 13, [1] + [0] * 15]
+
+    def test_batches_concurrent_text(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_tokenizer_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(settings, "batch_window_ms", BatchWindow(clip_textual=5000))
+        mocker.patch.object(settings, "max_batch_size", MaxBatchSize(clip_textual=3))
+        mocker.patch.object(OpenClipTextualEncoder, "download")
+        mocker.patch.object(OpenClipTextualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipTextualEncoder, "tokenizer_cfg", clip_tokenizer_cfg)
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.get_inputs.return_value = [SimpleNamespace(name="text", shape=("batch_size", 77))]
+        embeddings = np.random.rand(3, 512).astype(np.float32)
+        mocked.run.return_value = [embeddings]
+        mock_tokenizer = mocker.patch("app.models.clip.textual.Tokenizer.from_file", autospec=True).return_value
+        mock_tokenizer.encode_batch.side_effect = lambda texts: [SimpleNamespace(ids=[0] * 77) for _ in texts]
+
+        clip_encoder = OpenClipTextualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        clip_encoder.load()
+        with ThreadPoolExecutor(3) as pool:
+            outputs = list(pool.map(clip_encoder.predict, ["a dog", "a cat", "a bird"]))
+        assert clip_encoder.scheduler is not None
+        clip_encoder.scheduler.close()
+
+        mocked.run.assert_called_once()
+        mock_tokenizer.encode_batch.assert_called_once()
+        assert sorted(mock_tokenizer.encode_batch.call_args.args[0]) == ["a bird", "a cat", "a dog"]
+        assert mocked.run.call_args.args[1]["text"].shape == (3, 77)
+        assert sorted(output.tobytes() for output in outputs) == sorted(embedding.tobytes() for embedding in embeddings)
+
 
 class TestFaceRecognition:
     def test_set_min_score(self, mocker: MockerFixture) -> None:
@@ -485,6 +1452,116 @@ class TestFaceRecognition:
         assert np.equal(faces["scores"], scores).all()
         det_model.detect.assert_called_once()
 
+    def test_batched_detection_matches_detection(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(FaceDetector, "load")
+        face_detector = FaceDetector("buffalo_s", min_score=0.9, cache_dir="test_cache")
+
+        session = mock.Mock()
+        session.get_inputs.return_value = [SimpleNamespace(name="input.1", shape=["batch", 3, "?", "?"])]
+        session.get_outputs.return_value = [SimpleNamespace(name=f"output.{i}") for i in range(9)]
+        face_detector.session = session
+        face_detector.model = RetinaFace(session=session)
+        face_detector.model.prepare(ctx_id=0, det_thresh=0.9, input_size=(640, 640))
+
+        def net_outs() -> list[np.ndarray]:
+            anchors = [12800, 3200, 800]
+            scores = [np.random.rand(k, 1).astype(np.float32) for k in anchors]
+            bboxes = [np.random.rand(k, 4).astype(np.float32) * 4 for k in anchors]
+            kpss = [np.random.rand(k, 10).astype(np.float32) * 4 for k in anchors]
+            return scores + bboxes + kpss
+
+        images = [
+            np.random.randint(0, 255, (800, 600, 3), dtype=np.uint8),
+            np.random.randint(0, 255, (300, 900, 3), dtype=np.uint8),
+        ]
+        outputs = [net_outs() for _ in images]
+        expected = []
+        for image, outs in zip(images, outputs):
+            session.run.return_value = outs
+            expected.append(face_detector.model.detect(image))
+
+        session.run.return_value = [np.concatenate(outs) for outs in zip(*outputs)]
+        actual = face_detector._predict_batch([face_detector._letterbox(image) for image in images])
+
+        assert session.run.call_args.args[1]["input.1"].shape == (2, 3, 640, 640)
+        for (expected_det, expected_kpss), (actual_det, actual_kpss) in zip(expected, actual):
+            assert expected_det.shape[0] > 0
+            assert np.allclose(expected_det, actual_det)
+            assert np.allclose(expected_kpss, actual_kpss)
+
+    def test_detection_batches_images_across_requests(self, cv_image: cv2.Mat, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "batch_window_ms", BatchWindow(face_detection=5000))
+        mocker.patch.object(settings, "max_batch_size", MaxBatchSize(face_detection=3))
+        mocker.patch.object(FaceDetector, "load")
+        face_detector = FaceDetector("buffalo_s", min_score=0.0, cache_dir="test_cache")
+        face_detector.session = mock.Mock()
+        face_detector.session.get_inputs.return_value = [SimpleNamespace(name="input.1", shape=["batch", 3, 640, 640])]
+        face_detector.model = mock.Mock(det_thresh=0.5)
+        num_faces = 2
+        bbox = np.random.rand(num_faces, 5).astype(np.float32)
+        kpss = np.random.rand(num_faces, 5, 2).astype(np.float32)
+        predict_batch = mocker.patch.object(
+            face_detector, "_predict_batch", side_effect=lambda batch: [(bbox, kpss)] * len(batch)
+        )
+        face_detector.scheduler = face_detector._make_scheduler()
+        assert face_detector.scheduler is not None
+
+        with ThreadPoolExecutor(3) as pool:
+            results = list(pool.map(face_detector.predict, [cv_image] * 3))
+        face_detector.scheduler.close()
+
+        predict_batch.assert_called_once()
+        assert len(predict_batch.call_args.args[0]) == 3
+        for faces in results:
+            assert np.equal(faces["boxes"], bbox[:, :4].round()).all()
+            assert np.equal(faces["scores"], bbox[:, 4]).all()
+            assert np.equal(faces["landmarks"], kpss).all()
+
+    def test_detection_adds_batch_axis_if_batching(
+        self, ort_session: mock.Mock, path: mock.Mock, mocker: MockerFixture
+    ) -> None:
+        mocker.patch.object(settings, "batch_window_ms", BatchWindow(face_detection=5))
+        ensure_batch_axis = mocker.patch.object(FaceDetector, "_ensure_batch_axis", autospec=True)
+        mocker.patch("app.models.base.InferenceModel.download")
+        mocker.patch("app.models.facial_recognition.detection.RetinaFace")
+        ort_session.return_value.get_inputs.return_value = [
+            SimpleNamespace(name="input.1", shape=("batch", 3, "?", "?"))
+        ]
+        path.return_value.__truediv__.return_value.__truediv__.return_value.suffix = ".onnx"
+
+        face_detector = FaceDetector("buffalo_s", cache_dir=path, model_format=ModelFormat.ONNX)
+        face_detector.load()
+
+        ensure_batch_axis.assert_called_once_with(face_detector)
+        ort_session.assert_called_once()
+
+    def test_detection_does_not_add_batch_axis_if_not_batching(
+        self, ort_session: mock.Mock, path: mock.Mock, mocker: MockerFixture
+    ) -> None:
+        ensure_batch_axis = mocker.patch.object(FaceDetector, "_ensure_batch_axis", autospec=True)
+        mocker.patch("app.models.base.InferenceModel.download")
+        mocker.patch("app.models.facial_recognition.detection.RetinaFace")
+        ort_session.return_value.get_inputs.return_value = [SimpleNamespace(name="input.1", shape=(1, 3, "?", "?"))]
+        path.return_value.__truediv__.return_value.__truediv__.return_value.suffix = ".onnx"
+
+        face_detector = FaceDetector("buffalo_s", cache_dir=path, model_format=ModelFormat.ONNX)
+        face_detector.load()
+
+        ensure_batch_axis.assert_not_called()
+        assert face_detector.scheduler is None
+
+    def test_detection_add_batch_axis(self) -> None:
+        proto = self._make_proto([1, 3, "h", "w"], {"448": [12800, 1], "471": [12800, 4]})
+
+        assert FaceDetector("buffalo_s")._add_batch_axis(proto)
+
+        assert [dim.dim_param for dim in proto.graph.input[0].type.tensor_type.shape.dim] == ["batch", "", "h", "w"]
+        assert [output.type.tensor_type.shape.dim[0].dim_param for output in proto.graph.output] == [
+            "448_anchors",
+            "471_anchors",
+        ]
+        assert not FaceDetector("buffalo_s")._add_batch_axis(proto)
+
     def test_recognition(self, cv_image: cv2.Mat, mocker: MockerFixture) -> None:
         mocker.patch.object(FaceRecognizer, "load")
         face_recognizer = FaceRecognizer("buffalo_s", min_score=0.0, cache_dir="test_cache")
@@ -519,71 +1596,104 @@ class TestFaceRecognition:
         assert isinstance(call_args[0][0], np.ndarray)
         assert call_args[0][0].shape == (112, 112, 3)
 
-    def test_recognition_adds_batch_axis_for_ort(
-        self, ort_session: mock.Mock, path: mock.Mock, mocker: MockerFixture
-    ) -> None:
-        onnx = mocker.patch("app.models.facial_recognition.recognition.onnx", autospec=True)
-        update_dims = mocker.patch(
-            "app.models.facial_recognition.recognition.update_inputs_outputs_dims", autospec=True
-        )
-        mocker.patch("app.models.base.InferenceModel.download")
-        mocker.patch("app.models.facial_recognition.recognition.ArcFaceONNX")
-        ort_session.return_value.get_inputs.return_value = [SimpleNamespace(name="input.1", shape=(1, 3, 224, 224))]
-        ort_session.return_value.get_outputs.return_value = [SimpleNamespace(name="output.1", shape=(1, 800))]
-        path.return_value.__truediv__.return_value.__truediv__.return_value.suffix = ".onnx"
+    def test_recognition_int8_embeddings(self, cv_image: cv2.Mat, mocker: MockerFixture) -> None:
+        mocker.patch.object(FaceRecognizer, "load")
+        face_recognizer = FaceRecognizer("buffalo_s", min_score=0.0, cache_dir="test_cache")
 
-        proto = mock.Mock()
+        num_faces = 2
+        bbox = np.random.rand(num_faces, 4).astype(np.float32)
+        scores = np.array([0.67] * num_faces).astype(np.float32)
+        kpss = np.random.rand(num_faces, 5, 2).astype(np.float32)
+        faces = {"boxes": bbox, "landmarks": kpss, "scores": scores}
 
-        input_dims = mock.Mock()
-        input_dims.name = "input.1"
-        input_dims.type.tensor_type.shape.dim = [SimpleNamespace(dim_value=size) for size in [1, 3, 224, 224]]
-        proto.graph.input = [input_dims]
+        rec_model = mock.Mock()
+        embedding = np.random.rand(num_faces, 512).astype(np.float32) - 0.5
+        rec_model.get_feat.return_value = embedding
+        face_recognizer.model = rec_model
 
-        output_dims = mock.Mock()
-        output_dims.name = "output.1"
-        output_dims.type.tensor_type.shape.dim = [SimpleNamespace(dim_value=size) for size in [1, 800]]
-        proto.graph.output = [output_dims]
+        faces = face_recognizer.predict(cv_image, faces, embeddingDtype="int8")
 
-        onnx.load.return_value = proto
+        assert len(faces) == num_faces
+        for face, expected in zip(faces, embedding):
+            assert isinstance(face["embedding"], dict)
+            assert face["embedding"]["values"].dtype == np.int8
+            assert np.allclose(
+                face["embedding"]["values"] * face["embedding"]["scale"], expected, atol=face["embedding"]["scale"] / 2
+            )
+
+    def test_recognition_batches_faces_across_requests(self, cv_image: cv2.Mat, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "batch_window_ms", BatchWindow(facial_recognition=5000))
+        mocker.patch.object(settings, "max_batch_size", MaxBatchSize(facial_recognition=4))
+        mocker.patch.object(FaceRecognizer, "load")
+        face_recognizer = FaceRecognizer("buffalo_s", min_score=0.0, cache_dir="test_cache")
+        face_recognizer.session = mock.Mock()
+        face_recognizer.session.get_inputs.return_value = [
+            SimpleNamespace(name="input.1", shape=("batch", 3, 112, 112))
+        ]
+        rec_model = mock.Mock()
+        rec_model.get_feat.side_effect = lambda crops: np.random.rand(len(crops), 512).astype(np.float32)
+        face_recognizer.model = rec_model
+        face_recognizer.scheduler = face_recognizer._make_scheduler()
+        assert face_recognizer.scheduler is not None
 
-        face_recognizer = FaceRecognizer("buffalo_s", cache_dir=path)
-        face_recognizer.load()
+        num_faces = 2
+        faces = {
+            "boxes": np.random.rand(num_faces, 4).astype(np.float32),
+            "landmarks": np.random.rand(num_faces, 5, 2).astype(np.float32),
+            "scores": np.array([0.67] * num_faces).astype(np.float32),
+        }
+        with ThreadPoolExecutor(2) as pool:
+            results = list(pool.map(lambda _: face_recognizer.predict(cv_image, faces), range(2)))
+        face_recognizer.scheduler.close()
 
-        assert face_recognizer.batch_size is None
-        update_dims.assert_called_once_with(proto, {"input.1": ["batch", 3, 224, 224]}, {"output.1": ["batch", 800]})
-        onnx.save.assert_called_once_with(update_dims.return_value, face_recognizer.model_path)
+        rec_model.get_feat.assert_called_once()
+        assert len(rec_model.get_feat.call_args.args[0]) == 4
+        assert all(len(result) == num_faces for result in results)
+        assert all(face["embedding"].shape == (512,) for result in results for face in result)
 
-    def test_recognition_does_not_add_batch_axis_if_exists(
+    def test_recognition_adds_batch_axis_for_ort(
         self, ort_session: mock.Mock, path: mock.Mock, mocker: MockerFixture
     ) -> None:
-        onnx = mocker.patch("app.models.facial_recognition.recognition.onnx", autospec=True)
-        update_dims = mocker.patch(
-            "app.models.facial_recognition.recognition.update_inputs_outputs_dims", autospec=True
-        )
+        ensure_batch_axis = mocker.patch.object(FaceRecognizer, "_ensure_batch_axis", autospec=True)
         mocker.patch("app.models.base.InferenceModel.download")
         mocker.patch("app.models.facial_recognition.recognition.ArcFaceONNX")
         path.return_value.__truediv__.return_value.__truediv__.return_value.suffix = ".onnx"
 
-        inputs = [SimpleNamespace(name="input.1", shape=("batch", 3, 224, 224))]
-        outputs = [SimpleNamespace(name="output.1", shape=("batch", 800))]
-        ort_session.return_value.get_inputs.return_value = inputs
-        ort_session.return_value.get_outputs.return_value = outputs
-
         face_recognizer = FaceRecognizer("buffalo_s", cache_dir=path)
         face_recognizer.load()
 
         assert face_recognizer.batch_size is None
-        update_dims.assert_not_called()
-        onnx.load.assert_not_called()
-        onnx.save.assert_not_called()
+        ensure_batch_axis.assert_called_once_with(face_recognizer)
+        ort_session.assert_called_once()
+
+    def test_recognition_add_batch_axis(self) -> None:
+        proto = self._make_proto([1, 3, 112, 112], {"683": [1, 512]})
+
+        assert FaceRecognizer("buffalo_s")._add_batch_axis(proto)
+
+        assert proto.graph.input[0].type.tensor_type.shape.dim[0].dim_param == "batch"
+        assert proto.graph.output[0].type.tensor_type.shape.dim[0].dim_param == "batch"
+
+    def test_recognition_add_batch_axis_does_nothing_if_exists(self) -> None:
+        proto = self._make_proto(["batch", 3, 112, 112], {"683": ["batch", 512]})
+        expected = proto.SerializeToString()
+
+        assert not FaceRecognizer("buffalo_s")._add_batch_axis(proto)
+
+        assert proto.SerializeToString() == expected
+
+    def test_add_batch_axis_does_nothing_by_default(self) -> None:
+        proto = self._make_proto([1, 3, 224, 224], {"output": [1, 512]})
+        expected = proto.SerializeToString()
+
+        assert not OpenClipVisualEncoder("ViT-B-32__openai")._add_batch_axis(proto)
+
+        assert proto.SerializeToString() == expected
 
     def test_recognition_does_not_add_batch_axis_for_armnn(
         self, ann_session: mock.Mock, path: mock.Mock, mocker: MockerFixture
     ) -> None:
-        onnx = mocker.patch("app.models.facial_recognition.recognition.onnx", autospec=True)
-        update_dims = mocker.patch(
-            "app.models.facial_recognition.recognition.update_inputs_outputs_dims", autospec=True
-        )
+        ensure_batch_axis = mocker.patch.object(FaceRecognizer, "_ensure_batch_axis", autospec=True)
         mocker.patch("app.models.base.InferenceModel.download")
         mocker.patch("app.models.facial_recognition.recognition.ArcFaceONNX")
         path.return_value.__truediv__.return_value.__truediv__.return_value.suffix = ".armnn"
@@ -597,17 +1707,12 @@ class TestFaceRecognition:
         face_recognizer.load()
 
         assert face_recognizer.batch_size == 1
-        update_dims.assert_not_called()
-        onnx.load.assert_not_called()
-        onnx.save.assert_not_called()
+        ensure_batch_axis.assert_not_called()
 
     def test_recognition_does_not_add_batch_axis_for_openvino(
         self, ort_session: mock.Mock, path: mock.Mock, mocker: MockerFixture
     ) -> None:
-        onnx = mocker.patch("app.models.facial_recognition.recognition.onnx", autospec=True)
-        update_dims = mocker.patch(
-            "app.models.facial_recognition.recognition.update_inputs_outputs_dims", autospec=True
-        )
+        ensure_batch_axis = mocker.patch.object(FaceRecognizer, "_ensure_batch_axis", autospec=True)
         mocker.patch("app.models.base.InferenceModel.download")
         mocker.patch("app.models.facial_recognition.recognition.ArcFaceONNX")
         path.return_value.__truediv__.return_value.__truediv__.return_value.suffix = ".onnx"
@@ -623,9 +1728,121 @@ class TestFaceRecognition:
         face_recognizer.load()
 
         assert face_recognizer.batch_size == 1
-        update_dims.assert_not_called()
-        onnx.load.assert_not_called()
-        onnx.save.assert_not_called()
+        ensure_batch_axis.assert_not_called()
+
+    def test_ensure_batch_axis_converts_model_once(self, tmp_path: Path, mocker: MockerFixture) -> None:
+        face_recognizer = FaceRecognizer("buffalo_s", cache_dir=tmp_path)
+        self._save_model(face_recognizer.model_path)
+        data = face_recognizer.model_path.with_name("model.onnx.data").read_bytes()
+        load = mocker.patch("app.models.base.onnx.load", wraps=onnx.load)
+
+        face_recognizer._ensure_batch_axis()
+        face_recognizer._ensure_batch_axis()
+
+        load.assert_called_once_with(face_recognizer.model_path, load_external_data=False)
+        # weights in a separate file are left as is
+        assert face_recognizer.model_path.with_name("model.onnx.data").read_bytes() == data
+        assert face_recognizer.model_path.with_name("model.onnx.batched").is_file()
+        assert not face_recognizer.model_path.with_name("model.onnx.tmp").exists()
+        session = ort.InferenceSession(face_recognizer.model_path.as_posix(), providers=["CPUExecutionProvider"])
+        assert session.get_inputs()[0].shape == ["batch", 512]
+        assert session.run(None, {"input.1": np.ones((3, 512), dtype=np.float32)})[0].shape == (3, 512)
+
+    def test_ensure_batch_axis_marks_model_with_batch_axis(self, tmp_path: Path, mocker: MockerFixture) -> None:
+        face_recognizer = FaceRecognizer("buffalo_s", cache_dir=tmp_path)
+        self._save_model(face_recognizer.model_path, batch="batch")
+        save = mocker.patch("app.models.base.onnx.save", wraps=onnx.save)
+
+        face_recognizer._ensure_batch_axis()
+
+        save.assert_not_called()
+        assert face_recognizer.model_path.with_name("model.onnx.batched").is_file()
+
+    def test_ensure_batch_axis_rechecks_model_if_replaced(self, tmp_path: Path, mocker: MockerFixture) -> None:
+        face_recognizer = FaceRecognizer("buffalo_s", cache_dir=tmp_path)
+        self._save_model(face_recognizer.model_path)
+        face_recognizer._ensure_batch_axis()
+        self._save_model(face_recognizer.model_path)
+        save = mocker.patch("app.models.base.onnx.save", wraps=onnx.save)
+
+        face_recognizer._ensure_batch_axis()
+
+        save.assert_called_once()
+        assert onnx.load(face_recognizer.model_path).graph.input[0].type.tensor_type.shape.dim[0].dim_param == "batch"
+
+    def test_ensure_batch_axis_converts_model_once_across_threads(self, tmp_path: Path, mocker: MockerFixture) -> None:
+        model_path = FaceRecognizer("buffalo_s", cache_dir=tmp_path).model_path
+        self._save_model(model_path)
+        save = mocker.patch("app.models.base.onnx.save", wraps=onnx.save)
+
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(lambda _: FaceRecognizer("buffalo_s", cache_dir=tmp_path)._ensure_batch_axis(), range(4)))
+
+        save.assert_called_once()
+
+    def _make_proto(self, input_shape: list[int | str], output_shapes: dict[str, list[int | str]]) -> onnx.ModelProto:
+        outputs = [
+            onnx.helper.make_tensor_value_info(name, onnx.TensorProto.FLOAT, shape)
+            for name, shape in output_shapes.items()
+        ]
+        graph = onnx.helper.make_graph(
+            [onnx.helper.make_node("Identity", ["input.1"], [name]) for name in output_shapes],
+            "test",
+            [onnx.helper.make_tensor_value_info("input.1", onnx.TensorProto.FLOAT, input_shape)],
+            outputs,
+        )
+        return onnx.helper.make_model(graph)
+
+    def _save_model(self, model_path: Path, batch: int | str = 1) -> None:
+        weight = onnx.numpy_helper.from_array(np.ones((512, 512), dtype=np.float32), "weight")
+        graph = onnx.helper.make_graph(
+            [onnx.helper.make_node("MatMul", ["input.1", "weight"], ["output.1"])],
+            "test",
+            [onnx.helper.make_tensor_value_info("input.1", onnx.TensorProto.FLOAT, [batch, 512])],
+            [onnx.helper.make_tensor_value_info("output.1", onnx.TensorProto.FLOAT, [batch, 512])],
+            [weight],
+        )
+        model = onnx.helper.make_model(graph, opset_imports=[onnx.helper.make_opsetid("", 17)])
+        model.ir_version = 8
+        model_path.parent.mkdir(parents=True, exist_ok=True)
+        onnx.save(model, model_path.as_posix(), save_as_external_data=True, location="model.onnx.data")
+
+
+class TestPreforkLoading:
+    def test_loads_models_before_fork(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(gunicorn_conf, "preload_app", True)
+        mocker.patch.object(settings, "preload", PreloadModelData(clip="ViT-B-32__openai"))
+        mocker.patch.object(settings, "model_intra_op_threads", 4)
+        mocker.patch.object(gunicorn_conf.ort, "get_available_providers", return_value=["CPUExecutionProvider"])
+        mocker.patch.object(gunicorn_conf.ann.ann, "is_available", False)
+        preload_models = mocker.patch("app.main.preload_models")
+        freeze = mocker.patch.object(gunicorn_conf.gc, "freeze")
+
+        gunicorn_conf.when_ready(mock.Mock())
+
+        preload_models.assert_called_once_with(settings.preload, inter_op_threads=1, intra_op_threads=1)
+        assert settings.model_intra_op_threads == 4
+        freeze.assert_called_once()
+
+    def test_does_not_load_models_before_fork_if_using_gpu(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(gunicorn_conf, "preload_app", True)
+        mocker.patch.object(settings, "preload", PreloadModelData(clip="ViT-B-32__openai"))
+        mocker.patch.object(
+            gunicorn_conf.ort, "get_available_providers", return_value=["CUDAExecutionProvider", "CPUExecutionProvider"]
+        )
+        preload_models = mocker.patch("app.main.preload_models")
+
+        gunicorn_conf.when_ready(mock.Mock())
+
+        preload_models.assert_not_called()
+
+    def test_does_not_load_models_before_fork_if_disabled(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(gunicorn_conf, "preload_app", False)
+        preload_models = mocker.patch("app.main.preload_models")
+
+        gunicorn_conf.when_ready(mock.Mock())
+
+        preload_models.assert_not_called()
 
 
 @pytest.mark.asyncio
@@ -634,7 +1851,7 @@ class TestCache:
         model_cache = ModelCache()
         await model_cache.get("test_model_name", ModelType.RECOGNITION, ModelTask.FACIAL_RECOGNITION)
         await model_cache.get("test_model_name", ModelType.RECOGNITION, ModelTask.FACIAL_RECOGNITION)
-        assert len(model_cache.cache._cache) == 1
+        assert len(model_cache.cache) == 1
         mock_get_model.assert_called_once()
 
     async def test_kwargs_used(self, mock_get_model: mock.Mock) -> None:
@@ -656,27 +1873,135 @@ class TestCache:
                 mock.call("test_model_name", ModelType.TEXTUAL, ModelTask.SEARCH),
             ]
         )
-        assert len(model_cache.cache._cache) == 2
+        assert len(model_cache.cache) == 2
 
-    @mock.patch("app.models.cache.OptimisticLock", autospec=True)
-    async def test_model_ttl(self, mock_lock_cls: mock.Mock, mock_get_model: mock.Mock) -> None:
+    @mock.patch("app.models.cache.time.monotonic")
+    async def test_model_ttl(self, monotonic: mock.Mock, mock_get_model: mock.Mock) -> None:
         model_cache = ModelCache()
+        monotonic.return_value = 0
+        await model_cache.get("test_model_name", ModelType.RECOGNITION, ModelTask.FACIAL_RECOGNITION, ttl=100)
+        monotonic.return_value = 101
         await model_cache.get("test_model_name", ModelType.RECOGNITION, ModelTask.FACIAL_RECOGNITION, ttl=100)
-        mock_lock_cls.return_value.__aenter__.return_value.cas.assert_called_with(mock.ANY, ttl=100)
 
-    @mock.patch("app.models.cache.SimpleMemoryCache.expire")
-    async def test_revalidate_get(self, mock_cache_expire: mock.Mock, mock_get_model: mock.Mock) -> None:
+        mock_get_model.return_value.unload.assert_called_once()
+
+    @mock.patch("app.models.cache.time.monotonic")
+    async def test_revalidate_get(self, monotonic: mock.Mock, mock_get_model: mock.Mock) -> None:
         model_cache = ModelCache(revalidate=True)
-        await model_cache.get("test_model_name", ModelType.RECOGNITION, ModelTask.FACIAL_RECOGNITION, ttl=100)
-        await model_cache.get("test_model_name", ModelType.RECOGNITION, ModelTask.FACIAL_RECOGNITION, ttl=100)
-        mock_cache_expire.assert_called_once_with(mock.ANY, 100)
+        for now in [0, 60, 120]:
+            monotonic.return_value = now
+            await model_cache.get("test_model_name", ModelType.RECOGNITION, ModelTask.FACIAL_RECOGNITION, ttl=100)
+
+        mock_get_model.return_value.unload.assert_not_called()
 
     async def test_profiling(self, mock_get_model: mock.Mock) -> None:
         model_cache = ModelCache(profiling=True)
         await model_cache.get("test_model_name", ModelType.RECOGNITION, ModelTask.FACIAL_RECOGNITION, ttl=100)
         profiling = await model_cache.get_profiling()
         assert isinstance(profiling, dict)
-        assert profiling == model_cache.cache.profiling
+        assert profiling == model_cache.profiling
+        assert profiling["get_count"] == 1
+
+    async def test_profiling_records_warmup_time(self) -> None:
+        model_cache = ModelCache(profiling=True)
+        for warmup_time in [1.5, None, 0.5]:
+            model_cache.record_warmup(mock.Mock(warmup_time=warmup_time))
+
+        profiling = await model_cache.get_profiling()
+
+        assert profiling is not None
+        assert profiling["warmup_count"] == 2
+        assert profiling["warmup_total"] == 2.0
+        assert profiling["warmup_max"] == 1.5
+
+    async def test_unloads_least_recently_used_over_budget(self, mock_get_model: mock.Mock) -> None:
+        first, second, third = [mock.Mock(loaded=True, memory_usage=100, ttl=0) for _ in range(3)]
+        mock_get_model.side_effect = [first, second, third]
+        model_cache = ModelCache(memory_budget=250)
+        for model_name in ["first", "second", "first", "third"]:
+            await model_cache.get(model_name, ModelType.VISUAL, ModelTask.SEARCH)
+
+        model_cache.trim(keep=third)
+
+        second.unload.assert_called_once()
+        first.unload.assert_not_called()
+        third.unload.assert_not_called()
+
+    async def test_does_not_unload_pinned_kept_or_used_models_for_budget(self, mock_get_model: mock.Mock) -> None:
+        first, second, third = [mock.Mock(loaded=True, memory_usage=100, ttl=0) for _ in range(3)]
+        mock_get_model.side_effect = [first, second, third]
+        model_cache = ModelCache(memory_budget=50)
+        for model_name in ["first", "second", "third"]:
+            await model_cache.get(model_name, ModelType.VISUAL, ModelTask.SEARCH)
+        model_cache.pin(first)
+
+        with model_cache.use(third):
+            model_cache.trim(keep=second)
+
+        first.unload.assert_not_called()
+        second.unload.assert_not_called()
+        third.unload.assert_not_called()
+
+    async def test_ignores_unloaded_models_for_budget(self, mock_get_model: mock.Mock) -> None:
+        model = mock.Mock(loaded=False, memory_usage=0, ttl=0)
+        mock_get_model.return_value = model
+        model_cache = ModelCache(memory_budget=50)
+        await model_cache.get("first", ModelType.VISUAL, ModelTask.SEARCH)
+
+        model_cache.trim()
+
+        model.unload.assert_not_called()
+
+    @mock.patch("app.models.cache.time.monotonic")
+    async def test_unloads_idle_model_with_own_ttl(self, monotonic: mock.Mock, mock_get_model: mock.Mock) -> None:
+        short, long, forever = [mock.Mock(loaded=True, ttl=ttl) for ttl in [10, 100, 0]]
+        mock_get_model.side_effect = [short, long, forever]
+        model_cache = ModelCache(revalidate=True)
+        monotonic.return_value = 0
+        for model_name in ["short", "long", "forever"]:
+            await model_cache.get(model_name, ModelType.VISUAL, ModelTask.SEARCH)
+
+        monotonic.return_value = 50
+        model_cache.expire()
+
+        short.unload.assert_called_once()
+        long.unload.assert_not_called()
+        forever.unload.assert_not_called()
+        assert len(model_cache.cache) == 3
+
+    @mock.patch("app.models.cache.time.monotonic")
+    async def test_does_not_unload_idle_model_in_use(self, monotonic: mock.Mock, mock_get_model: mock.Mock) -> None:
+        model = mock.Mock(loaded=True, ttl=10)
+        mock_get_model.return_value = model
+        model_cache = ModelCache()
+        monotonic.return_value = 0
+        await model_cache.get("test_model_name", ModelType.VISUAL, ModelTask.SEARCH)
+
+        monotonic.return_value = 50
+        with model_cache.use(model):
+            model_cache.expire()
+        model.unload.assert_not_called()
+
+        monotonic.return_value = 100
+        model_cache.expire()
+        model.unload.assert_called_once()
+
+    @mock.patch("app.models.cache.time.monotonic")
+    async def test_rearms_ttl_after_unloading(self, monotonic: mock.Mock, mock_get_model: mock.Mock) -> None:
+        model = mock.Mock(loaded=True, ttl=10)
+        mock_get_model.return_value = model
+        model_cache = ModelCache()
+        monotonic.return_value = 0
+        await model_cache.get("test_model_name", ModelType.VISUAL, ModelTask.SEARCH)
+        monotonic.return_value = 20
+        model_cache.expire()
+        await model_cache.get("test_model_name", ModelType.VISUAL, ModelTask.SEARCH)
+
+        monotonic.return_value = 40
+        model_cache.expire()
+
+        assert model.unload.call_count == 2
+        mock_get_model.assert_called_once()
 
     async def test_loads_mclip(self) -> None:
         model_cache = ModelCache()
@@ -762,6 +2087,32 @@ class TestCache:
             any_order=True,
         )
 
+    @pytest.mark.parametrize(("pin", "share"), [(True, False), (False, True)])
+    async def test_pins_preloaded_models(
+        self, pin: bool, share: bool, monkeypatch: MonkeyPatch, mock_get_model: mock.Mock
+    ) -> None:
+        monkeypatch.setattr(settings, "pin_preloaded_models", pin)
+        monkeypatch.setattr(settings, "share_preloaded_models", share)
+        model_cache = ModelCache()
+        monkeypatch.setattr("app.main.model_cache", model_cache)
+
+        await preload_models(PreloadModelData(clip="ViT-B-32__openai"))
+
+        assert model_cache.pinned == set(model_cache.cache)
+        assert len(model_cache.pinned) == 2
+
+    async def test_does_not_pin_preloaded_models_by_default(
+        self, monkeypatch: MonkeyPatch, mock_get_model: mock.Mock
+    ) -> None:
+        monkeypatch.setattr(settings, "pin_preloaded_models", False)
+        monkeypatch.setattr(settings, "share_preloaded_models", False)
+        model_cache = ModelCache()
+        monkeypatch.setattr("app.main.model_cache", model_cache)
+
+        await preload_models(PreloadModelData(clip="ViT-B-32__openai"))
+
+        assert not model_cache.pinned
+
 
 @pytest.mark.asyncio
 class TestLoad:
@@ -776,6 +2127,19 @@ class TestLoad:
         mock_model.load.assert_called_once()
         mock_model.clear_cache.assert_not_called()
 
+    async def test_load_records_warmup_time(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(model_cache, "profiling", {})
+        mock_model = mock.Mock(spec=InferenceModel)
+        mock_model.loaded = False
+        mock_model.load_attempts = 0
+        mock_model.warmup_time = 0.5
+
+        await load(mock_model)
+
+        assert model_cache.profiling is not None
+        assert model_cache.profiling["warmup_count"] == 1
+        assert model_cache.profiling["warmup_total"] == 0.5
+
     async def test_load_returns_model_if_loaded(self) -> None:
         mock_model = mock.Mock(spec=InferenceModel)
         mock_model.loaded = True
@@ -814,6 +2178,60 @@ class TestLoad:
         mock_model.clear_cache.assert_not_called()
         mock_model.load.assert_not_called()
 
+    async def test_concurrent_loads_share_one_load(self) -> None:
+        mock_model = mock.Mock(spec=InferenceModel)
+        mock_model.loaded = False
+        mock_model.load_attempts = 0
+
+        results = await asyncio.gather(load(mock_model), load(mock_model), load(mock_model))
+
+        assert all(res is mock_model for res in results)
+        mock_model.load.assert_called_once()
+
+    async def test_loads_different_models_in_parallel(self, monkeypatch: MonkeyPatch) -> None:
+        barrier = threading.Barrier(2, timeout=5)
+        models = [mock.Mock(spec=InferenceModel, loaded=False, load_attempts=0) for _ in range(2)]
+        for model in models:
+            # deadlocks if one model waits for the other to load
+            model.load.side_effect = barrier.wait
+
+        with ThreadPoolExecutor() as pool:
+            monkeypatch.setattr("app.main.load_pool", pool)
+            await asyncio.gather(*[load(model) for model in models])
+
+        for model in models:
+            model.load.assert_called_once()
+
+    async def test_load_raises_503_if_not_waiting_for_load(self, monkeypatch: MonkeyPatch) -> None:
+        event = threading.Event()
+        mock_model = mock.Mock(spec=InferenceModel)
+        mock_model.model_name = "test_model_name"
+        mock_model.model_type = ModelType.VISUAL
+        mock_model.loaded = False
+        mock_model.load_attempts = 0
+        mock_model.load.side_effect = lambda: event.wait(5)
+
+        with ThreadPoolExecutor() as pool:
+            monkeypatch.setattr("app.main.load_pool", pool)
+            with pytest.raises(HTTPException) as e:
+                await load(mock_model, wait=0)
+            event.set()
+            res = await load(mock_model)
+
+        assert e.value.status_code == 503
+        assert e.value.headers == {"Retry-After": "5"}
+        assert res is mock_model
+        mock_model.load.assert_called_once()
+
+    async def test_get_load_wait(self) -> None:
+        assert get_load_wait(None) is None
+        assert get_load_wait("respond-async") is None
+        assert get_load_wait("respond-async, wait=0") == 0
+        assert get_load_wait('wait="2.5"') == 2.5
+
+        with pytest.raises(HTTPException):
+            get_load_wait("wait=soon")
+
     async def test_falls_back_to_onnx_if_other_format_does_not_exist(
         self, exception: mock.Mock, warning: mock.Mock
     ) -> None:
@@ -835,6 +2253,28 @@ class TestLoad:
         warning.assert_called_once_with("ARMNN is available, but model 'test_model_name' does not support it.")
         mock_model.model_format = ModelFormat.ONNX
 
+    async def test_falls_back_to_fp32_if_int8_does_not_exist(
+        self, exception: mock.Mock, warning: mock.Mock, info: mock.Mock
+    ) -> None:
+        mock_model = mock.Mock(spec=InferenceModel)
+        mock_model.model_name = "test_model_name"
+        mock_model.model_type = ModelType.VISUAL
+        mock_model.model_task = ModelTask.SEARCH
+        mock_model.model_format = ModelFormat.ONNX_INT8
+        mock_model.loaded = False
+        mock_model.load_attempts = 0
+        mock_model.load.side_effect = [FileNotFoundError(), None]
+
+        await load(mock_model)
+
+        assert mock_model.load.call_count == 2
+        assert mock_model.model_format == ModelFormat.ONNX
+        info.assert_called_once_with(
+            "Model 'test_model_name' does not have an INT8 variant. Using the FP32 model instead."
+        )
+        exception.assert_not_called()
+        warning.assert_not_called()
+
 
 def test_root_endpoint(deployed_app: TestClient) -> None:
     response = deployed_app.get("http://localhost:3003")
@@ -851,6 +2291,520 @@ def test_ping_endpoint(deployed_app: TestClient) -> None:
     assert response.text == "pong"
 
 
+def test_profiling_endpoint(mocker: MockerFixture) -> None:
+    mocker.patch.object(model_cache, "profiling", {"warmup_count": 1})
+
+    response = TestClient(app).get("/profiling")
+
+    assert response.status_code == 200
+    assert response.json() == {"warmup_count": 1}
+
+
+def test_profiling_endpoint_returns_404_if_disabled(mocker: MockerFixture) -> None:
+    mocker.patch.object(model_cache, "profiling", None)
+
+    response = TestClient(app).get("/profiling")
+
+    assert response.status_code == 404
+
+
+class TestDecodedImage:
+    def test_converts_once(self, pil_image: Image.Image, mocker: MockerFixture) -> None:
+        cvt_color = mocker.patch("app.models.transforms.cv2.cvtColor", wraps=cv2.cvtColor)
+        image = DecodedImage(pil_image)
+
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda _: image.bgr, range(4)))
+
+        cvt_color.assert_called_once()
+        assert np.array_equal(results[0], np.asarray(pil_image)[..., ::-1])
+        assert all(result is results[0] for result in results)
+        assert decode_cv2(image) is results[0]
+        assert decode_pil(image) is pil_image
+
+    def test_builds_pil_from_bgr(self, cv_image: NDArray[np.uint8]) -> None:
+        image = DecodedImage(cv_image)
+
+        assert np.array_equal(np.asarray(image.pil), cv_image[..., ::-1])
+        assert image.pil is image.pil
+        assert (image.width, image.height) == (600, 800)
+
+    def test_models_share_conversion(
+        self,
+        pil_image: Image.Image,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        cvt_color = mocker.patch("app.models.transforms.cv2.cvtColor", wraps=cv2.cvtColor)
+        mocker.patch.object(FaceDetector, "load")
+        mocker.patch.object(FaceRecognizer, "load")
+        face_detector = FaceDetector("buffalo_s", cache_dir="test_cache")
+        face_detector.model = mock.Mock()
+        face_detector.model.detect.return_value = (np.array([[0, 0, 100, 100, 0.9]], dtype=np.float32), None)
+        face_recognizer = FaceRecognizer("buffalo_s", cache_dir="test_cache")
+        face_recognizer.model = mock.Mock()
+        face_recognizer.model.get_feat.return_value = np.random.rand(1, 512).astype(np.float32)
+        mocker.patch("app.models.facial_recognition.recognition.norm_crop", return_value=np.zeros((112, 112, 3)))
+        image = DecodedImage(pil_image)
+
+        faces = face_detector.predict(image)
+        face_recognizer.predict(image, {**faces, "landmarks": np.zeros((1, 5, 2), dtype=np.float32)})
+
+        cvt_color.assert_called_once()
+
+
+class TestPreprocessPool:
+    identity = (ModelType.VISUAL, ModelTask.SEARCH)
+    scale = np.full(3, 1 / 255, dtype=np.float32)
+    shift = np.zeros(3, dtype=np.float32)
+
+    def _transforms(self) -> dict[Any, Any]:
+        transform = partial(resize_crop_normalize, size=32, scale=self.scale, shift=self.shift)
+        return {self.identity: (transform, (3, 32, 32))}
+
+    def _jpeg(self) -> bytes:
+        byte_image = BytesIO()
+        Image.new("RGB", (80, 60), color=(255, 128, 0)).save(byte_image, format="jpeg")
+        return byte_image.getvalue()
+
+    def test_preprocess_round_trip(self) -> None:
+        image_bytes = self._jpeg()
+
+        image = attach(*preprocess(image_bytes, None, self._transforms()))
+        names = [shm.name for shm in image.shared_memory]
+
+        expected_rgb = np.asarray(decode_pil(image_bytes))
+        assert np.array_equal(image.rgb, expected_rgb)
+        assert (image.width, image.height) == (80, 60)
+        expected = resize_crop_normalize(expected_rgb, 32, self.scale, self.shift, np.empty((3, 32, 32), np.float32))
+        assert np.array_equal(image.tensors[self.identity], expected)
+
+        image.close()
+
+        for name in names:
+            with pytest.raises(FileNotFoundError):
+                SharedMemory(name=name)
+
+    def test_preprocess_in_process_pool(self) -> None:
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+            shared = pool.submit(preprocess, self._jpeg(), (40, 30), self._transforms()).result()
+
+        image = attach(*shared)
+        try:
+            assert image.rgb.shape == (30, 40, 3)
+            assert image.tensors[self.identity].shape == (3, 32, 32)
+        finally:
+            image.close()
+
+    def test_preprocess_unlinks_shared_memory_on_error(self, mocker: MockerFixture) -> None:
+        names: list[str] = []
+
+        def _create(**kwargs: Any) -> SharedMemory:
+            shm = SharedMemory(**kwargs)
+            names.append(shm.name)
+            return shm
+
+        mocker.patch("app.models.preprocessing.SharedMemory", side_effect=_create)
+        transform = mock.Mock(side_effect=ValueError("failed"))
+
+        with pytest.raises(ValueError):
+            preprocess(self._jpeg(), None, {self.identity: (transform, (3, 32, 32))})
+
+        assert len(names) == 2
+        for name in names:
+            with pytest.raises(FileNotFoundError):
+                SharedMemory(name=name)
+
+    def test_clip_uses_preprocessed_tensor(
+        self,
+        mocker: MockerFixture,
+        clip_model_cfg: dict[str, Any],
+        clip_preprocess_cfg: Callable[[Path], dict[str, Any]],
+    ) -> None:
+        mocker.patch.object(OpenClipVisualEncoder, "download")
+        mocker.patch.object(OpenClipVisualEncoder, "model_cfg", clip_model_cfg)
+        mocker.patch.object(OpenClipVisualEncoder, "preprocess_cfg", clip_preprocess_cfg)
+        mocked = mocker.patch.object(InferenceModel, "_make_session", autospec=True).return_value
+        mocked.run.return_value = [[np.random.rand(512).astype(np.float32)]]
+        transform = mocker.patch.object(OpenClipVisualEncoder, "transform")
+        tensor = np.random.rand(3, 224, 224).astype(np.float32)
+        image = DecodedImage(np.zeros((60, 80, 3), dtype=np.uint8), tensors={self.identity: tensor})
+
+        clip_encoder = OpenClipVisualEncoder("ViT-B-32__openai", cache_dir="test_cache")
+        clip_encoder.predict(image)
+
+        transform.assert_not_called()
+        feeds = mocked.run.call_args.args[1]
+        assert np.array_equal(feeds["image"], tensor[np.newaxis])
+
+    def test_predict_with_preprocess_pool(
+        self, mock_cached_model: mock.Mock, deployed_app: TestClient, mocker: MockerFixture
+    ) -> None:
+        mocker.patch("app.main.preprocess_pool", ThreadPoolExecutor(1))
+        mock_cached_model.preprocess_transform = self._transforms()[self.identity]
+        images: list[DecodedImage] = []
+
+        def _predict(image: DecodedImage) -> list[float]:
+            images.append(image)
+            return [float(image.tensors[self.identity].mean())]
+
+        mock_cached_model.predict.side_effect = _predict
+
+        response = deployed_app.post(
+            "http://localhost:3003/predict",
+            data={"entries": json.dumps({"clip": {"visual": {"modelName": "ViT-B-32__openai"}}})},
+            files={"image": self._jpeg()},
+        )
+
+        assert response.status_code == 200
+        assert response.json()["imageWidth"] == 80
+        assert response.json()["clip"][0] > 0
+        assert images[0].shared_memory == []
+
+
+class TestPixelsInput:
+    def test_decodes_rgb_buffer_without_copying(self) -> None:
+        rgb = np.random.randint(0, 256, (50, 100, 3), dtype=np.uint8)
+        buffer = rgb.tobytes()
+
+        image = decode_rgb_buffer(buffer, 100, 50)
+
+        assert np.array_equal(image, rgb[..., ::-1])
+        assert np.shares_memory(image, np.frombuffer(buffer, dtype=np.uint8))
+        assert np.array_equal(np.asarray(decode_pil(image)), rgb)
+
+    def test_raises_exception_if_buffer_size_does_not_match(self) -> None:
+        with pytest.raises(ValueError):
+            decode_rgb_buffer(bytes(100 * 50 * 3), 100, 49)
+
+    def test_predict_with_pixels(self, mock_cached_model: mock.Mock, deployed_app: TestClient) -> None:
+        mock_cached_model.predict.side_effect = lambda image: [float(image.bgr[0, 0, 2])]
+        rgb = np.zeros((50, 100, 3), dtype=np.uint8)
+        rgb[..., 0] = 7
+
+        response = deployed_app.post(
+            "http://localhost:3003/predict",
+            data={
+                "entries": json.dumps({"clip": {"visual": {"modelName": "ViT-B-32__openai"}}}),
+                "width": "100",
+                "height": "50",
+            },
+            files={"pixels": rgb.tobytes()},
+        )
+
+        assert response.status_code == 200
+        assert response.json() == {"clip": [7.0], "imageHeight": 50, "imageWidth": 100}
+        (image,) = mock_cached_model.predict.call_args.args
+        assert isinstance(image, DecodedImage)
+        assert image.bgr.shape == (50, 100, 3)
+
+    def test_predict_with_pixels_raises_if_size_does_not_match(
+        self, mock_cached_model: mock.Mock, deployed_app: TestClient
+    ) -> None:
+        response = deployed_app.post(
+            "http://localhost:3003/predict",
+            data={
+                "entries": json.dumps({"clip": {"visual": {"modelName": "ViT-B-32__openai"}}}),
+                "width": "100",
+                "height": "60",
+            },
+            files={"pixels": bytes(100 * 50 * 3)},
+        )
+
+        assert response.status_code == 400
+        mock_cached_model.predict.assert_not_called()
+
+    def test_predict_with_pixels_raises_if_no_size(
+        self, mock_cached_model: mock.Mock, deployed_app: TestClient
+    ) -> None:
+        response = deployed_app.post(
+            "http://localhost:3003/predict",
+            data={"entries": json.dumps({"clip": {"visual": {"modelName": "ViT-B-32__openai"}}})},
+            files={"pixels": bytes(100 * 50 * 3)},
+        )
+
+        assert response.status_code == 400
+        mock_cached_model.predict.assert_not_called()
+
+
+class TestReducedDecoding:
+    def test_decodes_jpeg_at_reduced_scale(self) -> None:
+        byte_image = BytesIO()
+        Image.new("RGB", (2000, 1600)).save(byte_image, format="jpeg")
+
+        image = decode_pil(byte_image.getvalue(), lambda size: (300, 300))
+
+        assert image.size == (500, 400)
+        assert image.mode == "RGB"
+
+    def test_decodes_at_full_resolution_if_no_min_size(self) -> None:
+        byte_image = BytesIO()
+        Image.new("RGB", (2000, 1600)).save(byte_image, format="jpeg")
+
+        image = decode_pil(byte_image.getvalue(), lambda size: None)
+
+        assert image.size == (2000, 1600)
+
+    def test_ignores_min_size_for_non_jpeg(self) -> None:
+        byte_image = BytesIO()
+        Image.new("RGB", (2000, 1600)).save(byte_image, format="png")
+
+        image = decode_pil(byte_image.getvalue(), lambda size: (300, 300))
+
+        assert image.size == (2000, 1600)
+
+    def test_detection_min_image_size(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(FaceDetector, "load")
+        face_detector = FaceDetector("buffalo_s", cache_dir="test_cache")
+
+        assert face_detector.min_image_size((4000, 3000)) == (640, 480)
+        assert face_detector.min_image_size((3000, 4000)) == (480, 640)
+
+    def test_recognition_needs_full_resolution(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(FaceRecognizer, "load")
+        face_recognizer = FaceRecognizer("buffalo_s", cache_dir="test_cache")
+
+        assert face_recognizer.min_image_size((4000, 3000)) is None
+
+    def test_combines_min_sizes_of_models(self) -> None:
+        models: list[Any] = [mock.Mock(spec=InferenceModel), mock.Mock(spec=InferenceModel)]
+        models[0].min_image_size.return_value = (224, 224)
+        models[1].min_image_size.return_value = (640, 200)
+
+        assert min_image_size(models, (4000, 3000)) == (640, 224)
+
+        models[1].min_image_size.return_value = None
+
+        assert min_image_size(models, (4000, 3000)) is None
+
+    def test_predict_decodes_at_reduced_scale(self, mock_cached_model: mock.Mock, deployed_app: TestClient) -> None:
+        mock_cached_model.predict.side_effect = lambda image: [image.width]
+        mock_cached_model.min_image_size.return_value = (100, 100)
+        byte_image = BytesIO()
+        Image.new("RGB", (800, 400)).save(byte_image, format="jpeg")
+
+        response = deployed_app.post(
+            "http://localhost:3003/predict",
+            data={"entries": json.dumps({"clip": {"visual": {"modelName": "ViT-B-32__openai"}}})},
+            files={"image": byte_image.getvalue()},
+        )
+
+        assert response.status_code == 200
+        assert response.json() == {"clip": [200], "imageHeight": 100, "imageWidth": 200}
+        mock_cached_model.min_image_size.assert_called_once_with((800, 400))
+
+
+class TestPredictBatchEndpoint:
+    def test_texts(self, mock_cached_model: mock.Mock, deployed_app: TestClient) -> None:
+        mock_cached_model.predict.side_effect = lambda text: [len(text)]
+
+        response = deployed_app.post(
+            "http://localhost:3003/predict/batch",
+            data={
+                "entries": json.dumps({"clip": {"textual": {"modelName": "ViT-B-32__openai"}}}),
+                "texts": ["a", "bb", "ccc"],
+            },
+        )
+
+        assert response.status_code == 200
+        assert response.json() == [{"clip": [1]}, {"clip": [2]}, {"clip": [3]}]
+        assert mock_cached_model.predict.call_count == 3
+
+    def test_images(self, mock_cached_model: mock.Mock, deployed_app: TestClient) -> None:
+        mock_cached_model.predict.side_effect = lambda image: [image.width]
+        images = []
+        for size in [(100, 50), (200, 80)]:
+            byte_image = BytesIO()
+            Image.new("RGB", size).save(byte_image, format="jpeg")
+            images.append(("images", byte_image.getvalue()))
+
+        response = deployed_app.post(
+            "http://localhost:3003/predict/batch",
+            data={"entries": json.dumps({"clip": {"visual": {"modelName": "ViT-B-32__openai"}}})},
+            files=images,
+        )
+
+        assert response.status_code == 200
+        assert response.json() == [
+            {"clip": [100], "imageHeight": 50, "imageWidth": 100},
+            {"clip": [200], "imageHeight": 80, "imageWidth": 200},
+        ]
+
+    def test_closes_decoded_images_if_one_fails(
+        self, mock_cached_model: mock.Mock, deployed_app: TestClient, mocker: MockerFixture
+    ) -> None:
+        decoded = mock.Mock(spec=DecodedImage)
+        mocker.patch("app.main.decode_image", side_effect=[decoded, HTTPException(422, "Invalid image")])
+
+        response = deployed_app.post(
+            "http://localhost:3003/predict/batch",
+            data={"entries": json.dumps({"clip": {"visual": {"modelName": "ViT-B-32__openai"}}})},
+            files=[("images", b"image"), ("images", b"not an image")],
+        )
+
+        assert response.status_code == 422
+        decoded.close.assert_called_once()
+        mock_cached_model.predict.assert_not_called()
+
+    def test_raises_if_no_inputs(self, mock_cached_model: mock.Mock, deployed_app: TestClient) -> None:
+        response = deployed_app.post(
+            "http://localhost:3003/predict/batch",
+            data={"entries": json.dumps({"clip": {"visual": {"modelName": "ViT-B-32__openai"}}})},
+        )
+
+        assert response.status_code == 400
+        mock_cached_model.predict.assert_not_called()
+
+
+class TestOptionValidation:
+    def test_rejects_unknown_embedding_dtype(self, mock_cached_model: mock.Mock, deployed_app: TestClient) -> None:
+        entries = {"clip": {"textual": {"modelName": "ViT-B-32__openai", "options": {"embeddingDtype": "int4"}}}}
+
+        response = deployed_app.post(
+            "http://localhost:3003/predict", data={"entries": json.dumps(entries), "text": "test search query"}
+        )
+
+        assert response.status_code == 422
+        assert "int4" in response.json()["detail"]
+        mock_cached_model.predict.assert_not_called()
+
+    def test_accepts_embedding_dtype(self, mock_cached_model: mock.Mock, deployed_app: TestClient) -> None:
+        mock_cached_model.predict.return_value = [1.0]
+        entries = {"clip": {"textual": {"modelName": "ViT-B-32__openai", "options": {"embeddingDtype": "float16"}}}}
+
+        response = deployed_app.post(
+            "http://localhost:3003/predict", data={"entries": json.dumps(entries), "text": "test search query"}
+        )
+
+        assert response.status_code == 200
+        mock_cached_model.predict.assert_called_once_with("test search query", embeddingDtype="float16")
+
+    @pytest.mark.parametrize(
+        ("model_name", "dimension"),
+        [("ViT-B-32__openai", 256), ("nllb-clip-base-siglip__mrl", 1024), ("nllb-clip-base-siglip__mrl", 256.7)],
+    )
+    def test_rejects_invalid_embedding_dimension(
+        self, model_name: str, dimension: Any, mock_cached_model: mock.Mock, deployed_app: TestClient
+    ) -> None:
+        entries = {"clip": {"textual": {"modelName": model_name, "options": {"embeddingDimension": dimension}}}}
+
+        response = deployed_app.post(
+            "http://localhost:3003/predict", data={"entries": json.dumps(entries), "text": "test search query"}
+        )
+
+        assert response.status_code == 422
+        mock_cached_model.predict.assert_not_called()
+
+    def test_accepts_embedding_dimension_for_mrl_model(
+        self, mock_cached_model: mock.Mock, deployed_app: TestClient
+    ) -> None:
+        mock_cached_model.predict.return_value = [1.0]
+        options = {"embeddingDimension": 256}
+        entries = {"clip": {"textual": {"modelName": "nllb-clip-base-siglip__mrl", "options": options}}}
+
+        response = deployed_app.post(
+            "http://localhost:3003/predict", data={"entries": json.dumps(entries), "text": "test search query"}
+        )
+
+        assert response.status_code == 200
+        mock_cached_model.predict.assert_called_once_with("test search query", embeddingDimension=256)
+
+
+class TestPackedResponse:
+    def test_round_trip(self) -> None:
+        content: dict[str, Any] = {
+            "clip": np.random.rand(512).astype(np.float32),
+            "nested": [{"values": np.arange(6, dtype=np.int8).reshape(2, 3), "score": np.float32(0.5)}],
+            "imageHeight": 100,
+        }
+
+        packed = pack(content)
+        unpacked = unpack(packed)
+
+        assert np.array_equal(unpacked["clip"], content["clip"])
+        assert unpacked["clip"].dtype == np.float32
+        assert np.array_equal(unpacked["nested"][0]["values"], content["nested"][0]["values"])
+        assert unpacked["nested"][0]["values"].dtype == np.int8
+        assert unpacked["nested"][0]["score"] == 0.5
+        assert unpacked["imageHeight"] == 100
+
+    def test_aligns_buffers(self) -> None:
+        packed = pack({"a": np.ones(3, dtype=np.int8), "b": np.ones(3, dtype=np.float32)})
+        header_length = int.from_bytes(packed[:4], "little")
+        header = json.loads(packed[4 : 4 + header_length])
+
+        assert (4 + header_length) % 8 == 0
+        assert all(spec["offset"] % 8 == 0 for spec in header["arrays"])
+
+    def test_packs_faces_as_arrays(self) -> None:
+        faces: list[Any] = [
+            {
+                "boundingBox": {
+                    "x1": np.float32(i),
+                    "y1": np.float32(i + 1),
+                    "x2": np.float32(i + 2),
+                    "y2": np.float32(i + 3),
+                },
+                "embedding": np.random.rand(512).astype(np.float32),
+                "score": np.float32(0.9),
+            }
+            for i in range(3)
+        ]
+
+        packed = bytes(PackedResponse({"facial-recognition": faces, "imageHeight": 10, "imageWidth": 20}).body)
+        unpacked = unpack(packed)
+
+        assert unpacked["facial-recognition"]["boxes"].shape == (3, 4)
+        assert np.array_equal(unpacked["facial-recognition"]["boxes"][1], [1, 2, 3, 4])
+        assert unpacked["facial-recognition"]["scores"].shape == (3,)
+        assert np.array_equal(unpacked["facial-recognition"]["embeddings"], np.stack([f["embedding"] for f in faces]))
+        assert unpacked["imageHeight"] == 10
+
+    def test_packs_quantized_faces_with_scales(self) -> None:
+        faces: list[Any] = [
+            {
+                "boundingBox": {"x1": 0.0, "y1": 1.0, "x2": 2.0, "y2": 3.0},
+                "embedding": {"values": np.full(512, i, dtype=np.int8), "scale": 0.5 * (i + 1)},
+                "score": 0.9,
+            }
+            for i in range(3)
+        ]
+
+        unpacked = unpack(bytes(PackedResponse({"facial-recognition": faces}).body))
+
+        assert unpacked["facial-recognition"]["embeddings"].dtype == np.int8
+        assert unpacked["facial-recognition"]["embeddings"].shape == (3, 512)
+        assert np.array_equal(unpacked["facial-recognition"]["embeddingScales"], [0.5, 1.0, 1.5])
+
+    def test_predict_endpoint_negotiates_packed_response(
+        self, mock_cached_model: mock.Mock, deployed_app: TestClient
+    ) -> None:
+        embedding = np.random.rand(512).astype(np.float32)
+        mock_cached_model.predict.return_value = embedding
+
+        response = deployed_app.post(
+            "http://localhost:3003/predict",
+            data={"entries": json.dumps({"clip": {"textual": {"modelName": "ViT-B-32__openai"}}}), "text": "test"},
+            headers={"Accept": PACKED_MEDIA_TYPE},
+        )
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == PACKED_MEDIA_TYPE
+        assert np.array_equal(unpack(response.content)["clip"], embedding)
+
+    def test_predict_endpoint_defaults_to_json(self, mock_cached_model: mock.Mock, deployed_app: TestClient) -> None:
+        mock_cached_model.predict.return_value = [1.0, 2.0]
+
+        response = deployed_app.post(
+            "http://localhost:3003/predict",
+            data={"entries": json.dumps({"clip": {"textual": {"modelName": "ViT-B-32__openai"}}}), "text": "test"},
+        )
+
+        assert response.status_code == 200
+        assert response.json() == {"clip": [1.0, 2.0]}
+
+
 @pytest.mark.skipif(
     not settings.test_full,
     reason="More time-consuming since it deploys the app and loads models.",
@@ -0,0 +1,68 @@
+import tempfile
+import urllib.request
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import onnx
+import onnxruntime as ort
+
+from .util import get_model_path, verify_outputs
+
+MODEL_URL = "https://github.com/deepinsight/insightface/releases/download/v0.7/{model_name}.zip"
+models = ["antelopev2", "buffalo_l", "buffalo_m", "buffalo_s"]
+
+
+def to_onnx(
+    model_name: str,
+    output_dir_detection: Path | str,
+    output_dir_recognition: Path | str,
+) -> tuple[Path, Path]:
+    detection_path = get_model_path(output_dir_detection)
+    recognition_path = get_model_path(output_dir_recognition)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive_path = Path(tmpdir) / f"{model_name}.zip"
+        urllib.request.urlretrieve(MODEL_URL.format(model_name=model_name), archive_path)
+        with zipfile.ZipFile(archive_path) as archive:
+            archive.extractall(tmpdir)
+
+        # the packs also include landmark and attribute models, which aren't used
+        for model_path in sorted(Path(tmpdir).rglob("*.onnx")):
+            proto = onnx.load(model_path.as_posix())
+            input_shape = [dim.dim_value for dim in proto.graph.input[0].type.tensor_type.shape.dim]
+            if len(proto.graph.output) > 1:
+                export_detector(proto, model_path, detection_path)
+            elif input_shape[1:] == [3, 112, 112]:
+                export_recognizer(proto, model_path, recognition_path)
+
+    if not detection_path.is_file() or not recognition_path.is_file():
+        raise ValueError(f"Could not find detection and recognition models for {model_name}")
+    return detection_path, recognition_path
+
+
+def export_detector(proto: onnx.ModelProto, model_path: Path, output_path: Path) -> None:
+    # outputs are flattened across the anchors of each image, so a batch of images concatenates them
+    proto.graph.input[0].type.tensor_type.shape.dim[0].dim_param = "batch"
+    for output in proto.graph.output:
+        output.type.tensor_type.shape.dim[0].dim_param = f"{output.name}_anchors"
+    onnx.save(proto, output_path.as_posix())
+
+    images = np.random.default_rng(0).standard_normal((3, 3, 640, 640), dtype=np.float32)
+    verify_outputs(output_path, {proto.graph.input[0].name: images}, _run_separately(model_path, images))
+
+
+def export_recognizer(proto: onnx.ModelProto, model_path: Path, output_path: Path) -> None:
+    proto.graph.input[0].type.tensor_type.shape.dim[0].dim_param = "batch"
+    proto.graph.output[0].type.tensor_type.shape.dim[0].dim_param = "batch"
+    onnx.save(proto, output_path.as_posix())
+
+    faces = np.random.default_rng(0).standard_normal((3, 3, 112, 112), dtype=np.float32)
+    verify_outputs(output_path, {proto.graph.input[0].name: faces}, _run_separately(model_path, faces))
+
+
+def _run_separately(model_path: Path, inputs: np.ndarray) -> list[np.ndarray]:
+    # reference outputs from the original graph, one image at a time as it was made for
+    session = ort.InferenceSession(model_path.as_posix(), providers=["CPUExecutionProvider"])
+    name = session.get_inputs()[0].name
+    outputs = [session.run(None, {name: inputs[i : i + 1]}) for i in range(inputs.shape[0])]
+    return [np.concatenate([output[i] for output in outputs]) for i in range(len(outputs[0]))]
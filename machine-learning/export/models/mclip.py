@@ -5,11 +5,11 @@ from pathlib import Path
 
 import torch
 from multilingual_clip.pt_multilingual_clip import MultilingualCLIP
-from transformers import AutoTokenizer
+from transformers import AutoTokenizer, PreTrainedTokenizerBase
 
 from .openclip import OpenCLIPModelConfig
 from .openclip import to_onnx as openclip_to_onnx
-from .util import get_model_path
+from .util import SAMPLE_TEXTS, get_model_path, verify_outputs
 
 _MCLIP_TO_OPENCLIP = {
     "M-CLIP/XLM-Roberta-Large-Vit-B-32": OpenCLIPModelConfig("ViT-B-32", "openai"),
@@ -27,19 +27,20 @@ def to_onnx(
     textual_path = get_model_path(output_dir_textual)
     with tempfile.TemporaryDirectory() as tmpdir:
         model = MultilingualCLIP.from_pretrained(model_name, cache_dir=os.environ.get("CACHE_DIR", tmpdir))
-        AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir_textual)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        tokenizer.save_pretrained(output_dir_textual)
 
         model.eval()
         for param in model.parameters():
             param.requires_grad_(False)
 
-        export_text_encoder(model, textual_path)
+        export_text_encoder(model, tokenizer, textual_path)
         visual_path, _ = openclip_to_onnx(_MCLIP_TO_OPENCLIP[model_name], output_dir_visual)
         assert visual_path is not None, "Visual model export failed"
     return visual_path, textual_path
 
 
-def export_text_encoder(model: MultilingualCLIP, output_path: Path | str) -> None:
+def export_text_encoder(model: MultilingualCLIP, tokenizer: PreTrainedTokenizerBase, output_path: Path | str) -> None:
     output_path = Path(output_path)
 
     def forward(self: MultilingualCLIP, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
@@ -62,8 +63,17 @@ def export_text_encoder(model: MultilingualCLIP, output_path: Path | str) -> Non
             input_names=["input_ids", "attention_mask"],
             output_names=["embedding"],
             opset_version=17,
-            # dynamic_axes={
-            #     "input_ids": {0: "batch_size", 1: "sequence_length"},
-            #     "attention_mask": {0: "batch_size", 1: "sequence_length"},
-            # },
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "embedding": {0: "batch"},
+            },
         )
+
+    # the attention mask excludes padding from the embeddings, so they don't depend on how much there is
+    for padding in ["max_length", "longest"]:
+        tokens = tokenizer(SAMPLE_TEXTS, padding=padding, max_length=77, truncation=True, return_tensors="pt")
+        input_ids, attention_mask = tokens["input_ids"].to(torch.int32), tokens["attention_mask"].to(torch.int32)
+        expected = [model(input_ids, attention_mask).numpy()]
+        feeds = {"input_ids": input_ids.numpy(), "attention_mask": attention_mask.numpy()}
+        verify_outputs(output_path, feeds, expected)
@@ -8,7 +8,7 @@ import open_clip
 import torch
 from transformers import AutoTokenizer
 
-from .util import get_model_path, save_config
+from .util import SAMPLE_TEXTS, get_model_path, save_config, verify_outputs
 
 
 @dataclass
@@ -86,15 +86,20 @@ def export_image_encoder(model: open_clip.CLIP, model_cfg: OpenCLIPModelConfig,
             input_names=["image"],
             output_names=["embedding"],
             opset_version=17,
-            # dynamic_axes={"image": {0: "batch_size"}},
+            dynamic_axes={"image": {0: "batch"}, "embedding": {0: "batch"}},
         )
 
+    images = torch.randn(3, 3, model_cfg.image_size, model_cfg.image_size)
+    verify_outputs(output_path, {"image": images.numpy()}, [encode_image(images).numpy()])
+
 
 def export_text_encoder(model: open_clip.CLIP, model_cfg: OpenCLIPModelConfig, output_path: Path | str) -> None:
     output_path = Path(output_path)
 
+    dynamic_sequence = has_causal_text_tower(model)
+
     def encode_text(text: torch.Tensor) -> torch.Tensor:
-        output = model.encode_text(text, normalize=True)
+        output = encode_truncated_text(model, text) if dynamic_sequence else model.encode_text(text, normalize=True)
         assert isinstance(output, torch.Tensor)
         return output
 
@@ -110,5 +115,47 @@ def export_text_encoder(model: open_clip.CLIP, model_cfg: OpenCLIPModelConfig, o
             input_names=["text"],
             output_names=["embedding"],
             opset_version=17,
-            # dynamic_axes={"text": {0: "batch_size"}},
+            dynamic_axes={
+                "text": {0: "batch", 1: "sequence"} if dynamic_sequence else {0: "batch"},
+                "embedding": {0: "batch"},
+            },
         )
+
+    tokenizer = open_clip.get_tokenizer(model_cfg.name, context_length=model_cfg.sequence_length)
+    text = tokenizer(SAMPLE_TEXTS).to(torch.int32)
+    expected = [model.encode_text(text, normalize=True).numpy()]
+    verify_outputs(output_path, {"text": text.numpy()}, expected)
+    if dynamic_sequence:
+        # the padding after the longest text can be left out without changing the embeddings
+        length = int(text.argmax(dim=-1).max()) + 1
+        verify_outputs(output_path, {"text": text[:, :length].numpy()}, expected)
+
+
+def has_causal_text_tower(model: torch.nn.Module) -> bool:
+    """
+    Whether the model's text embeddings are taken from the EOT token of a causal transformer, in which case the tokens
+    after it don't affect them and can be left out.
+    """
+
+    return (
+        isinstance(model, open_clip.CLIP)
+        and getattr(model, "text_pool_type", "argmax") == "argmax"
+        and getattr(model, "attn_mask", None) is not None
+    )
+
+
+def encode_truncated_text(model: open_clip.CLIP, text: torch.Tensor) -> torch.Tensor:
+    # same as `CLIP.encode_text`, but with the positional embedding and causal mask cut to the length of the input
+    cast_dtype = model.transformer.get_cast_dtype()
+    sequence_length = text.shape[1]
+
+    x = model.token_embedding(text).to(cast_dtype)
+    x = x + model.positional_embedding[:sequence_length].to(cast_dtype)
+    x = model.transformer(x, attn_mask=model.attn_mask[:sequence_length, :sequence_length])
+    x = model.ln_final(x)
+    x = x[torch.arange(x.shape[0]), text.argmax(dim=-1)]
+    if isinstance(model.text_projection, torch.nn.Linear):
+        x = model.text_projection(x)
+    elif model.text_projection is not None:
+        x = x @ model.text_projection
+    return torch.nn.functional.normalize(x, dim=-1)
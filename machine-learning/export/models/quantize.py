@@ -0,0 +1,202 @@
+import json
+import tempfile
+from pathlib import Path
+from typing import Any, Iterator
+
+import numpy as np
+import onnx
+import onnxruntime as ort
+from numpy.typing import NDArray
+from onnx.external_data_helper import uses_external_data
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quant_pre_process,
+    quantize_dynamic,
+    quantize_static,
+)
+from PIL import Image
+from tokenizers import Tokenizer
+
+# a variant is only kept if its embeddings are close enough to those of the fp32 model
+MIN_MEAN_COSINE_SIMILARITY = 0.99
+MIN_COSINE_SIMILARITY = 0.97
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+VALIDATION_TEXTS = [
+    "a photo of a dog",
+    "a cat sleeping on a couch",
+    "people walking on a beach at sunset",
+    "a plate of pasta with tomato sauce",
+    "snow-covered mountains under a clear sky",
+    "a birthday cake with candles",
+    "a red car parked on the street",
+    "a child playing with a ball in the park",
+    "the city skyline at night",
+    "a bowl of fruit on a wooden table",
+    "ein Hund, der im Schnee spielt",
+    "une tour Eiffel illuminée la nuit",
+    "un grupo de amigos en una fiesta",
+    "富士山と桜",
+    "",
+]
+
+
+def get_quantized_path(model_path: Path | str) -> Path:
+    return Path(model_path).with_suffix(".int8.onnx")
+
+
+def quantize_visual(model_path: Path | str, image_dir: Path | str | None, max_images: int = 500) -> Path | None:
+    """
+    Saves an INT8 variant of a visual model next to it, using static quantization calibrated on the images in
+    `image_dir` if it's accurate enough, or dynamic quantization otherwise. Returns None if neither is.
+    """
+
+    model_path = Path(model_path)
+    if image_dir is None:
+        print(f"Skipping quantization of {model_path}: no images to validate against")
+        return None
+
+    images = sorted(path for path in Path(image_dir).rglob("*") if path.suffix.lower() in IMAGE_SUFFIXES)[:max_images]
+    if len(images) < 2:
+        print(f"Skipping quantization of {model_path}: found fewer than 2 images in {image_dir}")
+        return None
+
+    preprocess_cfg = json.load((model_path.parent / "preprocess_cfg.json").open())
+    # held out from calibration so that static quantization isn't validated on the data it was fit to
+    calibration = [preprocess_image(path, preprocess_cfg) for path in images[1::2]]
+    validation = [preprocess_image(path, preprocess_cfg) for path in images[::2]]
+    return _quantize(model_path, [{"image": image} for image in validation], [{"image": i} for i in calibration])
+
+
+def quantize_textual(model_path: Path | str) -> Path | None:
+    """
+    Saves an INT8 variant of a textual model next to it using dynamic quantization, if it's accurate enough on a
+    set of sample captions. Returns None if it isn't.
+    """
+
+    model_path = Path(model_path)
+    input_names = {node.name for node in _session(model_path).get_inputs()}
+    context_length = json.load((model_path.parent.parent / "config.json").open())["text_cfg"].get("context_length", 77)
+    tokenizer = load_tokenizer(model_path.parent, context_length)
+    return _quantize(model_path, [tokenize(tokenizer, text, input_names) for text in VALIDATION_TEXTS])
+
+
+def _quantize(
+    model_path: Path,
+    validation: list[dict[str, NDArray[Any]]],
+    calibration: list[dict[str, NDArray[Any]]] | None = None,
+) -> Path | None:
+    output_path = get_quantized_path(model_path)
+    expected = _embed(model_path, validation)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        preprocessed_path = Path(tmpdir) / "model.onnx"
+        try:
+            quant_pre_process(model_path.as_posix(), preprocessed_path.as_posix(), skip_symbolic_shape=True)
+        except Exception as e:
+            print(f"Failed to preprocess {model_path} for quantization, quantizing it as is: {e}")
+            preprocessed_path = model_path
+
+        use_external_data = _uses_external_data(model_path)
+        modes = ["static", "dynamic"] if calibration else ["dynamic"]
+        for mode in modes:
+            if mode == "static":
+                assert calibration is not None
+                try:
+                    quantize_static(
+                        preprocessed_path.as_posix(),
+                        output_path.as_posix(),
+                        _CalibrationReader(calibration),
+                        quant_format=QuantFormat.QDQ,
+                        per_channel=True,
+                        activation_type=QuantType.QUInt8,
+                        weight_type=QuantType.QInt8,
+                        use_external_data_format=use_external_data,
+                    )
+                except Exception as e:
+                    print(f"Failed to statically quantize {model_path}, trying dynamic quantization instead: {e}")
+                    continue
+            else:
+                quantize_dynamic(
+                    preprocessed_path.as_posix(),
+                    output_path.as_posix(),
+                    per_channel=True,
+                    weight_type=QuantType.QInt8,
+                    use_external_data_format=use_external_data,
+                )
+
+            similarity = _cosine_similarity(expected, _embed(output_path, validation))
+            print(
+                f"{mode.capitalize()} INT8 variant of {model_path}: mean cosine similarity {similarity.mean():.4f}, "
+                f"min {similarity.min():.4f}"
+            )
+            if similarity.mean() >= MIN_MEAN_COSINE_SIMILARITY and similarity.min() >= MIN_COSINE_SIMILARITY:
+                return output_path
+
+    print(f"Discarding INT8 variant of {model_path} as it isn't accurate enough")
+    output_path.unlink(missing_ok=True)
+    output_path.with_name(f"{output_path.name}.data").unlink(missing_ok=True)
+    return None
+
+
+def _uses_external_data(model_path: Path) -> bool:
+    # the weights may be saved in any number of files, so the model itself is checked rather than the folder
+    proto = onnx.load(model_path.as_posix(), load_external_data=False)
+    return any(uses_external_data(initializer) for initializer in proto.graph.initializer)
+
+
+class _CalibrationReader(CalibrationDataReader):
+    def __init__(self, feeds: list[dict[str, NDArray[Any]]]) -> None:
+        self.feeds: Iterator[dict[str, NDArray[Any]]] = iter(feeds)
+
+    def get_next(self) -> dict[str, NDArray[Any]] | None:
+        return next(self.feeds, None)
+
+
+def preprocess_image(path: Path, preprocess_cfg: dict[str, Any]) -> NDArray[np.float32]:
+    size = preprocess_cfg["size"]
+    width, height = (size, size) if isinstance(size, int) else size
+    image = Image.open(path).convert("RGB")
+    # resizes the shortest side and center crops, which is close enough to the runtime for calibration
+    scale = max(width / image.width, height / image.height)
+    image = image.resize((round(image.width * scale), round(image.height * scale)), Image.Resampling.BICUBIC)
+    left, top = (image.width - width) // 2, (image.height - height) // 2
+    image = image.crop((left, top, left + width, top + height))
+
+    mean = np.array(preprocess_cfg["mean"], dtype=np.float32)
+    std = np.array(preprocess_cfg["std"], dtype=np.float32)
+    array: NDArray[np.float32] = (np.asarray(image, dtype=np.float32) / 255.0 - mean) / std
+    return array.transpose(2, 0, 1)[np.newaxis]
+
+
+def load_tokenizer(textual_dir: Path, context_length: int) -> Tokenizer:
+    tokenizer: Tokenizer = Tokenizer.from_file((textual_dir / "tokenizer.json").as_posix())
+    pad_token: str = json.load((textual_dir / "tokenizer_config.json").open())["pad_token"]
+    tokenizer.enable_padding(length=context_length, pad_token=pad_token, pad_id=tokenizer.token_to_id(pad_token))
+    tokenizer.enable_truncation(max_length=context_length)
+    return tokenizer
+
+
+def tokenize(tokenizer: Tokenizer, text: str, input_names: set[str]) -> dict[str, NDArray[Any]]:
+    encoding = tokenizer.encode(text)
+    if "text" in input_names:
+        return {"text": np.array([encoding.ids], dtype=np.int32)}
+    return {
+        "input_ids": np.array([encoding.ids], dtype=np.int32),
+        "attention_mask": np.array([encoding.attention_mask], dtype=np.int32),
+    }
+
+
+def _embed(model_path: Path, feeds: list[dict[str, NDArray[Any]]]) -> NDArray[np.float32]:
+    session = _session(model_path)
+    embeddings: NDArray[np.float32] = np.concatenate([session.run(None, feed)[0] for feed in feeds])
+    return embeddings
+
+
+def _session(model_path: Path) -> ort.InferenceSession:
+    return ort.InferenceSession(model_path.as_posix(), providers=["CPUExecutionProvider"])
+
+
+def _cosine_similarity(a: NDArray[np.float32], b: NDArray[np.float32]) -> NDArray[np.float32]:
+    similarity: NDArray[np.float32] = (a * b).sum(axis=-1) / (np.linalg.norm(a, axis=-1) * np.linalg.norm(b, axis=-1))
+    return similarity
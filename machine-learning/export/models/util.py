@@ -2,6 +2,13 @@ import json
 from pathlib import Path
 from typing import Any
 
+import numpy as np
+import onnxruntime as ort
+from numpy.typing import NDArray
+
+# captions to compare a textual model's outputs with, with differing lengths to cover padding
+SAMPLE_TEXTS = ["a photo of a dog", "people walking on a beach at sunset with their dogs", ""]
+
 
 def get_model_path(output_dir: Path | str) -> Path:
     output_dir = Path(output_dir)
@@ -13,3 +20,32 @@ def save_config(config: Any, output_path: Path | str) -> None:
     output_path = Path(output_path)
     output_path.parent.mkdir(parents=True, exist_ok=True)
     json.dump(config, output_path.open("w"))
+
+
+def verify_outputs(
+    model_path: Path | str, feeds: dict[str, NDArray[Any]], expected: list[NDArray[Any]], atol: float = 1e-4
+) -> None:
+    """
+    Checks that an exported model gives the expected outputs for a batch of inputs, both when run on the whole batch
+    and on each item separately, to catch dimensions that were fixed when the model was traced.
+    """
+
+    session = ort.InferenceSession(Path(model_path).as_posix(), providers=["CPUExecutionProvider"])
+    batch_size = next(iter(feeds.values())).shape[0]
+    batched = session.run(None, feeds)
+    separate = [session.run(None, {name: feed[i : i + 1] for name, feed in feeds.items()}) for i in range(batch_size)]
+    for i, expected_output in enumerate(expected):
+        # concatenated rather than stacked for outputs that are flattened across the batch, like detection anchors
+        separate_output = np.concatenate([outputs[i] for outputs in separate])
+        for actual in (batched[i], separate_output):
+            shapes = [feed.shape for feed in feeds.values()]
+            if actual.shape != expected_output.shape:
+                raise AssertionError(
+                    f"Output {i} of {model_path} has shape {actual.shape} instead of {expected_output.shape} "
+                    f"for inputs of shape {shapes}"
+                )
+            if not np.allclose(actual, expected_output, atol=atol):
+                raise AssertionError(
+                    f"Output {i} of {model_path} doesn't match the original model for inputs of shape {shapes}, "
+                    f"differing by up to {np.abs(actual - expected_output).max()}"
+                )
@@ -5,8 +5,9 @@ from tempfile import TemporaryDirectory
 
 import torch
 from huggingface_hub import create_repo, upload_folder
-from models import mclip, openclip
+from models import insightface, mclip, openclip
 from models.optimize import optimize
+from models.quantize import quantize_textual, quantize_visual
 from rich.progress import Progress
 
 models = [
@@ -50,6 +51,10 @@ models = [
     "ViT-L-16-SigLIP-384::webli",
     "ViT-SO400M-14-SigLIP-384::webli",
     "ViT-g-14::laion2b-s12b-b42k",
+    "antelopev2",
+    "buffalo_l",
+    "buffalo_m",
+    "buffalo_s",
     "nllb-clip-base-siglip::mrl",
     "nllb-clip-base-siglip::v1",
     "nllb-clip-large-siglip::mrl",
@@ -69,6 +74,8 @@ delete_patterns = ["**/*onnx*", "**/Constant*", "**/*.weight", "**/*.bias", f"**
 with Progress() as progress:
     task = progress.add_task("[green]Exporting models...", total=len(models))
     token = os.environ.get("HF_AUTH_TOKEN")
+    # local images to calibrate and validate INT8 visual models with. they aren't quantized without them
+    image_dir = os.environ.get("CALIBRATION_IMAGE_DIR")
     torch.backends.mha.set_fastpath_enabled(False)
     with TemporaryDirectory() as tmp:
         tmpdir = Path(tmp)
@@ -80,6 +87,12 @@ with Progress() as progress:
 
             def export() -> None:
                 progress.update(task, description=f"[green]Exporting {hf_model_name}")
+                if model in insightface.models:
+                    detection_dir = tmpdir / hf_model_name / "detection"
+                    recognition_dir = tmpdir / hf_model_name / "recognition"
+                    insightface.to_onnx(model, detection_dir, recognition_dir)
+                    return
+
                 visual_dir = tmpdir / hf_model_name / "visual"
                 textual_dir = tmpdir / hf_model_name / "textual"
                 if model.startswith("M-CLIP"):
@@ -92,6 +105,10 @@ with Progress() as progress:
                 optimize(visual_path)
                 progress.update(task, description=f"[green]Optimizing {hf_model_name} (textual)")
                 optimize(textual_path)
+                progress.update(task, description=f"[green]Quantizing {hf_model_name} (visual)")
+                quantize_visual(visual_path, image_dir)
+                progress.update(task, description=f"[green]Quantizing {hf_model_name} (textual)")
+                quantize_textual(textual_path)
 
                 gc.collect()
 
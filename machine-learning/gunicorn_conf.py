@@ -1,12 +1,44 @@
+import asyncio
+import gc
 import os
 
+import onnxruntime as ort
 from gunicorn.arbiter import Arbiter
 from gunicorn.workers.base import Worker
 
+import ann.ann
+from app.config import log, settings
+
 device_ids = os.environ.get("MACHINE_LEARNING_DEVICE_IDS", "0").replace(" ", "").split(",")
 env = os.environ
+GPU_PROVIDERS = {"CUDAExecutionProvider", "OpenVINOExecutionProvider"}
+
+# imports the app in the master process so that models loaded there are inherited by the workers
+preload_app = settings.share_preloaded_models and settings.preload is not None
 
 
 # Round-robin device assignment for each worker
 def pre_fork(arbiter: Arbiter, _: Worker) -> None:
     env["MACHINE_LEARNING_DEVICE_ID"] = device_ids[len(arbiter.WORKERS) % len(device_ids)]
+
+
+# Loads the preloaded models before forking so that their weights are shared copy-on-write between workers
+def when_ready(_: Arbiter) -> None:
+    if not preload_app or settings.preload is None:
+        return
+
+    # device contexts can't be shared across a fork
+    if (ann.ann.is_available and settings.ann) or set(ort.get_available_providers()) & GPU_PROVIDERS:
+        log.warning("Models can only be shared between workers when running on CPU. Loading them in each worker.")
+        return
+
+    from app.main import preload_models
+
+    # sessions must not start thread pools here, since the workers would inherit them without their threads.
+    # this limits the shared models to one thread per request for as long as they're loaded
+    asyncio.run(preload_models(settings.preload, inter_op_threads=1, intra_op_threads=1))
+
+    # avoids the garbage collector touching, and so copying, the inherited objects in each worker
+    gc.collect()
+    gc.freeze()
+    log.info("Loaded preloaded models before forking workers.")
@@ -0,0 +1,77 @@
+"""
+Compares the fused CLIP preprocessing in `resize_crop_normalize` against the previous PIL and NumPy chain.
+
+Run from the machine-learning directory with `python -m scripts.benchmark_clip_preprocess`.
+"""
+
+import timeit
+import tracemalloc
+from argparse import ArgumentParser
+from typing import Callable
+
+import numpy as np
+from numpy.typing import NDArray
+from PIL import Image
+
+from app.models.transforms import resize_crop_normalize
+
+# OpenAI CLIP normalization
+MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+
+
+def reference(image: Image.Image, size: int) -> NDArray[np.float32]:
+    if image.width < image.height:
+        new_size = (size, int((image.height / image.width) * size))
+    else:
+        new_size = (int((image.width / image.height) * size), size)
+    image = image.resize(new_size, resample=Image.Resampling.BICUBIC)
+    left, upper = int((image.width / 2) - (size / 2)), int((image.height / 2) - (size / 2))
+    image = image.crop((left, upper, left + size, upper + size))
+    image_np = (np.asarray(image, dtype=np.float32) / 255.0 - MEAN) / STD
+    return np.expand_dims(image_np.transpose(2, 0, 1), 0)
+
+
+def measure(name: str, func: Callable[[], object], iterations: int) -> float:
+    func()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    elapsed = min(timeit.repeat(func, number=iterations, repeat=3)) / iterations * 1000
+    print(f"{name:<32} {elapsed:8.2f} ms {peak / 2**20:8.2f} MiB peak allocated")
+    return elapsed
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--width", type=int, default=1440)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--size", type=int, default=224)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    image = Image.fromarray(pixels)
+    scale = (1 / (255 * STD)).astype(np.float32)
+    shift = (-MEAN / STD).astype(np.float32)
+    out = np.empty((1, 3, args.size, args.size), dtype=np.float32)
+
+    print(f"{args.width}x{args.height} image to {args.size}x{args.size}, {args.iterations} iterations")
+    baseline = measure("PIL + NumPy", lambda: reference(image, args.size), args.iterations)
+    fused = measure("fused", lambda: resize_crop_normalize(pixels, args.size, scale, shift, out[0]), args.iterations)
+    converted = measure(
+        "fused, including PIL to NumPy",
+        lambda: resize_crop_normalize(np.asarray(image), args.size, scale, shift, out[0]),
+        args.iterations,
+    )
+    print(f"speedup: {baseline / fused:.1f}x, {baseline / converted:.1f}x including conversion")
+
+    expected = reference(image, args.size)
+    resize_crop_normalize(pixels, args.size, scale, shift, out[0])
+    print(f"mean absolute difference: {np.abs(expected - out).mean():.4f}")
+
+
+if __name__ == "__main__":
+    main()